@@ -1,17 +1,46 @@
+from dataclasses import dataclass
 from datetime import datetime, timedelta
 from typing import Optional, Union
+import hashlib
+import os
+import time
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import HTTPException, status
+from .cache import TTLCache
 
-# パスワードハッシュ化の設定
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# パスワードハッシュ化の設定（BCRYPT_ROUNDS を変えると、ログイン時に新しいコストで再ハッシュする）
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# （needs_update は min_rounds〜max_rounds の範囲外だけを対象にするため、両方を同じ値にする）
+pwd_context = CryptContext(
+  schemes=["bcrypt"],
+  deprecated="auto",
+  bcrypt__rounds=BCRYPT_ROUNDS,
+  bcrypt__min_rounds=BCRYPT_ROUNDS,
+  bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
 
 # JWT設定
 SECRET_KEY = "your-secret-key-here"  # 本番環境では環境変数から取得
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+# 検証済みトークンと認証済みユーザーのキャッシュ
+# （ユーザー名の変更・削除時は invalidate_principal で破棄する）
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "60"))
+
+token_cache = TTLCache(maxsize=AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL, name="auth_token")
+principal_cache = TTLCache(maxsize=AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL, name="auth_principal")
+
+@dataclass(frozen=True)
+class Principal:
+  """認証済みユーザーの最小限の情報（id・shop_id だけ必要なルートは ORM を読み込まずに使う）"""
+  id: int
+  username: str
+  user_type: str
+  shop_id: Optional[int] = None
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
   """パスワードの検証"""
   return pwd_context.verify(plain_password, hashed_password)
@@ -42,3 +71,18 @@ def verify_token(token: str) -> dict:
       detail="Invalid authentication credentials",
       headers={"WWW-Authenticate": "Bearer"},
     )
+
+def verify_token_cached(token: str) -> dict:
+  """JWTトークンの検証（検証済みのトークンは有効期限までキャッシュ）"""
+  key = hashlib.sha256(token.encode()).hexdigest()
+  payload = token_cache.get(key)
+  if payload is None:
+    payload = verify_token(token)
+    remaining = payload.get("exp", 0) - time.time()
+    if remaining > 0:
+      token_cache.set(key, payload, ttl=min(AUTH_CACHE_TTL, remaining))
+  return payload
+
+def invalidate_principal(user_type: str, username: str) -> None:
+  """ユーザー情報の変更時にキャッシュ済みのユーザーを破棄"""
+  principal_cache.delete((user_type, username))
@@ -0,0 +1,130 @@
+"""店舗からのお知らせの一斉配信（ファンアウト）
+
+POST /notifications/broadcasts はジョブ（notification_broadcasts の行）を作成してすぐに返し、
+配信はリクエストの外のタスクで行う。配信先（店舗・メニューをお気に入り登録したユーザー）を
+user_id 順に BROADCAST_CHUNK_SIZE 件ずつ取り出し、通知を複数行の INSERT で作成する。
+1チャンクごとに進捗と一緒にコミットするため、テーブルを長くロックせず、
+プロセスが止まっても次に実行するワーカーが続きから配信する（同じユーザーに重複して届かない）。
+
+ジョブの実行権は条件付きの UPDATE で取得し、更新が BROADCAST_STALE_SECONDS 途絶えたジョブは
+他のワーカーが引き継ぐ。起動時と BROADCAST_POLL_INTERVAL ごとに未完了のジョブを探して実行する。
+"""
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from typing import Optional, Set
+
+from . import database, metrics, realtime
+from .cruds import notification_broadcast as broadcast_crud
+
+logger = logging.getLogger(__name__)
+
+BROADCAST_CHUNK_SIZE = int(os.getenv("BROADCAST_CHUNK_SIZE", "1000"))
+# チャンクの間に空ける秒数（他の書き込みに DB を譲る）
+BROADCAST_CHUNK_PAUSE = float(os.getenv("BROADCAST_CHUNK_PAUSE", "0.01"))
+# 1プロセスで同時に実行するジョブの数
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "2"))
+BROADCAST_STALE_SECONDS = float(os.getenv("BROADCAST_STALE_SECONDS", "60"))
+# 未完了のジョブ（他のワーカーで中断したものを含む）を探す間隔（0 で起動時のみ）
+BROADCAST_POLL_INTERVAL = float(os.getenv("BROADCAST_POLL_INTERVAL", "30"))
+
+CHUNK_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+delivered_notifications = metrics.counter("broadcast_notifications_delivered_total", "Notifications created by broadcasts")
+chunk_seconds = metrics.histogram("broadcast_chunk_seconds", "Time to deliver one broadcast chunk", buckets=CHUNK_BUCKETS)
+broadcasts_running = metrics.gauge("broadcasts_running", "Broadcast jobs running in this process")
+broadcasts_finished = metrics.counter("broadcasts_finished_total", "Broadcast jobs finished by this process", ["status"])
+
+# このプロセスを表す名前（実行権の持ち主として記録する）
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+_tasks: Set[asyncio.Task] = set()
+_running: Set[int] = set()
+_slots: Optional[asyncio.Semaphore] = None
+
+def _get_slots() -> asyncio.Semaphore:
+  global _slots
+  if _slots is None:
+    _slots = asyncio.Semaphore(BROADCAST_CONCURRENCY)
+  return _slots
+
+async def _run_sync(function, *args):
+  # expire_on_commit=False のセッションを使い回すと古い進捗を読むため、1回ごとに開き直す
+  async with database.AsyncSessionLocal() as db:
+    return await db.run_sync(function, *args)
+
+async def run_broadcast(broadcast_id: int) -> None:
+  """ジョブの実行権を取得できれば最後まで配信する"""
+  if broadcast_id in _running:
+    return
+  _running.add(broadcast_id)
+  try:
+    async with _get_slots():
+      if not await _run_sync(broadcast_crud.claim_broadcast, broadcast_id, WORKER_ID, BROADCAST_STALE_SECONDS):
+        return
+      broadcasts_running.inc()
+      try:
+        await _deliver(broadcast_id)
+      finally:
+        broadcasts_running.dec()
+  finally:
+    _running.discard(broadcast_id)
+
+async def _deliver(broadcast_id: int) -> None:
+  try:
+    total = await _run_sync(broadcast_crud.set_total, broadcast_id, WORKER_ID)
+    logger.info(f"お知らせ {broadcast_id} の配信を開始します（配信先 {total} 人）")
+    while True:
+      started = time.perf_counter()
+      notifications = await _run_sync(broadcast_crud.deliver_chunk, broadcast_id, WORKER_ID, BROADCAST_CHUNK_SIZE)
+      chunk_seconds.observe(time.perf_counter() - started)
+      if notifications is None:
+        logger.warning(f"お知らせ {broadcast_id} の配信は他のワーカーに引き継がれました")
+        return
+      if not notifications:
+        broadcasts_finished.inc(status="done")
+        logger.info(f"お知らせ {broadcast_id} の配信が完了しました")
+        return
+      delivered_notifications.inc(len(notifications))
+      # 接続中のユーザーにはすぐに届ける
+      await realtime.hub.publish_notifications(notifications)
+      await asyncio.sleep(BROADCAST_CHUNK_PAUSE)
+  except asyncio.CancelledError:
+    # 終了時に中断したジョブは、更新が途絶えた後に他のワーカーが続きから配信する
+    raise
+  except Exception as e:
+    logger.exception(f"お知らせ {broadcast_id} の配信に失敗しました")
+    broadcasts_finished.inc(status="failed")
+    await _run_sync(broadcast_crud.fail_broadcast, broadcast_id, WORKER_ID, str(e))
+
+def enqueue(broadcast_id: int) -> None:
+  """ジョブをこのプロセスのタスクとして開始（リクエストは完了を待たない）"""
+  task = asyncio.create_task(run_broadcast(broadcast_id))
+  _tasks.add(task)
+  task.add_done_callback(_tasks.discard)
+
+async def resume_pending() -> int:
+  """未着手・中断したジョブを開始し、その数を返す"""
+  broadcast_ids = await _run_sync(broadcast_crud.pending_broadcast_ids, BROADCAST_STALE_SECONDS)
+  for broadcast_id in broadcast_ids:
+    enqueue(broadcast_id)
+  return len(broadcast_ids)
+
+async def run_polling(interval: float = BROADCAST_POLL_INTERVAL) -> None:
+  """起動時と一定間隔で未完了のジョブを実行（起動時にタスクとして開始する）"""
+  while True:
+    try:
+      await resume_pending()
+    except Exception:
+      logger.exception("未完了のお知らせの確認に失敗しました")
+    if interval <= 0:
+      return
+    await asyncio.sleep(interval)
+
+async def shutdown() -> None:
+  for task in list(_tasks):
+    task.cancel()
+  await asyncio.gather(*_tasks, return_exceptions=True)
@@ -0,0 +1,236 @@
+"""キャッシュ
+
+- TTLCache: プロセス内のサイズ上限付き TTL キャッシュ
+- TieredCache: プロセス内キャッシュ + 共有キャッシュ（Redis 互換）の2段構成
+- SharedCache: 共有キャッシュ（redis.asyncio 互換のクライアント）の呼び出し（障害時は読み取りを一時停止）
+- InMemorySharedCache: Redis を使わない環境・テスト用の共有キャッシュの代替
+"""
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional
+
+from . import metrics
+
+_MISSING = object()
+
+cache_hits = metrics.counter("cache_hits_total", "Cache hits", ["cache", "tier"])
+cache_misses = metrics.counter("cache_misses_total", "Cache misses", ["cache"])
+cache_evictions = metrics.counter("cache_evictions_total", "Entries evicted to stay within maxsize", ["cache"])
+shared_cache_errors = metrics.counter("shared_cache_errors_total", "Failed calls to the shared cache", ["method"])
+
+# 共有キャッシュの読み取りに失敗した後、問い合わせを止める秒数
+SHARED_CACHE_RETRY_SECONDS = float(os.getenv("SHARED_CACHE_RETRY_SECONDS", "5"))
+
+class TTLCache:
+  """サイズ上限付きの TTL キャッシュ（上限を超えたら古いものから破棄）"""
+
+  def __init__(self, maxsize: int = 1024, ttl: float = 30.0, name: Optional[str] = None):
+    self.maxsize = maxsize
+    self.ttl = ttl
+    self.name = name
+    self._lock = threading.Lock()
+    self._data: "OrderedDict[Hashable, tuple]" = OrderedDict()
+
+  def get(self, key: Hashable, default: Any = None) -> Any:
+    """値を取得（期限切れ・未登録の場合は default）"""
+    with self._lock:
+      entry = self._data.get(key, _MISSING)
+      if entry is not _MISSING and entry[0] <= time.monotonic():
+        del self._data[key]
+        entry = _MISSING
+      if entry is _MISSING:
+        if self.name:
+          cache_misses.inc(cache=self.name)
+        return default
+      self._data.move_to_end(key)
+    if self.name:
+      cache_hits.inc(cache=self.name, tier="local")
+    return entry[1]
+
+  def set(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+    """値を登録"""
+    expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+    evicted = 0
+    with self._lock:
+      self._data[key] = (expires_at, value)
+      self._data.move_to_end(key)
+      while len(self._data) > self.maxsize:
+        self._data.popitem(last=False)
+        evicted += 1
+    if evicted and self.name:
+      cache_evictions.inc(evicted, cache=self.name)
+
+  def delete(self, key: Hashable) -> None:
+    """値を削除"""
+    with self._lock:
+      self._data.pop(key, None)
+
+  def clear(self) -> None:
+    """全て削除"""
+    with self._lock:
+      self._data.clear()
+
+  def __len__(self) -> int:
+    return len(self._data)
+
+class InMemorySharedCache:
+  """redis.asyncio の get / set / delete / incr だけを実装したプロセス内の代替"""
+
+  def __init__(self):
+    self._lock = threading.Lock()
+    self._data: Dict[str, tuple] = {}
+
+  async def get(self, key: str) -> Optional[str]:
+    with self._lock:
+      entry = self._data.get(key)
+      if entry is None:
+        return None
+      expires_at, value = entry
+      if expires_at is not None and expires_at <= time.monotonic():
+        del self._data[key]
+        return None
+      return value
+
+  async def set(self, key: str, value: str, ex: Optional[float] = None) -> None:
+    with self._lock:
+      self._data[key] = (time.monotonic() + ex if ex else None, value)
+
+  async def delete(self, *keys: str) -> int:
+    with self._lock:
+      return sum(self._data.pop(key, None) is not None for key in keys)
+
+  async def incr(self, key: str) -> int:
+    with self._lock:
+      entry = self._data.get(key)
+      value = int(entry[1]) + 1 if entry else 1
+      self._data[key] = (None, str(value))
+      return value
+
+class SharedCache:
+  """共有キャッシュのクライアント（redis.asyncio 互換）の呼び出し
+
+  イベントループを止めないよう非同期のクライアントだけを使う。障害でリクエストを失敗させず、
+  読み取りに失敗した後は SHARED_CACHE_RETRY_SECONDS の間だけ問い合わせを止めてプロセス内のキャッシュで処理する
+  （到達できない Redis のタイムアウトをリクエストごとに待たない）。破棄・世代番号の更新は常に送る。
+  """
+
+  def __init__(self, client, retry_seconds: float = SHARED_CACHE_RETRY_SECONDS):
+    self.client = client
+    self.retry_seconds = retry_seconds
+    self._retry_at = 0.0
+
+  def _failed(self, method: str) -> None:
+    shared_cache_errors.inc(method=method)
+    self._retry_at = time.monotonic() + self.retry_seconds
+
+  async def get(self, key: str) -> Optional[str]:
+    if time.monotonic() < self._retry_at:
+      return None
+    try:
+      return await self.client.get(key)
+    except Exception:
+      self._failed("get")
+      return None
+
+  async def set(self, key: str, value: str, ex: Optional[float] = None) -> None:
+    try:
+      await self.client.set(key, value, ex=ex)
+    except Exception:
+      self._failed("set")
+
+  async def delete(self, *keys: str) -> None:
+    try:
+      await self.client.delete(*keys)
+    except Exception:
+      self._failed("delete")
+
+  async def incr(self, key: str) -> Optional[int]:
+    try:
+      return await self.client.incr(key)
+    except Exception:
+      self._failed("incr")
+      return None
+
+def create_shared_cache(url: Optional[str]) -> Optional[SharedCache]:
+  """共有キャッシュを作成（url が memory:// ならプロセス内の代替、未設定なら None）"""
+  if not url:
+    return None
+  if url == "memory://":
+    return SharedCache(InMemorySharedCache())
+  try:
+    import redis.asyncio as redis
+  except ImportError as e:
+    raise RuntimeError("CACHE_REDIS_URL を使うには redis パッケージが必要です") from e
+  return SharedCache(redis.Redis.from_url(url, decode_responses=True, socket_timeout=0.1, socket_connect_timeout=0.1))
+
+class TieredCache:
+  """プロセス内キャッシュ + 共有キャッシュの2段構成のキャッシュ
+
+  値は JSON に変換できるものに限る。プロセス内の TTL は短くし、
+  他のワーカーでの更新が反映されるまでの遅れをその TTL 以内に抑える。
+  共有キャッシュを使うため、読み書き・破棄はいずれも非同期（イベントループ上の async 関数から await する）。
+  """
+
+  def __init__(self, name: str, local: TTLCache, shared: Optional[SharedCache] = None, shared_ttl: float = 60.0):
+    self.name = name
+    self.local = local
+    self.shared = shared
+    self.shared_ttl = shared_ttl
+    self._versions: Dict[str, int] = {}
+
+  async def get(self, key: str) -> Any:
+    value = self.local.get(key, _MISSING)
+    if value is not _MISSING:
+      return value
+    if self.shared is not None:
+      raw = await self.shared.get(f"{self.name}:{key}")
+      if raw is not None:
+        value = json.loads(raw)
+        self.local.set(key, value)
+        cache_hits.inc(cache=self.name, tier="shared")
+        return value
+    return None
+
+  async def set(self, key: str, value: Any) -> None:
+    self.local.set(key, value)
+    if self.shared is not None:
+      await self.shared.set(f"{self.name}:{key}", json.dumps(value), ex=self.shared_ttl)
+
+  async def delete(self, *keys: str) -> None:
+    for key in keys:
+      self.local.delete(key)
+    if self.shared is not None and keys:
+      await self.shared.delete(*[f"{self.name}:{key}" for key in keys])
+
+  async def version(self, namespace: str) -> int:
+    """一覧のキャッシュキーに含める世代番号"""
+    if self.shared is not None:
+      raw = await self.shared.get(f"{self.name}:{namespace}:version")
+      if raw is not None:
+        return int(raw)
+    return self._versions.get(namespace, 0)
+
+  async def bump(self, namespace: str) -> None:
+    """世代番号を進めて、その名前空間の一覧キャッシュをまとめて無効にする"""
+    self._versions[namespace] = self._versions.get(namespace, 0) + 1
+    if self.shared is not None:
+      await self.shared.incr(f"{self.name}:{namespace}:version")
+
+def query_key(**params) -> str:
+  """クエリパラメータを並び順に依存しないキーに変換"""
+  return "&".join(f"{name}={params[name]}" for name in sorted(params) if params[name] is not None)
+
+# GET /menu/{id}・/menus/{id}・/shops/{id}・/shops/ のレスポンスのキャッシュ
+response_cache = TieredCache(
+  "response",
+  TTLCache(
+    maxsize=int(os.getenv("RESPONSE_CACHE_SIZE", "4096")),
+    ttl=float(os.getenv("RESPONSE_CACHE_LOCAL_TTL", "5")),
+    name="response",
+  ),
+  shared=create_shared_cache(os.getenv("CACHE_REDIS_URL")),
+  shared_ttl=float(os.getenv("RESPONSE_CACHE_TTL", "60")),
+)
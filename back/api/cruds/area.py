@@ -1,17 +1,51 @@
+from collections import defaultdict
+from typing import Optional
+from sqlalchemy import func
 from sqlalchemy.orm import Session
 from ..models import area as area_model
 from ..models import shop as shop_model
 from ..models import menu as menu_model
 from ..schemas.shop import ShopWithMenus
+from .image_variant import attach_image_variants
 
-def get_menus_by_area(db: Session, area_id: int):
-  shops = db.query(shop_model.Shop).filter(shop_model.Shop.area_id == area_id).all()
+def get_menus_by_area(
+  db: Session,
+  area_id: int,
+  skip: int = 0,
+  limit: Optional[int] = None,
+  menus_per_shop: Optional[int] = None
+):
+  """エリア内の店舗ごとのメニューを取得（店舗とメニューの2回のクエリ、画像があれば派生画像の分を加えた3回で取得）"""
+  Shop = shop_model.Shop
+  Menu = menu_model.Menu
 
-  result = []
-  for shop in shops:
-    menus = db.query(menu_model.Menu).filter(menu_model.Menu.shop_id == shop.id).all()
-    result.append({
-      "shop_name": shop.name,
-      "menus": menus
-    })
-  return result
\ No newline at end of file
+  shop_query = db.query(Shop).filter(Shop.area_id == area_id).order_by(Shop.id).offset(skip)
+  if limit:
+    shop_query = shop_query.limit(limit)
+  shops = shop_query.all()
+  if not shops:
+    return []
+
+  shop_ids = [shop.id for shop in shops]
+  menu_query = db.query(Menu).filter(Menu.shop_id.in_(shop_ids))
+  if menus_per_shop:
+    # 店舗ごとに先頭 N 件のメニューだけを取得
+    row_number = func.row_number().over(partition_by=Menu.shop_id, order_by=Menu.id).label("row_number")
+    ranked = db.query(Menu.id, row_number).filter(Menu.shop_id.in_(shop_ids)).subquery()
+    menu_query = (
+      db.query(Menu)
+      .join(ranked, ranked.c.id == Menu.id)
+      .filter(ranked.c.row_number <= menus_per_shop)
+    )
+
+  menus = menu_query.order_by(Menu.shop_id, Menu.id).all()
+  # 画像のあるメニューがあれば、サムネイルの派生画像をまとめて取得
+  attach_image_variants(db, menus, "image_url", "thumb")
+  menus_by_shop = defaultdict(list)
+  for menu in menus:
+    menus_by_shop[menu.shop_id].append(menu)
+
+  return [
+    ShopWithMenus(id=shop.id, name=shop.name, menus=menus_by_shop[shop.id])
+    for shop in shops
+  ]
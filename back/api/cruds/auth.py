@@ -1,9 +1,11 @@
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from typing import Optional
+from typing import Optional, Union
+from .. import hashing
 from ..models.users import Users
 from ..models.shop_users import ShopUsers
 from ..schemas.auth import UserCreate, ShopUserCreate, UserUpdate
-from ..auth import get_password_hash, verify_password
+from ..auth import invalidate_principal
 
 def get_user_by_username(db: Session, username: str) -> Optional[Users]:
   """ユーザー名でユーザーを取得"""
@@ -13,9 +15,8 @@ def get_user_by_email(db: Session, email: str) -> Optional[Users]:
   """メールアドレスでユーザーを取得"""
   return db.query(Users).filter(Users.email == email).first()
 
-def create_user(db: Session, user: UserCreate) -> Users:
-  """新しいユーザーを作成"""
-  hashed_password = get_password_hash(user.password)
+def create_user(db: Session, user: UserCreate, hashed_password: str) -> Users:
+  """新しいユーザーを作成（パスワードは hashing.hash_password でハッシュ化済みのもの）"""
   db_user = Users(
       username=user.username,
       email=user.email,
@@ -27,14 +28,26 @@ def create_user(db: Session, user: UserCreate) -> Users:
   db.refresh(db_user)
   return db_user
 
-def authenticate_user(db: Session, email: str, password: str) -> Optional[Users]:
-  """ユーザー認証（メールアドレスでの認証）"""
-  user = get_user_by_email(db, email)
-  if not user:
+async def _verify_and_rehash(
+  db: AsyncSession, account: Union[Users, ShopUsers, None], password: str
+) -> Union[Users, ShopUsers, None]:
+  """パスワードを検証し、ハッシュのコスト設定が変わっていれば新しいハッシュで保存"""
+  if account is None:
     return None
-  if not verify_password(password, user.password_hash):
+  # 検証を待つ間に DB 接続を保持しないよう、先にトランザクションを終える
+  await db.commit()
+  valid, new_hash = await hashing.verify_password(password, account.password_hash)
+  if not valid:
     return None
-  return user
+  if new_hash:
+    account.password_hash = new_hash
+    await db.commit()
+  return account
+
+async def authenticate_user(db: AsyncSession, email: str, password: str) -> Optional[Users]:
+  """ユーザー認証（メールアドレスでの認証）"""
+  user = await db.run_sync(get_user_by_email, email)
+  return await _verify_and_rehash(db, user, password)
 
 def get_shop_user_by_username(db: Session, username: str) -> Optional[ShopUsers]:
   """ユーザー名で店舗ユーザーを取得"""
@@ -44,9 +57,8 @@ def get_shop_user_by_email(db: Session, email: str) -> Optional[ShopUsers]:
   """メールアドレスで店舗ユーザーを取得"""
   return db.query(ShopUsers).filter(ShopUsers.email == email).first()
 
-def create_shop_user(db: Session, shop_user: ShopUserCreate) -> ShopUsers:
-  """新しい店舗ユーザーを作成"""
-  hashed_password = get_password_hash(shop_user.password)
+def create_shop_user(db: Session, shop_user: ShopUserCreate, hashed_password: str) -> ShopUsers:
+  """新しい店舗ユーザーを作成（パスワードは hashing.hash_password でハッシュ化済みのもの）"""
   db_shop_user = ShopUsers(
     shop_id=shop_user.shop_id,
     username=shop_user.username,
@@ -58,14 +70,10 @@ def create_shop_user(db: Session, shop_user: ShopUserCreate) -> ShopUsers:
   db.refresh(db_shop_user)
   return db_shop_user
 
-def authenticate_shop_user(db: Session, username: str, password: str) -> Optional[ShopUsers]:
+async def authenticate_shop_user(db: AsyncSession, username: str, password: str) -> Optional[ShopUsers]:
   """店舗ユーザー認証"""
-  shop_user = get_shop_user_by_username(db, username)
-  if not shop_user:
-    return None
-  if not verify_password(password, shop_user.password_hash):
-    return None
-  return shop_user
+  shop_user = await db.run_sync(get_shop_user_by_username, username)
+  return await _verify_and_rehash(db, shop_user, password)
 
 def update_user(db: Session, user_id: int, user_update: UserUpdate) -> Optional[Users]:
   """ユーザー情報の更新"""
@@ -73,10 +81,12 @@ def update_user(db: Session, user_id: int, user_update: UserUpdate) -> Optional[
   if not db_user:
     return None
   
+  username = db_user.username
   update_data = user_update.model_dump(exclude_unset=True)
   for field, value in update_data.items():
     setattr(db_user, field, value)
   
   db.commit()
+  invalidate_principal("user", username)
   db.refresh(db_user)
   return db_user
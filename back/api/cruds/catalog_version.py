@@ -0,0 +1,34 @@
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+from typing import Iterable, Optional
+from ..models.catalog_version import CatalogVersion
+
+# メニュー全体の版のスコープ（店舗ごとの版は shop_scope）
+CATALOG_SCOPE = "menus"
+
+def shop_scope(shop_id: int) -> str:
+  return f"shop:{shop_id}"
+
+def bump_catalog_versions(db: Session, shop_ids: Iterable[Optional[int]]) -> None:
+  """メニュー全体と shop_ids の店舗の版を1つ進める（コミットは呼び出し側）
+
+  全体の行は全てのメニューの書き込みでロックするため、コミットの直前に呼んでロックを短くする。
+  行がなければ追加する。デッドロックを避けるため、常にスコープの順に更新する。
+  """
+  scopes = sorted({CATALOG_SCOPE, *(shop_scope(shop_id) for shop_id in shop_ids if shop_id is not None)})
+  rows = [{"scope": scope, "version": 1} for scope in scopes]
+  if db.get_bind().dialect.name == "mysql":
+    statement = mysql_insert(CatalogVersion).values(rows)
+    statement = statement.on_duplicate_key_update(version=CatalogVersion.version + 1)
+  else:
+    statement = sqlite_insert(CatalogVersion).values(rows)
+    statement = statement.on_conflict_do_update(
+      index_elements=[CatalogVersion.scope], set_={"version": CatalogVersion.version + 1}
+    )
+  db.execute(statement)
+
+def get_catalog_version(db: Session, shop_id: Optional[int] = None) -> int:
+  """メニュー全体（shop_id 指定時はその店舗）の版（主キーで1行読むだけ）"""
+  scope = CATALOG_SCOPE if shop_id is None else shop_scope(shop_id)
+  return db.query(CatalogVersion.version).filter(CatalogVersion.scope == scope).scalar() or 0
@@ -1,8 +1,12 @@
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from typing import List, Optional
+from typing import List, Optional, Tuple
+from ..database import run_on_primary
+from ..favorite_sets import FavoriteSet, shop_favorite_sets
 from ..models.favorites import Favorite
 from ..models.shop import Shop
 from ..schemas.favorites import FavoriteBase
+from .popularity import change_shop_favorite_count, record_shop_favorite_count
 
 def get_user_favorites(db: Session, user_id: int) -> List[Favorite]:
   """ユーザーのお気に入り一覧を取得"""
@@ -12,8 +16,16 @@ def get_user_favorite_shops(db: Session, user_id: int) -> List[Shop]:
   """ユーザーのお気に入り店舗一覧を取得"""
   return db.query(Shop).join(Favorite).filter(Favorite.user_id == user_id).all()
 
-def add_favorite(db: Session, user_id: int, shop_id: int) -> Favorite:
-  """お気に入りを追加"""
+def get_favorite_ids(db: Session, user_id: int) -> List[int]:
+  """ユーザーのお気に入り店舗の id（主キーだけを読み込む）"""
+  return [shop_id for (shop_id,) in db.query(Favorite.shop_id).filter(Favorite.user_id == user_id)]
+
+async def get_favorite_set(user_id: int) -> FavoriteSet:
+  """ユーザーのお気に入り店舗の id の集合（キャッシュになければプライマリから1回読み込む）"""
+  return await shop_favorite_sets.get(user_id, lambda: run_on_primary(get_favorite_ids, user_id))
+
+def _add_favorite(db: Session, user_id: int, shop_id: int) -> Tuple[Favorite, bool, Optional[Tuple[int, int]]]:
+  """お気に入りを追加し、(お気に入り, 追加したか, 変更後の (エリア id, お気に入り数)) を返す"""
   # 既に存在するかチェック
   existing = db.query(Favorite).filter(
       Favorite.user_id == user_id,
@@ -21,16 +33,26 @@ def add_favorite(db: Session, user_id: int, shop_id: int) -> Favorite:
   ).first()
   
   if existing:
-      return existing
+      return existing, False, None
   
   favorite = Favorite(user_id=user_id, shop_id=shop_id)
   db.add(favorite)
+  # お気に入り数も同じトランザクションで増やす
+  ranking_entry = change_shop_favorite_count(db, shop_id, 1)
   db.commit()
   db.refresh(favorite)
+  return favorite, True, ranking_entry
+
+async def add_favorite(db: AsyncSession, user_id: int, shop_id: int) -> Favorite:
+  """お気に入りを追加（コミット後にお気に入りの集合のキャッシュとランキングを更新）"""
+  favorite, created, ranking_entry = await db.run_sync(_add_favorite, user_id, shop_id)
+  if created:
+    await shop_favorite_sets.invalidate(user_id)
+    await record_shop_favorite_count(ranking_entry, shop_id)
   return favorite
 
-def remove_favorite(db: Session, user_id: int, shop_id: int) -> bool:
-  """お気に入りを削除"""
+def _remove_favorite(db: Session, user_id: int, shop_id: int) -> Tuple[bool, Optional[Tuple[int, int]]]:
+  """お気に入りを削除し、(削除したか, 変更後の (エリア id, お気に入り数)) を返す"""
   favorite = db.query(Favorite).filter(
       Favorite.user_id == user_id,
       Favorite.shop_id == shop_id
@@ -38,14 +60,19 @@ def remove_favorite(db: Session, user_id: int, shop_id: int) -> bool:
   
   if favorite:
       db.delete(favorite)
+      ranking_entry = change_shop_favorite_count(db, shop_id, -1)
       db.commit()
-      return True
-  return False
+      return True, ranking_entry
+  return False, None
+
+async def remove_favorite(db: AsyncSession, user_id: int, shop_id: int) -> bool:
+  """お気に入りを削除"""
+  removed, ranking_entry = await db.run_sync(_remove_favorite, user_id, shop_id)
+  if removed:
+    await shop_favorite_sets.invalidate(user_id)
+    await record_shop_favorite_count(ranking_entry, shop_id)
+  return removed
 
-def is_favorite(db: Session, user_id: int, shop_id: int) -> bool:
+async def is_favorite(user_id: int, shop_id: int) -> bool:
   """お気に入り状態を確認"""
-  favorite = db.query(Favorite).filter(
-      Favorite.user_id == user_id,
-      Favorite.shop_id == shop_id
-  ).first()
-  return favorite is not None
\ No newline at end of file
+  return shop_id in await get_favorite_set(user_id)
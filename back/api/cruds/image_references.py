@@ -0,0 +1,80 @@
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+import anyio
+from sqlalchemy import func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from ..image_store import IMAGE_GC_GRACE_SECONDS, image_store
+from ..models.image_variant import ImageVariant
+from ..models.menu import Menu
+from ..models.shop import Shop
+
+def count_image_references(db: Session, url: str) -> int:
+  """画像を参照しているメニュー・店舗の数"""
+  menus = db.query(func.count(Menu.id)).filter(Menu.image_url == url).scalar()
+  shops = db.query(func.count(Shop.id)).filter(Shop.image_path == url).scalar()
+  return menus + shops
+
+def referenced_image_urls(db: Session, urls: Iterable[str]) -> Set[str]:
+  """urls のうち、メニュー・店舗から参照されているもの"""
+  urls = {url for url in urls if url}
+  if not urls:
+    return set()
+  referenced = {url for (url,) in db.query(Menu.image_url).filter(Menu.image_url.in_(urls)).distinct()}
+  referenced.update(url for (url,) in db.query(Shop.image_path).filter(Shop.image_path.in_(urls)).distinct())
+  return referenced
+
+def delete_image_records(db: Session, urls: Iterable[str]) -> None:
+  """削除した画像の派生画像の記録を削除"""
+  urls = list(urls)
+  if urls:
+    db.query(ImageVariant).filter(ImageVariant.source_url.in_(urls)).delete(synchronize_session=False)
+    db.commit()
+
+async def retain_images(urls: Iterable[Optional[str]]) -> None:
+  """メニュー・店舗に登録する画像を削除の対象から外す（登録をコミットする前に呼ぶ）"""
+  paths = [image_store.path_for_url(url) for url in set(urls) if url]
+  paths = [path for path in paths if image_store.is_uploaded(path)]
+  if paths:
+    await anyio.to_thread.run_sync(lambda: [image_store.retain(path) for path in paths])
+
+async def remove_unreferenced_images(
+  db: AsyncSession, paths: Dict[str, Path], grace: float = IMAGE_GC_GRACE_SECONDS
+) -> Tuple[List[str], int]:
+  """{URL: パス} のうち参照されていない画像を削除し、(削除した URL, 解放したバイト数) を返す
+
+  ファイルの操作はスレッドで行う。参照の確認と削除の間にメニューの更新などで参照されないよう、
+  画像を claim してから別のトランザクションで参照を確認し直し、参照されていれば元に戻す。
+  """
+  referenced = await db.run_sync(referenced_image_urls, paths)
+  await db.commit()
+  released, freed = [], 0
+  for url, path in paths.items():
+    if url in referenced:
+      continue
+    claim = await anyio.to_thread.run_sync(image_store.claim, path, grace)
+    if claim is None:
+      continue
+    still_referenced = await db.run_sync(referenced_image_urls, [url])
+    # 次の確認で最新のコミットを読むよう、トランザクションを終える
+    await db.commit()
+    if still_referenced:
+      await anyio.to_thread.run_sync(image_store.restore, claim, path)
+      continue
+    size = await anyio.to_thread.run_sync(image_store.discard, claim, path)
+    if size:
+      released.append(url)
+      freed += size
+  await db.run_sync(delete_image_records, released)
+  return released, freed
+
+async def release_images(db: AsyncSession, urls: Iterable[Optional[str]]) -> None:
+  """メニュー・店舗の削除や画像の差し替えで参照が外れた画像を削除（コミット後に呼ぶ）
+
+  参照が残っている画像と、猶予期間内の画像（アップロード直後で登録前のものなど）は残し、
+  後者は定期的な掃除（images.sweep_images）に任せる。
+  """
+  paths = {url: image_store.path_for_url(url) for url in set(urls) if url}
+  paths = {url: path for url, path in paths.items() if image_store.is_content_addressed(path)}
+  if paths:
+    await remove_unreferenced_images(db, paths)
@@ -0,0 +1,60 @@
+from collections import defaultdict
+from typing import Dict, Iterable, List, Tuple
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from ..models.image_variant import ImageVariant
+from ..models.menu import Menu
+from ..models.shop import Shop
+from .catalog_version import bump_catalog_versions
+from .menu import invalidate_menu_responses, menu_count_cache
+from .shop import invalidate_shop_responses
+
+# 派生画像のサイズ（長辺の最大ピクセル数）
+VARIANT_SIZES = {"thumb": 160, "card": 480, "full": 1280}
+
+def get_image_variants(db: Session, source_urls: Iterable[str], size: str) -> Dict[str, Dict[str, str]]:
+  """元画像の URL ごとに、指定サイズの {形式: URL} を取得"""
+  urls = {url for url in source_urls if url}
+  if not urls:
+    return {}
+  rows = (
+    db.query(ImageVariant.source_url, ImageVariant.format, ImageVariant.url)
+    .filter(ImageVariant.source_url.in_(urls), ImageVariant.size == size)
+    .order_by(ImageVariant.source_url, ImageVariant.format)
+  )
+  variants = defaultdict(dict)
+  for source_url, format, url in rows:
+    variants[source_url][format] = url
+  return variants
+
+def attach_image_variants(db: Session, objects: List, attr: str, size: str) -> None:
+  """Menu・Shop の各オブジェクトに image_variants（指定サイズの {形式: URL}）を設定（1回のクエリ）"""
+  variants = get_image_variants(db, (getattr(obj, attr) for obj in objects), size)
+  for obj in objects:
+    obj.image_variants = variants.get(getattr(obj, attr), {})
+
+def record_image_variants(db: Session, source_url: str, variants: List[dict]) -> Tuple[List[int], List[int]]:
+  """生成した派生画像を記録し、その画像を使うメニュー・店舗の id を返す"""
+  db.query(ImageVariant).filter(ImageVariant.source_url == source_url).delete(synchronize_session=False)
+  db.add_all(ImageVariant(source_url=source_url, **variant) for variant in variants)
+  return _touch_image_users(db, source_url)
+
+async def invalidate_image_users(menu_ids: List[int], shop_ids: List[int]) -> None:
+  """派生画像を変更した画像を使うメニュー・店舗のキャッシュ済みのレスポンスを破棄"""
+  if menu_ids:
+    await invalidate_menu_responses(menu_ids)
+  if shop_ids:
+    await invalidate_shop_responses(shop_ids)
+
+def _touch_image_users(db: Session, source_url: str) -> Tuple[List[int], List[int]]:
+  # updated_at を進めて ETag・一覧の版を変える（レスポンスのキャッシュは invalidate_image_users で破棄する）
+  menus = db.query(Menu.id, Menu.shop_id).filter(Menu.image_url == source_url).all()
+  menu_ids = [menu_id for menu_id, _ in menus]
+  if menu_ids:
+    db.query(Menu).filter(Menu.id.in_(menu_ids)).update({Menu.updated_at: func.now()}, synchronize_session=False)
+    bump_catalog_versions(db, {shop_id for _, shop_id in menus})
+  shop_ids = [shop_id for (shop_id,) in db.query(Shop.id).filter(Shop.image_path == source_url)]
+  db.commit()
+  if menu_ids:
+    menu_count_cache.clear()
+  return menu_ids, shop_ids
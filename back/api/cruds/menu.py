@@ -1,8 +1,130 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import or_
-from typing import List, Optional
+from dataclasses import dataclass, field
+from datetime import datetime
+from sqlalchemy import Select, and_, func, insert, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Query, Session, joinedload
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Sequence, Set, Tuple
+import os
+from api import pagination
+from api.http_cache import make_etag
+from api.cache import TTLCache, response_cache
+from api.cruds.catalog_version import bump_catalog_versions, get_catalog_version
+from api.cruds.image_references import release_images, retain_images
 from api.models.menu import Menu
-from api.schemas.menu import MenuCreate, MenuUpdate
+from api.models.menu_departure import MenuDeparture
+from api.models.menu_tombstone import MenuTombstone
+from api.models.shop import Shop
+from api.search import menu_index
+from api.schemas.menu import MenuCreate, MenuResponse, MenuUpdate
+
+# 並び順ごとのソートキー（カーソルに使うため最後は id で一意にする）
+MENU_SORTS = {
+  "id": [(Menu.id, False)],
+  "newest": [(Menu.created_at, True), (Menu.id, True)],
+  "price_asc": [(Menu.price, False), (Menu.id, False)],
+  "price_desc": [(Menu.price, True), (Menu.id, True)],
+  # お気に入りの多い順（集計せずに favorite_count のインデックスで並べる）
+  "popular": [(Menu.favorite_count, True), (Menu.id, True)],
+}
+
+# 絞り込み条件ごとの総数のキャッシュ（メニューの更新時に破棄）
+menu_count_cache = TTLCache(
+  maxsize=int(os.getenv("MENU_COUNT_CACHE_SIZE", "1024")),
+  ttl=float(os.getenv("MENU_COUNT_CACHE_TTL", "30")),
+  name="menu_count",
+)
+
+def menu_response_key(menu_id: int) -> str:
+  """GET /menu/{id}・/menus/{id} のレスポンスのキャッシュキー"""
+  return f"menu:{menu_id}"
+
+async def invalidate_menu_responses(menu_ids: Iterable[int]) -> None:
+  """キャッシュ済みの GET /menu/{id}・/menus/{id} のレスポンスを破棄（コミット後に呼ぶ）"""
+  keys = [menu_response_key(menu_id) for menu_id in set(menu_ids)]
+  if keys:
+    await response_cache.delete(*keys)
+
+def menu_etag(values: dict) -> str:
+  """メニュー1件の ETag（MenuResponse の各項目の値から作成）
+
+  updated_at は秒単位のため、同じ秒の2回の更新でも内容が変われば ETag が変わるよう全項目から作る。
+  """
+  parts = (values.get(field) for field in MenuResponse.model_fields)
+  return make_etag("menu", *(sorted(part.items()) if isinstance(part, dict) else part for part in parts))
+
+# 一括取り込み・書き出しで1回に読み書きする行数
+MENU_BATCH_SIZE = 500
+
+@dataclass
+class MenuImportResult:
+  """一括取り込みの結果（バッチごとに追記し、finish_import で確定する）"""
+  created: int = 0
+  updated: int = 0
+  created_ids: Set[int] = field(default_factory=set)
+  updated_ids: List[int] = field(default_factory=list)
+  replaced_images: List[str] = field(default_factory=list)
+  # (行番号, エラー内容)
+  errors: List[Tuple[int, str]] = field(default_factory=list)
+
+def changed_since(since: datetime):
+  """since 以降に追加・更新されたメニューの条件（未更新の行は updated_at が NULL のため created_at で判定）"""
+  return or_(Menu.updated_at >= since, and_(Menu.updated_at.is_(None), Menu.created_at >= since))
+
+def menu_export_query(
+  fields: Sequence[str],
+  shop_id: Optional[int] = None,
+  area_id: Optional[int] = None,
+  category: Optional[str] = None,
+  since: Optional[datetime] = None
+) -> Select:
+  """書き出すメニューの列を id 順に取得するクエリ（ORM オブジェクトを作らずに行のまま読む）"""
+  query = select(*(getattr(Menu, field) for field in fields)).order_by(Menu.id)
+  if area_id is not None:
+    query = query.join(Shop, Shop.id == Menu.shop_id).where(Shop.area_id == area_id)
+  if shop_id is not None:
+    query = query.where(Menu.shop_id == shop_id)
+  if category:
+    query = query.where(Menu.category == category)
+  if since is not None:
+    # OR 条件と id 順の並び替えを同じ SELECT に書くと全件走査になるため、
+    # 変更のあった id をサブクエリで ix_menus_updated_created から引く
+    query = query.where(Menu.id.in_(select(Menu.id).where(changed_since(since))))
+  return query
+
+def menu_tombstone_query(since: datetime, shop_id: Optional[int] = None, area_id: Optional[int] = None) -> Select:
+  """since 以降に削除したメニューを取得するクエリ"""
+  query = select(MenuTombstone.menu_id, MenuTombstone.shop_id, MenuTombstone.deleted_at).order_by(MenuTombstone.menu_id)
+  if area_id is not None:
+    query = query.join(Shop, Shop.id == MenuTombstone.shop_id).where(Shop.area_id == area_id)
+  if shop_id is not None:
+    query = query.where(MenuTombstone.shop_id == shop_id)
+  return query.where(MenuTombstone.deleted_at >= since)
+
+def menu_departure_query(
+  since: datetime, shop_id: Optional[int] = None, area_id: Optional[int] = None, category: Optional[str] = None
+) -> Select:
+  """since 以降に絞り込みの条件から外れ、今も外れているメニューを取得するクエリ（削除の行として返す）
+
+  変更前の店舗・エリア・カテゴリーが条件に一致した記録を探す。条件に戻ったメニューは
+  追加・更新の行で返すため除く（削除の行は最後に送るため、残すと消えてしまう）。
+  削除したメニューは menu_tombstone_query で返すため、残っているメニューだけを対象にする。
+  """
+  query = select(
+    MenuDeparture.menu_id, Menu.shop_id, func.max(MenuDeparture.departed_at).label("deleted_at")
+  ).join(Menu, Menu.id == MenuDeparture.menu_id).where(MenuDeparture.departed_at >= since)
+  current = []
+  if shop_id is not None:
+    query = query.where(MenuDeparture.shop_id == shop_id)
+    current.append(Menu.shop_id == shop_id)
+  if area_id is not None:
+    query = query.where(MenuDeparture.area_id == area_id)
+    current.append(Menu.shop_id.in_(select(Shop.id).where(Shop.area_id == area_id)))
+  if category:
+    query = query.where(MenuDeparture.category == category)
+    current.append(Menu.category == category)
+  if current:
+    query = query.where(~and_(*current))
+  return query.group_by(MenuDeparture.menu_id, Menu.shop_id).order_by(MenuDeparture.menu_id)
 
 class MenuCRUD:
   def __init__(self, db: Session):
@@ -12,16 +134,15 @@ class MenuCRUD:
     """メニューの詳細を取得"""
     return self.db.query(Menu).filter(Menu.id == menu_id).first()
   
-  def get_menus(
-    self, 
-    skip: int = 0, 
-    limit: int = 10,
+  def _filtered_query(
+    self,
     category: Optional[str] = None,
     search: Optional[str] = None,
     shop_id: Optional[int] = None,
-    available_only: bool = True
-  ) -> List[Menu]:
-    """メニュー一覧を取得"""
+    available_only: bool = True,
+    rank: bool = True
+  ) -> Query:
+    """絞り込み条件を適用したクエリを作成"""
     query = self.db.query(Menu)
     
     if available_only:
@@ -34,68 +155,302 @@ class MenuCRUD:
       query = query.filter(Menu.shop_id == shop_id)
     
     if search:
-      query = query.filter(
-        or_(
-          Menu.name.contains(search),
-          Menu.description.contains(search)
-        )
-      )
+      query = menu_index.apply(query, search, rank=rank)
     
-    return query.offset(skip).limit(limit).all()
+    return query
   
-  def get_menus_count(
+  def get_menus_page(
     self,
+    skip: int = 0,
+    limit: int = 10,
     category: Optional[str] = None,
     search: Optional[str] = None,
     shop_id: Optional[int] = None,
-    available_only: bool = True
-  ) -> int:
-    """メニューの総数を取得"""
-    query = self.db.query(Menu)
+    available_only: bool = True,
+    sort: Optional[str] = None,
+    cursor: Optional[str] = None,
+    count: str = "none"
+  ) -> Tuple[List[Menu], Optional[int], Optional[str]]:
+    """メニュー一覧・総数・次ページのカーソルを取得
+
+    cursor を指定した場合は skip を使わずにカーソルの位置からシークする。
+    検索時に sort を指定しない場合は関連度順となり、カーソルは返さない。
+    count=exact の総数はキャッシュになければ COUNT(*) OVER() で一覧と同じクエリから取得する。
+    """
+    rank = bool(search) and sort is None and cursor is None
+    query = self._filtered_query(category, search, shop_id, available_only, rank=rank)
     
-    if available_only:
-      query = query.filter(Menu.is_available == True)
+    cache_key = (category, search, shop_id, available_only)
+    total = None
+    if count == "exact":
+      total = menu_count_cache.get(cache_key)
+    elif count == "estimate":
+      total = pagination.estimate_count(query)
     
-    if category:
-      query = query.filter(Menu.category == category)
+    # カーソル指定時はシーク後の件数になってしまうため、ウィンドウ関数は使わない
+    windowed = count == "exact" and total is None and not cursor
+    if windowed:
+      query = query.add_columns(func.count().over().label("total"))
     
-    if shop_id:
-      query = query.filter(Menu.shop_id == shop_id)
+    if rank:
+      rows = query.order_by(Menu.id).offset(skip).limit(limit).all()
+    else:
+      keys = MENU_SORTS[sort or "id"]
+      query = pagination.seek(query, keys, cursor)
+      if not cursor:
+        query = query.offset(skip)
+      rows = query.limit(limit + 1).all()
     
-    if search:
-      query = query.filter(
-        or_(
-          Menu.name.contains(search),
-          Menu.description.contains(search)
-        )
-      )
+    if windowed:
+      if rows:
+        total = rows[0].total
+      elif skip == 0:
+        total = 0
+      rows = [row.Menu for row in rows]
     
-    return query.count()
+    next_cursor = None
+    if not rank:
+      rows, next_cursor = pagination.split_page(rows, keys, limit)
+    
+    if count == "exact" and total is None:
+      total = self.get_menus_count(category, search, shop_id, available_only)
+    elif windowed:
+      menu_count_cache.set(cache_key, total)
+    
+    return rows, total, next_cursor
+  
+  def get_menus(
+    self, 
+    skip: int = 0, 
+    limit: int = 10,
+    category: Optional[str] = None,
+    search: Optional[str] = None,
+    shop_id: Optional[int] = None,
+    available_only: bool = True
+  ) -> List[Menu]:
+    """メニュー一覧を取得"""
+    menus, _, _ = self.get_menus_page(
+      skip=skip,
+      limit=limit,
+      category=category,
+      search=search,
+      shop_id=shop_id,
+      available_only=available_only
+    )
+    return menus
+  
+  def get_menus_count(
+    self,
+    category: Optional[str] = None,
+    search: Optional[str] = None,
+    shop_id: Optional[int] = None,
+    available_only: bool = True,
+    mode: str = "exact"
+  ) -> Optional[int]:
+    """メニューの総数を取得（mode: exact / estimate / none）"""
+    cache_key = (category, search, shop_id, available_only)
+    if mode == "exact":
+      total = menu_count_cache.get(cache_key)
+      if total is not None:
+        return total
+    query = self._filtered_query(category, search, shop_id, available_only, rank=False)
+    total = pagination.count(query, mode)
+    if mode == "exact":
+      menu_count_cache.set(cache_key, total)
+    return total
+  
+  def get_catalog_version(self, shop_id: Optional[int] = None) -> str:
+    """メニューの版。一覧の ETag に使う
+
+    メニューを集計せず、書き込みのたびに進める catalog_versions の行を主キーで読む。
+    読み取りと同じセッションで読むため、レプリカでも一覧の内容と版が食い違わない。
+    """
+    return str(get_catalog_version(self.db, shop_id))
+  
+  def import_menus(
+    self, shop_id: int, rows: List[Tuple[int, Optional[int], Dict]], result: MenuImportResult, write: bool = True
+  ) -> None:
+    """検証済みの行 (行番号, id, 値) をまとめて書き込む（コミットは finish_import で行う）
+
+    id のない行は複数行の INSERT でまとめて追加し、id のある行は自店舗の既存メニューを
+    主キー指定の一括 UPDATE で丸ごと置き換える。検索インデックスは確定時にまとめて更新する。
+    write=False では id の確認だけを行い、エラーを result に記録する。
+    """
+    ids = {menu_id for _, menu_id, _ in rows if menu_id is not None}
+    existing = {}
+    if ids:
+      existing = {
+        menu_id: (image_url, category)
+        for menu_id, image_url, category in self.db.query(Menu.id, Menu.image_url, Menu.category)
+        .filter(Menu.id.in_(ids), Menu.shop_id == shop_id)
+      }
+    inserts, updates, recategorized = [], [], []
+    for line, menu_id, values in rows:
+      if menu_id is None:
+        inserts.append(values)
+      elif menu_id in existing:
+        updates.append({"id": menu_id, **values})
+        image_url, category = existing[menu_id]
+        if image_url != values.get("image_url"):
+          result.replaced_images.append(image_url)
+        if category != values.get("category"):
+          recategorized.append((menu_id, category))
+      else:
+        result.errors.append((line, f"メニュー {menu_id} はこの店舗に存在しません"))
+    if not write:
+      return
+    
+    if inserts:
+      # MySQL は RETURNING を使えないため、追加前の最大 id より後の行を追加したメニューとみなす
+      max_id = self.db.query(func.max(Menu.id)).scalar() or 0
+      self.db.execute(insert(Menu), inserts)
+      result.created += len(inserts)
+      result.created_ids.update(
+        menu_id for (menu_id,) in self.db.query(Menu.id).filter(Menu.shop_id == shop_id, Menu.id > max_id)
+      )
+    if updates:
+      self.db.execute(update(Menu), updates)
+      result.updated += len(updates)
+      result.updated_ids.extend(values["id"] for values in updates)
+    if recategorized:
+      area_id = self.db.query(Shop.area_id).filter(Shop.id == shop_id).scalar()
+      self.db.execute(insert(MenuDeparture), [
+        {"menu_id": menu_id, "shop_id": shop_id, "area_id": area_id, "category": category}
+        for menu_id, category in recategorized
+      ])
+  
+  def finish_import(self, result: MenuImportResult, commit: bool = True) -> None:
+    """一括取り込みを確定（commit=False なら全て取り消す）"""
+    if not commit:
+      self.db.rollback()
+      return
+    ids = sorted(result.created_ids.union(result.updated_ids))
+    shop_ids = set()
+    for i in range(0, len(ids), MENU_BATCH_SIZE):
+      menus = (
+        self.db.query(Menu)
+        .filter(Menu.id.in_(ids[i:i + MENU_BATCH_SIZE]))
+        .options(joinedload(Menu.shop))
+        .populate_existing()
+        .all()
+      )
+      menu_index.index_many(self.db, menus)
+      shop_ids.update(menu.shop_id for menu in menus)
+    if ids:
+      bump_catalog_versions(self.db, shop_ids)
+    self.db.commit()
+    menu_count_cache.clear()
   
   def create_menu(self, menu: MenuCreate) -> Menu:
     """新しいメニューを作成"""
     db_menu = Menu(**menu.model_dump())
     self.db.add(db_menu)
+    self.db.flush()
+    menu_index.index(self.db, db_menu)
+    bump_catalog_versions(self.db, [db_menu.shop_id])
     self.db.commit()
+    menu_count_cache.clear()
     self.db.refresh(db_menu)
     return db_menu
   
-  def update_menu(self, menu_id: int, menu: MenuUpdate) -> Optional[Menu]:
-    """メニューを更新"""
+  def update_menu(self, menu_id: int, menu: MenuUpdate) -> Tuple[Optional[Menu], List[str]]:
+    """メニューを更新し、(メニュー, 参照が外れた画像の URL) を返す（画像の削除は呼び出し側で行う）"""
+    released = []
     db_menu = self.get_menu(menu_id)
     if db_menu:
+      old_image_url = db_menu.image_url
+      old_shop_id, old_category = db_menu.shop_id, db_menu.category
       update_data = menu.model_dump(exclude_unset=True)
       for field, value in update_data.items():
         setattr(db_menu, field, value)
+      if (db_menu.shop_id, db_menu.category) != (old_shop_id, old_category):
+        # 変更前の店舗・エリア・カテゴリーで絞り込んだ差分に、削除として伝える
+        self.db.add(MenuDeparture(
+          menu_id=menu_id, shop_id=old_shop_id, category=old_category,
+          area_id=self.db.query(Shop.area_id).filter(Shop.id == old_shop_id).scalar(),
+        ))
+      self.db.flush()
+      menu_index.index(self.db, db_menu)
+      bump_catalog_versions(self.db, [old_shop_id, db_menu.shop_id])
       self.db.commit()
+      menu_count_cache.clear()
+      if db_menu.image_url != old_image_url:
+        released.append(old_image_url)
       self.db.refresh(db_menu)
-    return db_menu
+    return db_menu, released
   
-  def delete_menu(self, menu_id: int) -> bool:
-    """メニューを削除"""
+  def delete_menu(self, menu_id: int) -> Tuple[bool, Optional[str]]:
+    """メニューを削除し、(削除したか, 参照が外れた画像の URL) を返す（画像の削除は呼び出し側で行う）"""
     db_menu = self.get_menu(menu_id)
     if db_menu:
+      image_url = db_menu.image_url
+      menu_index.remove(self.db, menu_id)
+      self.db.merge(MenuTombstone(menu_id=menu_id, shop_id=db_menu.shop_id))
       self.db.delete(db_menu)
+      bump_catalog_versions(self.db, [db_menu.shop_id])
       self.db.commit()
-      return True
-    return False
+      menu_count_cache.clear()
+      return True, image_url
+    return False, None
+
+class AsyncMenuCRUD:
+  """MenuCRUD の非同期版（AsyncSession.run_sync で同じ処理を実行し、書き込み後にレスポンスのキャッシュを破棄）"""
+  def __init__(self, db: AsyncSession):
+    self.db = db
+  
+  async def get_menu(self, menu_id: int) -> Optional[Menu]:
+    return await self.db.run_sync(lambda db: MenuCRUD(db).get_menu(menu_id))
+  
+  async def get_menus_page(self, **kwargs) -> Tuple[List[Menu], Optional[int], Optional[str]]:
+    return await self.db.run_sync(lambda db: MenuCRUD(db).get_menus_page(**kwargs))
+  
+  async def get_menus(self, **kwargs) -> List[Menu]:
+    return await self.db.run_sync(lambda db: MenuCRUD(db).get_menus(**kwargs))
+  
+  async def get_menus_count(self, **kwargs) -> Optional[int]:
+    return await self.db.run_sync(lambda db: MenuCRUD(db).get_menus_count(**kwargs))
+  
+  async def get_catalog_version(self, shop_id: Optional[int] = None) -> str:
+    return await self.db.run_sync(lambda db: MenuCRUD(db).get_catalog_version(shop_id))
+  
+  async def stream(self, query: Select, batch_size: int = MENU_BATCH_SIZE) -> AsyncIterator[Sequence]:
+    """クエリの結果をサーバーサイドカーソルで batch_size 行ずつ返す（全件をメモリに載せない）"""
+    result = await self.db.stream(query.execution_options(yield_per=batch_size))
+    async for rows in result.partitions():
+      yield rows
+  
+  async def get_database_time(self) -> datetime:
+    """DB サーバーの現在時刻（updated_at と同じ時計で差分の起点を決める）"""
+    return await self.db.scalar(select(func.now()))
+  
+  async def import_menus(
+    self, shop_id: int, rows: List[Tuple[int, Optional[int], Dict]], result: MenuImportResult, write: bool = True
+  ) -> None:
+    if write:
+      await retain_images(values.get("image_url") for _, _, values in rows)
+    return await self.db.run_sync(lambda db: MenuCRUD(db).import_menus(shop_id, rows, result, write))
+  
+  async def finish_import(self, result: MenuImportResult, commit: bool = True) -> None:
+    await self.db.run_sync(lambda db: MenuCRUD(db).finish_import(result, commit))
+    if commit:
+      await invalidate_menu_responses(result.updated_ids)
+      await release_images(self.db, result.replaced_images)
+  
+  async def create_menu(self, menu: MenuCreate) -> Menu:
+    await retain_images([menu.image_url])
+    return await self.db.run_sync(lambda db: MenuCRUD(db).create_menu(menu))
+  
+  async def update_menu(self, menu_id: int, menu: MenuUpdate) -> Optional[Menu]:
+    await retain_images([menu.image_url])
+    db_menu, released = await self.db.run_sync(lambda db: MenuCRUD(db).update_menu(menu_id, menu))
+    if db_menu is not None:
+      await invalidate_menu_responses([menu_id])
+      await release_images(self.db, released)
+    return db_menu
+  
+  async def delete_menu(self, menu_id: int) -> bool:
+    deleted, image_url = await self.db.run_sync(lambda db: MenuCRUD(db).delete_menu(menu_id))
+    if deleted:
+      await invalidate_menu_responses([menu_id])
+      await release_images(self.db, [image_url])
+    return deleted
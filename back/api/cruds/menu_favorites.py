@@ -1,6 +1,11 @@
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
+from typing import List, Optional, Tuple
+from ..database import run_on_primary
+from ..favorite_sets import FavoriteSet, menu_favorite_sets
 from ..models.menu_favorites import MenuFavorites
 from ..schemas.menu_favorites import MenuFavoritesBase
+from .popularity import change_menu_favorite_count, record_menu_favorite_count
 
 class MenuFavoritesCRUD:
     def __init__(self, db: Session):
@@ -19,22 +24,63 @@ class MenuFavoritesCRUD:
             MenuFavorites.user_id == user_id
         ).all()
     
-    def add_favorite(self, favorite: MenuFavoritesBase):
-        """お気に入りを追加"""
+    def get_favorite_ids(self, user_id: int) -> List[int]:
+        """ユーザーのお気に入りメニューの id（主キーだけを読み込む）"""
+        return [
+            menu_id for (menu_id,) in self.db.query(MenuFavorites.menu_id).filter(MenuFavorites.user_id == user_id)
+        ]
+    
+    def add_favorite(self, favorite: MenuFavoritesBase) -> Tuple[MenuFavorites, Optional[Tuple[int, int]]]:
+        """お気に入りを追加し、(お気に入り, 変更後の (エリア id, お気に入り数)) を返す"""
         db_favorite = MenuFavorites(
             user_id=favorite.user_id,
             menu_id=favorite.menu_id
         )
         self.db.add(db_favorite)
+        # お気に入り数も同じトランザクションで増やす
+        ranking_entry = change_menu_favorite_count(self.db, favorite.menu_id, 1)
         self.db.commit()
         self.db.refresh(db_favorite)
-        return db_favorite
+        return db_favorite, ranking_entry
     
-    def remove_favorite(self, user_id: int, menu_id: int):
-        """お気に入りを削除"""
+    def remove_favorite(self, user_id: int, menu_id: int) -> Tuple[bool, Optional[Tuple[int, int]]]:
+        """お気に入りを削除し、(削除したか, 変更後の (エリア id, お気に入り数)) を返す"""
         favorite = self.get_favorite(user_id, menu_id)
         if favorite:
             self.db.delete(favorite)
+            ranking_entry = change_menu_favorite_count(self.db, menu_id, -1)
             self.db.commit()
-            return True
-        return False
\ No newline at end of file
+            return True, ranking_entry
+        return False, None
+
+class AsyncMenuFavoritesCRUD:
+    """MenuFavoritesCRUD の非同期版（AsyncSession.run_sync で同じ処理を実行）"""
+    def __init__(self, db: AsyncSession):
+        self.db = db
+    
+    async def get_favorite(self, user_id: int, menu_id: int):
+        return await self.db.run_sync(lambda db: MenuFavoritesCRUD(db).get_favorite(user_id, menu_id))
+    
+    async def get_user_favorites(self, user_id: int):
+        return await self.db.run_sync(lambda db: MenuFavoritesCRUD(db).get_user_favorites(user_id))
+    
+    @staticmethod
+    async def get_favorite_set(user_id: int) -> FavoriteSet:
+        """ユーザーのお気に入りメニューの id の集合（キャッシュになければプライマリから1回読み込む。セッションは不要）"""
+        return await menu_favorite_sets.get(
+            user_id, lambda: run_on_primary(lambda db: MenuFavoritesCRUD(db).get_favorite_ids(user_id))
+        )
+    
+    async def add_favorite(self, favorite: MenuFavoritesBase) -> MenuFavorites:
+        """お気に入りを追加（コミット後にお気に入りの集合のキャッシュとランキングを更新）"""
+        db_favorite, ranking_entry = await self.db.run_sync(lambda db: MenuFavoritesCRUD(db).add_favorite(favorite))
+        await menu_favorite_sets.invalidate(favorite.user_id)
+        await record_menu_favorite_count(ranking_entry, favorite.menu_id)
+        return db_favorite
+    
+    async def remove_favorite(self, user_id: int, menu_id: int) -> bool:
+        removed, ranking_entry = await self.db.run_sync(lambda db: MenuFavoritesCRUD(db).remove_favorite(user_id, menu_id))
+        if removed:
+            await menu_favorite_sets.invalidate(user_id)
+            await record_menu_favorite_count(ranking_entry, menu_id)
+        return removed
@@ -1,7 +1,13 @@
+from sqlalchemy import func
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from ..models.notification import Notification
 from ..schemas.notification import NotificationCreate
-from typing import List, Optional
+from .. import pagination
+from typing import List, Optional, Sequence, Tuple
+
+# 受信箱は新しい順（同じ日時の通知は id で順序を決める）
+NOTIFICATION_SORT_KEYS = [(Notification.created_at, True), (Notification.id, True)]
 
 class NotificationCRUD:
   def __init__(self, db: Session):
@@ -9,19 +15,50 @@ class NotificationCRUD:
 
   # 通知を一件作成
   def create_notification(self, notification: NotificationCreate) -> Notification:
-    db_notification = Notification(**notification.dict())
+    db_notification = Notification(**notification.model_dump())
     self.db.add(db_notification)
     self.db.commit()
     self.db.refresh(db_notification)
     return db_notification
-  
-  # 指定ユーザーの通知一覧を取得
-  def get_user_notifications(self, user_id: int) -> List[Notification]:
-    return self.db.query(Notification).filter(Notification.user_id == user_id).all()
-
-  # 通知を既読に変更（個別）
-  def mark_as_read(self, notification_id: int) -> Optional[Notification]:
-    notification = self.db.query(Notification).filter(Notification.notification_id == notification_id).first()
+
+  # 指定ユーザーの通知を1ページ分取得（次ページのカーソル付き）
+  def get_inbox_page(
+    self,
+    user_id: int,
+    limit: int = 20,
+    cursor: Optional[str] = None,
+    status: Optional[str] = None
+  ) -> Tuple[List[Notification], Optional[str]]:
+    query = self.db.query(Notification).filter(Notification.user_id == user_id)
+    if status:
+      query = query.filter(Notification.status == status)
+    query = pagination.seek(query, NOTIFICATION_SORT_KEYS, cursor)
+    return pagination.fetch_page(query, NOTIFICATION_SORT_KEYS, limit)
+
+  # after_id より後の通知を古い順に limit 件（リアルタイム配信の再接続時に補う分）
+  def get_after(self, user_id: int, after_id: int, limit: int) -> List[Notification]:
+    return self.db.query(Notification).filter(
+      Notification.user_id == user_id,
+      Notification.id > after_id
+    ).order_by(Notification.id).limit(limit).all()
+
+  # ユーザーの最新の通知の id（通知がなければ 0）
+  def latest_id(self, user_id: int) -> int:
+    return self.db.query(func.max(Notification.id)).filter(Notification.user_id == user_id).scalar() or 0
+
+  # 未読の件数（(user_id, status) のインデックスだけで数える）
+  def count_unread(self, user_id: int) -> int:
+    return self.db.query(func.count(Notification.id)).filter(
+      Notification.user_id == user_id,
+      Notification.status == "unread"
+    ).scalar()
+
+  # 通知を既読に変更（個別、他のユーザーの通知は None）
+  def mark_as_read(self, user_id: int, notification_id: int) -> Optional[Notification]:
+    notification = self.db.query(Notification).filter(
+      Notification.id == notification_id,
+      Notification.user_id == user_id
+    ).first()
     if not notification:
       return None
     notification.status = "read"
@@ -29,10 +66,56 @@ class NotificationCRUD:
     self.db.refresh(notification)
     return notification
 
-  # 通知を既読に変更（一括）
-  def mark_all_as_read(self, user_id: int):
-    self.db.query(Notification).filter(
+  # 指定した通知をまとめて既読に変更（1回の UPDATE、既読にした件数を返す）
+  def mark_many_as_read(self, user_id: int, notification_ids: Sequence[int]) -> int:
+    updated = self.db.query(Notification).filter(
+      Notification.user_id == user_id,
+      Notification.id.in_(set(notification_ids)),
+      Notification.status == "unread"
+    ).update({"status": "read"}, synchronize_session=False)
+    self.db.commit()
+    return updated
+
+  # 通知を既読に変更（全件）
+  def mark_all_as_read(self, user_id: int) -> int:
+    updated = self.db.query(Notification).filter(
       Notification.user_id == user_id,
       Notification.status == "unread"
-    ).update({"status": "read"})
-    self.db.commit()
\ No newline at end of file
+    ).update({"status": "read"}, synchronize_session=False)
+    self.db.commit()
+    return updated
+
+class AsyncNotificationCRUD:
+  """NotificationCRUD の非同期版（AsyncSession.run_sync で同じ処理を実行）"""
+  def __init__(self, db: AsyncSession):
+    self.db = db
+
+  async def create_notification(self, notification: NotificationCreate) -> Notification:
+    return await self.db.run_sync(lambda db: NotificationCRUD(db).create_notification(notification))
+
+  async def get_inbox_page(
+    self,
+    user_id: int,
+    limit: int = 20,
+    cursor: Optional[str] = None,
+    status: Optional[str] = None
+  ) -> Tuple[List[Notification], Optional[str]]:
+    return await self.db.run_sync(lambda db: NotificationCRUD(db).get_inbox_page(user_id, limit, cursor, status))
+
+  async def get_after(self, user_id: int, after_id: int, limit: int) -> List[Notification]:
+    return await self.db.run_sync(lambda db: NotificationCRUD(db).get_after(user_id, after_id, limit))
+
+  async def latest_id(self, user_id: int) -> int:
+    return await self.db.run_sync(lambda db: NotificationCRUD(db).latest_id(user_id))
+
+  async def count_unread(self, user_id: int) -> int:
+    return await self.db.run_sync(lambda db: NotificationCRUD(db).count_unread(user_id))
+
+  async def mark_as_read(self, user_id: int, notification_id: int) -> Optional[Notification]:
+    return await self.db.run_sync(lambda db: NotificationCRUD(db).mark_as_read(user_id, notification_id))
+
+  async def mark_many_as_read(self, user_id: int, notification_ids: Sequence[int]) -> int:
+    return await self.db.run_sync(lambda db: NotificationCRUD(db).mark_many_as_read(user_id, notification_ids))
+
+  async def mark_all_as_read(self, user_id: int) -> int:
+    return await self.db.run_sync(lambda db: NotificationCRUD(db).mark_all_as_read(user_id))
@@ -0,0 +1,148 @@
+from datetime import datetime, timedelta
+from typing import List, Optional
+from sqlalchemy import func, insert, or_, select, union
+from sqlalchemy.orm import Session
+from ..models.favorites import Favorite
+from ..models.menu import Menu
+from ..models.menu_favorites import MenuFavorites
+from ..models.notification import Notification
+from ..models.notification_broadcast import NotificationBroadcast
+
+def _now() -> datetime:
+  return datetime.utcnow()
+
+def _shop_fans(shop_id: int, after: int = 0):
+  """店舗をお気に入り登録したユーザー（主キーを含む ix_favorites_shop_id を user_id 順にたどる）"""
+  return select(Favorite.user_id.label("user_id")).where(Favorite.shop_id == shop_id, Favorite.user_id > after)
+
+def _menu_fans(shop_id: int, after: int = 0):
+  """店舗のメニューをお気に入り登録したユーザー"""
+  return (
+    select(MenuFavorites.user_id.label("user_id"))
+    .join(Menu, Menu.id == MenuFavorites.menu_id)
+    .where(Menu.shop_id == shop_id, MenuFavorites.user_id > after)
+  )
+
+def count_recipients(db: Session, shop_id: int) -> int:
+  """配信先（店舗・メニューのどちらかをお気に入り登録したユーザー）の数"""
+  recipients = union(_shop_fans(shop_id), _menu_fans(shop_id)).subquery()
+  return db.execute(select(func.count()).select_from(recipients)).scalar()
+
+def recipient_ids(db: Session, shop_id: int, after: int, limit: int) -> List[int]:
+  """user_id が after より大きい配信先を user_id 順に limit 件
+
+  それぞれの取得元で先に limit 件に絞ってから重複を除くため、毎回全件を読まずに済む。
+  """
+  shop_fans = _shop_fans(shop_id, after).order_by(Favorite.user_id).limit(limit).subquery()
+  menu_fans = _menu_fans(shop_id, after).distinct().order_by(MenuFavorites.user_id).limit(limit).subquery()
+  recipients = union(select(shop_fans.c.user_id), select(menu_fans.c.user_id)).subquery()
+  query = select(recipients.c.user_id).order_by(recipients.c.user_id).limit(limit)
+  return list(db.execute(query).scalars())
+
+def create_broadcast(db: Session, shop_id: int, shop_user_id: Optional[int], contents: str) -> NotificationBroadcast:
+  broadcast = NotificationBroadcast(shop_id=shop_id, shop_user_id=shop_user_id, contents=contents, status="queued")
+  db.add(broadcast)
+  db.commit()
+  db.refresh(broadcast)
+  return broadcast
+
+def get_broadcast(db: Session, broadcast_id: int, shop_id: Optional[int] = None) -> Optional[NotificationBroadcast]:
+  query = db.query(NotificationBroadcast).filter(NotificationBroadcast.id == broadcast_id)
+  if shop_id is not None:
+    query = query.filter(NotificationBroadcast.shop_id == shop_id)
+  return query.first()
+
+def pending_broadcast_ids(db: Session, stale_seconds: float) -> List[int]:
+  """未着手のジョブと、実行中のまま更新が途絶えたジョブ"""
+  stale = _now() - timedelta(seconds=stale_seconds)
+  return [
+    broadcast_id for (broadcast_id,) in db.query(NotificationBroadcast.id).filter(or_(
+      NotificationBroadcast.status == "queued",
+      (NotificationBroadcast.status == "running") & (NotificationBroadcast.heartbeat_at < stale),
+    )).order_by(NotificationBroadcast.id)
+  ]
+
+def claim_broadcast(db: Session, broadcast_id: int, worker: str, stale_seconds: float) -> bool:
+  """ジョブの実行権を取得（他のワーカーが実行中なら False）
+
+  条件付きの UPDATE で取得するため、複数のワーカーが同時に取得しようとしても1つだけが成功する。
+  """
+  stale = _now() - timedelta(seconds=stale_seconds)
+  claimed = db.query(NotificationBroadcast).filter(
+    NotificationBroadcast.id == broadcast_id,
+    or_(
+      NotificationBroadcast.status == "queued",
+      (NotificationBroadcast.status == "running") & (NotificationBroadcast.heartbeat_at < stale),
+    ),
+  ).update({"status": "running", "worker": worker, "heartbeat_at": _now()}, synchronize_session=False)
+  db.commit()
+  return claimed == 1
+
+def set_total(db: Session, broadcast_id: int, worker: str) -> Optional[int]:
+  """配信先の数を記録（開始時に1回だけ数える）"""
+  broadcast = get_broadcast(db, broadcast_id)
+  if broadcast is None or broadcast.worker != worker:
+    return None
+  if broadcast.total is None:
+    broadcast.total = count_recipients(db, broadcast.shop_id)
+    db.commit()
+  return broadcast.total
+
+def deliver_chunk(db: Session, broadcast_id: int, worker: str, chunk_size: int) -> Optional[List[Notification]]:
+  """次の配信先 chunk_size 件に通知を作成し、進捗と同じトランザクションでコミット
+
+  作成した通知を返す（空なら完了）。実行権を他のワーカーに奪われていれば書き込まずに None を返す。
+  """
+  broadcast = get_broadcast(db, broadcast_id)
+  if broadcast is None or broadcast.worker != worker or broadcast.status != "running":
+    db.rollback()
+    return None
+  user_ids = recipient_ids(db, broadcast.shop_id, broadcast.last_user_id, chunk_size)
+  notifications: List[Notification] = []
+  if user_ids:
+    # 作成した通知を読み直すための境界（これより後に採番された id だけを探す）
+    floor = db.query(func.max(Notification.id)).scalar() or 0
+    # 複数行の INSERT にまとめて送る（MySQL では insertmanyvalues で 1 文になる）
+    db.execute(insert(Notification), [
+      {
+        "user_id": user_id,
+        "shop_id": broadcast.shop_id,
+        "shop_user_id": broadcast.shop_user_id,
+        "contents": broadcast.contents,
+        "status": "unread",
+      }
+      for user_id in user_ids
+    ])
+    # リアルタイム配信用に作成した通知を主キーの範囲で読む
+    notifications = db.query(Notification).filter(
+      Notification.id > floor,
+      Notification.user_id.in_(user_ids),
+      Notification.shop_id == broadcast.shop_id,
+      Notification.contents == broadcast.contents,
+    ).order_by(Notification.id).all()
+  values = {
+    "delivered": NotificationBroadcast.delivered + len(user_ids),
+    "heartbeat_at": _now(),
+  }
+  if user_ids:
+    values["last_user_id"] = user_ids[-1]
+  else:
+    values.update(status="done", finished_at=func.now())
+  # 読み込んだ後に実行権が移っていれば、通知も進捗も書き込まない
+  updated = db.query(NotificationBroadcast).filter(
+    NotificationBroadcast.id == broadcast_id,
+    NotificationBroadcast.worker == worker,
+    NotificationBroadcast.last_user_id == broadcast.last_user_id,
+  ).update(values, synchronize_session=False)
+  if updated != 1:
+    db.rollback()
+    return None
+  db.commit()
+  return notifications
+
+def fail_broadcast(db: Session, broadcast_id: int, worker: str, error: str) -> None:
+  db.query(NotificationBroadcast).filter(
+    NotificationBroadcast.id == broadcast_id,
+    NotificationBroadcast.worker == worker,
+  ).update({"status": "failed", "error": error[:255], "finished_at": func.now()}, synchronize_session=False)
+  db.commit()
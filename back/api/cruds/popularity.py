@@ -0,0 +1,93 @@
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from typing import List, Optional, Tuple
+from ..models.menu import Menu
+from ..models.shop import Shop
+from ..rankings import menu_rankings, shop_rankings
+from .image_variant import attach_image_variants
+
+def change_menu_favorite_count(db: Session, menu_id: int, delta: int) -> Optional[Tuple[int, int]]:
+  """メニューのお気に入り数を delta 増減し、(エリア id, 新しいお気に入り数) を返す
+
+  コミットは呼び出し側で行い、お気に入りの追加・削除と同じトランザクションにする。
+  お気に入り数の変更では updated_at を進めない（一覧の版・差分の書き出しに影響させない）。
+  """
+  query = db.query(Menu).filter(Menu.id == menu_id)
+  if delta < 0:
+    query = query.filter(Menu.favorite_count > 0)
+  query.update(
+    {Menu.favorite_count: Menu.favorite_count + delta, Menu.updated_at: Menu.updated_at}, synchronize_session=False
+  )
+  return db.query(Shop.area_id, Menu.favorite_count).join(Shop, Shop.id == Menu.shop_id).filter(Menu.id == menu_id).first()
+
+def change_shop_favorite_count(db: Session, shop_id: int, delta: int) -> Optional[Tuple[int, int]]:
+  """店舗のお気に入り数を delta 増減し、(エリア id, 新しいお気に入り数) を返す（コミットは呼び出し側）"""
+  query = db.query(Shop).filter(Shop.id == shop_id)
+  if delta < 0:
+    query = query.filter(Shop.favorite_count > 0)
+  query.update({Shop.favorite_count: Shop.favorite_count + delta}, synchronize_session=False)
+  return db.query(Shop.area_id, Shop.favorite_count).filter(Shop.id == shop_id).first()
+
+async def record_menu_favorite_count(entry: Optional[Tuple[int, int]], menu_id: int) -> None:
+  """コミット後に、変更後のお気に入り数をエリアのランキングに反映"""
+  if entry is not None:
+    area_id, count = entry
+    await menu_rankings.update(area_id, menu_id, count)
+
+async def record_shop_favorite_count(entry: Optional[Tuple[int, int]], shop_id: int) -> None:
+  if entry is not None:
+    area_id, count = entry
+    await shop_rankings.update(area_id, shop_id, count)
+
+def top_menus_query(db: Session, area_id: int, limit: int):
+  """エリアのメニューのお気に入り数の多い順（ランキングの作成用）"""
+  return (
+    db.query(Menu.id, Menu.favorite_count)
+    .join(Shop, Shop.id == Menu.shop_id)
+    .filter(Shop.area_id == area_id, Menu.is_available == True, Menu.favorite_count > 0)
+    .order_by(Menu.favorite_count.desc(), Menu.id.desc())
+    .limit(limit)
+  )
+
+def top_shops_query(db: Session, area_id: int, limit: int):
+  """エリアの店舗のお気に入り数の多い順（ix_shops_area_favorite_count を逆順にたどる）"""
+  return (
+    db.query(Shop.id, Shop.favorite_count)
+    .filter(Shop.area_id == area_id, Shop.favorite_count > 0)
+    .order_by(Shop.favorite_count.desc(), Shop.id.desc())
+    .limit(limit)
+  )
+
+def _in_ranking_order(rows: List, ids: List[int]) -> List:
+  by_id = {row.id: row for row in rows}
+  return [by_id[item_id] for item_id in ids if item_id in by_id]
+
+def _load_popular_menus(db: Session, ids: List[int], limit: int) -> List[Menu]:
+  # ランキングの作成後に販売終了・削除されたメニューは除く
+  menus = db.query(Menu).filter(Menu.id.in_(ids), Menu.is_available == True).all()
+  menus = _in_ranking_order(menus, ids)[:limit]
+  attach_image_variants(db, menus, "image_url", "card")
+  return menus
+
+def _load_popular_shops(db: Session, ids: List[int], limit: int) -> List[Shop]:
+  shops = _in_ranking_order(db.query(Shop).filter(Shop.id.in_(ids)).all(), ids)[:limit]
+  attach_image_variants(db, shops, "image_path", "card")
+  return shops
+
+async def get_popular_menus(db: AsyncSession, area_id: int, limit: int) -> List[Menu]:
+  """エリアのお気に入り数の多いメニュー（ランキングの id を主キーで読み込む）"""
+  ids = await menu_rankings.get(area_id, lambda capacity: db.run_sync(
+    lambda sync_db: [tuple(row) for row in top_menus_query(sync_db, area_id, capacity)]
+  ))
+  if not ids:
+    return []
+  return await db.run_sync(_load_popular_menus, ids, limit)
+
+async def get_popular_shops(db: AsyncSession, area_id: int, limit: int) -> List[Shop]:
+  """エリアのお気に入り数の多い店舗"""
+  ids = await shop_rankings.get(area_id, lambda capacity: db.run_sync(
+    lambda sync_db: [tuple(row) for row in top_shops_query(sync_db, area_id, capacity)]
+  ))
+  if not ids:
+    return []
+  return await db.run_sync(_load_popular_shops, ids, limit)
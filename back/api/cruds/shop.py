@@ -1,44 +1,132 @@
+from sqlalchemy import func, insert, literal, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
+from typing import Iterable, List, Optional, Tuple
+from .. import pagination
+from ..models.menu import Menu
+from ..models.menu_departure import MenuDeparture
 from ..models.shop import Shop
-from ..schemas.shop import ShopCreate, ShopUpdate
+from ..schemas.shop import ShopCreate, ShopRead, ShopUpdate
+from ..cache import response_cache
+from ..http_cache import make_etag
+from ..search import menu_index
+from .catalog_version import bump_catalog_versions
+from .image_references import release_images, retain_images
+from .menu import menu_count_cache, menu_response_key
+
+SHOP_SORT_KEYS = [(Shop.id, False)]
+SHOP_SORTS = {
+  "id": SHOP_SORT_KEYS,
+  # お気に入りの多い順（集計せずに favorite_count のインデックスで並べる）
+  "popular": [(Shop.favorite_count, True), (Shop.id, True)],
+}
+
+# GET /shops/ のレスポンスのキャッシュキーの名前空間（店舗の追加・更新・削除で世代を進める）
+SHOP_LIST_NAMESPACE = "shops"
+
+def shop_response_key(shop_id: int) -> str:
+  """GET /shops/{id} のレスポンスのキャッシュキー"""
+  return f"shop:{shop_id}"
+
+async def invalidate_shop_responses(shop_ids: Iterable[int] = (), menu_ids: Iterable[int] = ()) -> None:
+  """キャッシュ済みの店舗（と所属メニュー）のレスポンスを破棄し、GET /shops/ の世代を進める（コミット後に呼ぶ）"""
+  keys = [shop_response_key(shop_id) for shop_id in set(shop_ids)]
+  keys.extend(menu_response_key(menu_id) for menu_id in set(menu_ids))
+  if keys:
+    await response_cache.delete(*keys)
+  await response_cache.bump(SHOP_LIST_NAMESPACE)
+
+def shop_etag(values: dict) -> str:
+  """店舗1件の ETag（ShopRead の各項目の値から作成）"""
+  parts = (values.get(field) for field in ShopRead.model_fields)
+  return make_etag("shop", *(sorted(part.items()) if isinstance(part, dict) else part for part in parts))
 
 # ShopCreateのデータを受け取り、DBに新規登録
-def create_shop(db: Session, shop: ShopCreate):
+def _create_shop(db: Session, shop: ShopCreate):
   db_shop = Shop(**shop.dict())
   db.add(db_shop)
   db.commit()
   db.refresh(db_shop)
   return db_shop
 
+async def create_shop(db: AsyncSession, shop: ShopCreate):
+  await retain_images([shop.image_path])
+  db_shop = await db.run_sync(_create_shop, shop)
+  await invalidate_shop_responses()
+  return db_shop
+
 # 店舗一覧を取得（最大100件、任意のスキップ付き）
 def get_shops(db: Session, skip: int = 0, limit: int = 100):
   return db.query(Shop).offset(skip).limit(limit).all()
 
+# 店舗一覧と次ページのカーソルを取得（cursor 指定時は skip を使わずシーク）
+def get_shops_page(db: Session, skip: int = 0, limit: int = 100, cursor: Optional[str] = None, sort: Optional[str] = None):
+  keys = SHOP_SORTS[sort or "id"]
+  query = pagination.seek(db.query(Shop), keys, cursor)
+  if not cursor:
+    query = query.offset(skip)
+  return pagination.fetch_page(query, keys, limit)
+
 # 特定のIDの店舗を一件取得
 def get_shop_by_id(db: Session, shop_id: int):
   return db.query(Shop).filter(Shop.id == shop_id).first()
 
-# 店舗情報の更新
-def update_shop(db: Session, shop_id, shop_update: ShopUpdate):
+# 店舗情報の更新（更新した店舗と、参照が外れた画像の URL を返す）
+def _update_shop(db: Session, shop_id, shop_update: ShopUpdate) -> Tuple[Optional[Shop], List[str]]:
   db_shop = db.query(Shop).filter(Shop.id == shop_id).first()
   if not db_shop:
-    return None   # NotFound対応
+    return None, []   # NotFound対応
   
+  old_image_path = db_shop.image_path
+  old_area_id = db_shop.area_id
   for key, value in shop_update.dict().items():
     setattr(db_shop, key, value)    # モデルの各属性に新しい値を代入
 
+  # エリアが変わると所属メニューは変更前のエリアの絞り込みから外れ、変更後のエリアの差分に加わる
+  if db_shop.area_id != old_area_id:
+    db.execute(insert(MenuDeparture).from_select(
+      ["menu_id", "shop_id", "area_id", "category"],
+      select(Menu.id, Menu.shop_id, literal(old_area_id), Menu.category).where(Menu.shop_id == shop_id),
+    ))
+    db.query(Menu).filter(Menu.shop_id == shop_id).update({Menu.updated_at: func.now()}, synchronize_session=False)
+
+  # 店舗名は検索ドキュメントに含まれるため、所属メニューを再インデックス
+  for menu in db_shop.menus:
+    menu_index.index(db, menu)
+
   db.commit()
+  menu_count_cache.clear()
+  released = [old_image_path] if db_shop.image_path != old_image_path else []
   db.refresh(db_shop)
+  return db_shop, released
+
+async def update_shop(db: AsyncSession, shop_id: int, shop_update: ShopUpdate):
+  await retain_images([shop_update.image_path])
+  db_shop, released = await db.run_sync(_update_shop, shop_id, shop_update)
+  if db_shop is not None:
+    await invalidate_shop_responses([shop_id])
+    await release_images(db, released)
   return db_shop
 
-# 店舗情報の削除
-def delete_shop(db: Session, shop_id: int):
+# 店舗情報の削除（削除した店舗、所属していたメニューの id、店舗の画像の URL を返す）
+def _delete_shop(db: Session, shop_id: int) -> Tuple[Optional[Shop], List[int], Optional[str]]:
   db_shop = db.query(Shop).filter(Shop.id == shop_id).first()
   if not db_shop:
-    return None
+    return None, [], None
 
+  # 所属メニューの shop_id も変わるため、メニューのキャッシュも破棄する
+  menu_ids = [menu.id for menu in db_shop.menus]
+  image_path = db_shop.image_path
   db.delete(db_shop)
+  if menu_ids:
+    bump_catalog_versions(db, [shop_id])
   db.commit()
-  return db_shop
-  db.commit()
+  menu_count_cache.clear()
+  return db_shop, menu_ids, image_path
+
+async def delete_shop(db: AsyncSession, shop_id: int):
+  db_shop, menu_ids, image_path = await db.run_sync(_delete_shop, shop_id)
+  if db_shop is not None:
+    await invalidate_shop_responses([shop_id], menu_ids)
+    await release_images(db, [image_path])
   return db_shop
\ No newline at end of file
@@ -1,5 +1,6 @@
 from sqlalchemy.orm import Session
 from typing import Optional
+from ..auth import invalidate_principal
 from ..models.shop_users import ShopUsers
 
 class ShopUsersCRUD:
@@ -26,9 +27,11 @@ class ShopUsersCRUD:
     db_shop_user = self.get_shop_user(shop_user_id)
 
     if db_shop_user:
+      username = db_shop_user.username
       for field, value in shop_user.model_dump(exclude_unset=True).items():
         setattr(db_shop_user, field, value)
       self.db.commit()
+      invalidate_principal("shop_user", username)
       self.db.refresh(db_shop_user)
       return db_shop_user
     return None
@@ -37,8 +40,10 @@ class ShopUsersCRUD:
     db_shop_user = self.get_shop_user(shop_user_id)
 
     if db_shop_user:
+      username = db_shop_user.username
       self.db.delete(db_shop_user)
       self.db.commit()
+      invalidate_principal("shop_user", username)
       return True
     return False
   
\ No newline at end of file
@@ -1,5 +1,6 @@
 from sqlalchemy.orm import Session
 from typing import Optional
+from ..auth import invalidate_principal
 from ..models.users import Users
 from ..schemas.users import UserCreate, UserUpdate
 
@@ -29,9 +30,11 @@ class UsersCRUD:
     db_user = self.get_user(user_id)
 
     if db_user:
+      username = db_user.username
       for field, value in user.model_dump(exclude_unset=True).items():
         setattr(db_user, field, value)
       self.db.commit()
+      invalidate_principal("user", username)
       self.db.refresh(db_user)
       return db_user
   
@@ -39,7 +42,9 @@ class UsersCRUD:
   def delete_user(self, user_id: int) -> bool:
     db_user = self.get_user(user_id)
     if db_user:
+      username = db_user.username
       self.db.delete(db_user)
       self.db.commit()
+      invalidate_principal("user", username)
       return True
     return False
@@ -1,35 +1,98 @@
 from sqlalchemy import create_engine
+from sqlalchemy.engine import URL, make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import os
+from typing import Union
 from dotenv import load_dotenv
 
 load_dotenv()
 
+from fastapi import Request
+from .pool import POOL_SETTINGS, InstrumentedAsyncQueuePool, InstrumentedQueuePool, instrument_engine
+from .query_stats import instrument_queries
+from .routing import Replica, ReplicaSet, prefers_primary, replica_reads
+
 MYSQL_USER = os.getenv("MYSQL_USER", "root")
 MYSQL_PASSWORD = os.getenv("MYSQL_PASSWORD", "password")
 MYSQL_HOST = os.getenv("MYSQL_HOST", "db")
 MYSQL_PORT = os.getenv("MYSQL_PORT", "3306")
 MYSQL_DATABASE = os.getenv("MYSQL_DATABASE", "menu_app")
 
-SQLALCHEMY_DATABASE_URL = f"mysql+pymysql://{MYSQL_USER}:{MYSQL_PASSWORD}@{MYSQL_HOST}:{MYSQL_PORT}/{MYSQL_DATABASE}?charset=utf8mb4"
-
-engine = create_engine(
-  SQLALCHEMY_DATABASE_URL,
-  echo=False,
-  pool_pre_ping=True,
-  pool_recycle=300,
-  pool_timeout=20,
-  max_overflow=0,
-  pool_size=5,
-  connect_args={
-    "connect_timeout": 60,
-    "read_timeout": 30,
-    "write_timeout": 30,
-  }
-)
+# 読み取りレプリカ（"host:port" のカンマ区切り、未設定ならプライマリのみ）
+MYSQL_REPLICA_HOSTS = [host.strip() for host in os.getenv("MYSQL_REPLICA_HOSTS", "").split(",") if host.strip()]
+# 接続先を URL で指定する場合（SQLite のスタンドインなど）。DATABASE_REPLICA_URLS は MYSQL_REPLICA_HOSTS に追加される
+DATABASE_URL = os.getenv("DATABASE_URL", "")
+DATABASE_REPLICA_URLS = [url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",") if url.strip()]
+
+# 同期ドライバーの URL から非同期ルート用のドライバーを決める
+ASYNC_DRIVERS = {"mysql": "mysql+aiomysql", "sqlite": "sqlite+aiosqlite"}
+
+def database_url(driver: str, host: str = MYSQL_HOST, port: str = MYSQL_PORT) -> str:
+  return f"mysql+{driver}://{MYSQL_USER}:{MYSQL_PASSWORD}@{host}:{port}/{MYSQL_DATABASE}?charset=utf8mb4"
+
+def async_database_url(url: Union[str, URL]) -> URL:
+  """同期ドライバーの URL を非同期ドライバーの URL に変換（mysql+pymysql → mysql+aiomysql など）"""
+  url = make_url(url)
+  return url.set(drivername=ASYNC_DRIVERS[url.get_backend_name()])
+
+def _connect_args(url: Union[str, URL], is_async: bool) -> dict:
+  backend = make_url(url).get_backend_name()
+  if backend == "mysql":
+    return {"connect_timeout": 60} if is_async else {"connect_timeout": 60, "read_timeout": 30, "write_timeout": 30}
+  if backend == "sqlite" and not is_async:
+    # プールの接続をスレッドプールの各ワーカーで使い回す
+    return {"check_same_thread": False}
+  return {}
+
+SQLALCHEMY_DATABASE_URL = DATABASE_URL or database_url("pymysql")
+ASYNC_SQLALCHEMY_DATABASE_URL = async_database_url(SQLALCHEMY_DATABASE_URL)
+
+# プールの設定は DB_POOL_SIZE / DB_MAX_OVERFLOW などの環境変数で調整する（api/pool.py）
+def build_engine(url: Union[str, URL], name: str):
+  sync_engine = create_engine(
+    url,
+    echo=False,
+    poolclass=InstrumentedQueuePool,
+    **POOL_SETTINGS,
+    connect_args=_connect_args(url, is_async=False)
+  )
+  instrument_engine(sync_engine, name)
+  instrument_queries(sync_engine)
+  return sync_engine
+
+# 非同期ルート用のエンジン（DB 待ちの間もスレッドプールのワーカーを占有しない）
+def build_async_engine(url: Union[str, URL], name: str):
+  engine_async = create_async_engine(
+    url,
+    echo=False,
+    poolclass=InstrumentedAsyncQueuePool,
+    **POOL_SETTINGS,
+    connect_args=_connect_args(url, is_async=True)
+  )
+  instrument_engine(engine_async.sync_engine, f"{name}_async")
+  instrument_queries(engine_async.sync_engine)
+  return engine_async
+
+engine = build_engine(SQLALCHEMY_DATABASE_URL, "primary")
+async_engine = build_async_engine(ASYNC_SQLALCHEMY_DATABASE_URL, "primary")
+
+def _create_replica(index: int, url: str) -> Replica:
+  name = f"replica{index}"
+  return Replica(name, build_engine(url, name), build_async_engine(async_database_url(url), name))
+
+def _replica_urls():
+  for host_port in MYSQL_REPLICA_HOSTS:
+    host, _, port = host_port.partition(":")
+    yield database_url("pymysql", host, port or "3306")
+  yield from DATABASE_REPLICA_URLS
+
+replicas = ReplicaSet(_create_replica(i, url) for i, url in enumerate(_replica_urls(), start=1))
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# コミット後もレスポンスの組み立てで属性を参照できるよう expire_on_commit=False にする
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
 
 Base = declarative_base()
 
@@ -39,3 +102,39 @@ def get_db():
     yield db
   finally:
     db.close()
+
+async def get_async_db():
+  async with AsyncSessionLocal() as db:
+    yield db
+
+async def run_on_primary(fn, *args):
+  """プライマリの新しいセッションで fn(session, *args) を実行
+
+  キャッシュに保存する読み取り用。レプリカから読むと、書き込み直後に遅れた内容を新しい版で保存してしまう。
+  """
+  async with AsyncSessionLocal() as db:
+    return await db.run_sync(fn, *args)
+
+async def _choose_replica(request: Request):
+  """読み取りに使うレプリカを選ぶ（プライマリを使う場合は None）"""
+  replica = None
+  if replicas and not await prefers_primary(request.headers):
+    replica = replicas.choose()
+  replica_reads.inc(target=replica.name if replica else "primary")
+  return replica
+
+async def get_read_db(request: Request):
+  """読み取り専用のセッション（レプリカがあればレプリカに接続）"""
+  replica = await _choose_replica(request)
+  db = (replica.session_factory if replica else SessionLocal)()
+  try:
+    yield db
+  finally:
+    db.close()
+
+async def get_async_read_db(request: Request):
+  """読み取り専用の非同期セッション（レプリカがあればレプリカに接続）"""
+  replica = await _choose_replica(request)
+  factory = replica.async_session_factory if replica else AsyncSessionLocal
+  async with factory() as db:
+    yield db
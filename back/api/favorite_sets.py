@@ -0,0 +1,78 @@
+"""ユーザーごとのお気に入りの集合のキャッシュ
+
+一覧のカードごとにお気に入りかどうかを問い合わせる代わりに、ユーザーのお気に入りの id を
+1回で読み込み、昇順の array（1件 4 バイト）として保持して二分探索で判定する。
+追加・削除時は invalidate で破棄する。CACHE_REDIS_URL を設定している場合は共有キャッシュの
+世代番号で他のワーカーにも伝わり、未設定の場合は FAVORITE_SET_CACHE_TTL 以内に反映される。
+"""
+import os
+import zlib
+from array import array
+from bisect import bisect_left
+from typing import Awaitable, Callable, Dict, Iterable, Optional
+
+from .cache import SharedCache, TTLCache, response_cache
+
+FAVORITE_SET_CACHE_SIZE = int(os.getenv("FAVORITE_SET_CACHE_SIZE", "10000"))
+FAVORITE_SET_CACHE_TTL = float(os.getenv("FAVORITE_SET_CACHE_TTL", "60"))
+
+class FavoriteSet:
+  """お気に入りの id の集合（昇順の配列）"""
+  __slots__ = ("ids", "_digest")
+
+  def __init__(self, ids: Iterable[int]):
+    self.ids = array("I", sorted(set(ids)))
+    self._digest: Optional[int] = None
+
+  def __contains__(self, item_id: int) -> bool:
+    index = bisect_left(self.ids, item_id)
+    return index < len(self.ids) and self.ids[index] == item_id
+
+  def __len__(self) -> int:
+    return len(self.ids)
+
+  def statuses(self, item_ids: Iterable[int]) -> Dict[int, bool]:
+    return {item_id: item_id in self for item_id in item_ids}
+
+  @property
+  def digest(self) -> str:
+    """集合の内容から決まる値（ユーザーごとの ETag に含める）"""
+    if self._digest is None:
+      self._digest = zlib.crc32(self.ids.tobytes())
+    return f"{len(self.ids)}-{self._digest:08x}"
+
+class FavoriteSetCache:
+  """ユーザー id → FavoriteSet のキャッシュ"""
+
+  def __init__(
+    self, name: str, maxsize: int = FAVORITE_SET_CACHE_SIZE, ttl: float = FAVORITE_SET_CACHE_TTL,
+    shared: Optional[SharedCache] = None
+  ):
+    self.name = name
+    self.local = TTLCache(maxsize=maxsize, ttl=ttl, name=name)
+    self.shared = shared
+
+  async def _version(self, user_id: int) -> int:
+    if self.shared is None:
+      return 0
+    # 共有キャッシュの障害時は None になり、プロセス内のキャッシュだけで判定する
+    return int(await self.shared.get(f"{self.name}:{user_id}:version") or 0)
+
+  async def get(self, user_id: int, load: Callable[[], Awaitable[Iterable[int]]]) -> FavoriteSet:
+    """ユーザーのお気に入りの集合（なければ await load() で読み込む）"""
+    version = await self._version(user_id)
+    entry = self.local.get(user_id)
+    if entry is not None and entry[0] == version:
+      return entry[1]
+    favorite_set = FavoriteSet(await load())
+    self.local.set(user_id, (version, favorite_set))
+    return favorite_set
+
+  async def invalidate(self, user_id: int) -> None:
+    self.local.delete(user_id)
+    if self.shared is not None:
+      await self.shared.incr(f"{self.name}:{user_id}:version")
+
+# 共有キャッシュはレスポンスのキャッシュと同じもの（CACHE_REDIS_URL）を使う
+menu_favorite_sets = FavoriteSetCache("menu_favorite_sets", shared=response_cache.shared)
+shop_favorite_sets = FavoriteSetCache("shop_favorite_sets", shared=response_cache.shared)
@@ -0,0 +1,89 @@
+"""パスワードハッシュの実行プール
+
+bcrypt のハッシュ化・検証を専用のプロセスプールで実行し、イベントループと
+他のルートが使うスレッドプールを塞がないようにする。同時実行数は
+PASSWORD_HASH_CONCURRENCY で制限し、待ちが PASSWORD_HASH_MAX_QUEUE を超えたら 503 を返す。
+"""
+import asyncio
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Tuple
+
+from fastapi import HTTPException, status
+
+from . import metrics
+from .auth import pwd_context
+
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(os.cpu_count() or 1, 4))))
+PASSWORD_HASH_CONCURRENCY = int(os.getenv("PASSWORD_HASH_CONCURRENCY", str(PASSWORD_HASH_WORKERS)))
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", "100"))
+
+HASH_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+hash_queue_depth = metrics.gauge("password_hash_queue_depth", "Password hash operations waiting for a slot")
+hash_in_flight = metrics.gauge("password_hash_in_flight", "Password hash operations running in the pool")
+hash_seconds = metrics.histogram(
+  "password_hash_seconds", "Time spent hashing or verifying a password, including queueing", ["operation"], HASH_BUCKETS
+)
+hash_rejected = metrics.counter("password_hash_rejected_total", "Password hash operations rejected because the queue was full")
+
+_executor: Optional[ProcessPoolExecutor] = None
+_semaphore: Optional[asyncio.Semaphore] = None
+
+def _hash(password: str) -> str:
+  return pwd_context.hash(password)
+
+def _verify_and_update(password: str, password_hash: str) -> Tuple[bool, Optional[str]]:
+  return pwd_context.verify_and_update(password, password_hash)
+
+def _get_executor() -> ProcessPoolExecutor:
+  global _executor
+  if _executor is None:
+    # fork だとスレッドを持つ親プロセスのロック状態を引き継ぐため spawn を使う
+    _executor = ProcessPoolExecutor(PASSWORD_HASH_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+  return _executor
+
+async def _run(operation: str, function, *args):
+  global _semaphore
+  if _semaphore is None:
+    _semaphore = asyncio.Semaphore(PASSWORD_HASH_CONCURRENCY)
+  if _semaphore.locked() and hash_queue_depth.value() >= PASSWORD_HASH_MAX_QUEUE:
+    hash_rejected.inc()
+    raise HTTPException(
+      status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+      detail="Too many authentication requests",
+      headers={"Retry-After": "1"},
+    )
+  started = time.perf_counter()
+  hash_queue_depth.inc()
+  try:
+    await _semaphore.acquire()
+  finally:
+    hash_queue_depth.dec()
+  hash_in_flight.inc()
+  try:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_get_executor(), function, *args)
+  finally:
+    hash_in_flight.dec()
+    _semaphore.release()
+    hash_seconds.observe(time.perf_counter() - started, operation=operation)
+
+async def hash_password(password: str) -> str:
+  """パスワードのハッシュ化（プロセスプールで実行）"""
+  return await _run("hash", _hash, password)
+
+async def verify_password(password: str, password_hash: str) -> Tuple[bool, Optional[str]]:
+  """パスワードの検証（プロセスプールで実行）
+
+  ハッシュのコスト設定が変わっていれば、新しい設定でのハッシュも返す（不要なら None）。
+  """
+  return await _run("verify", _verify_and_update, password, password_hash)
+
+def shutdown() -> None:
+  global _executor
+  if _executor is not None:
+    _executor.shutdown(wait=False, cancel_futures=True)
+    _executor = None
@@ -0,0 +1,50 @@
+"""HTTP キャッシュ（ETag / If-None-Match / Cache-Control）
+
+カタログ系の GET レスポンスに強い ETag と Cache-Control を付け、
+If-None-Match が一致する場合はボディを作らずに 304 を返す。
+"""
+import hashlib
+import os
+from typing import Optional
+
+from fastapi import Request, Response
+
+CATALOG_MAX_AGE = int(os.getenv("CATALOG_MAX_AGE", "30"))
+CATALOG_STALE_WHILE_REVALIDATE = int(os.getenv("CATALOG_STALE_WHILE_REVALIDATE", "60"))
+
+# CDN・リバースプロキシでも共有できる（ユーザーごとに変わらない）レスポンス用
+CATALOG_CACHE_CONTROL = (
+  f"public, max-age={CATALOG_MAX_AGE}, stale-while-revalidate={CATALOG_STALE_WHILE_REVALIDATE}"
+)
+# ログイン中のユーザー向けの情報を含むレスポンス用（ブラウザにだけ保存し、毎回 ETag で確認する）
+PRIVATE_CACHE_CONTROL = "private, no-cache"
+
+def make_etag(*parts) -> str:
+  """値の組から強い ETag を作成"""
+  digest = hashlib.sha1("\x1f".join(map(str, parts)).encode()).hexdigest()
+  return f'"{digest}"'
+
+def etag_matches(request: Request, etag: str) -> bool:
+  """If-None-Match が ETag に一致するか（If-None-Match は弱い比較）"""
+  header = request.headers.get("if-none-match")
+  if not header:
+    return False
+  if header.strip() == "*":
+    return True
+  candidates = (tag.strip() for tag in header.split(","))
+  return etag in (tag[2:] if tag.startswith("W/") else tag for tag in candidates)
+
+def set_cache_headers(response: Response, etag: Optional[str], cache_control: str = CATALOG_CACHE_CONTROL) -> None:
+  if etag:
+    response.headers["ETag"] = etag
+  response.headers["Cache-Control"] = cache_control
+
+def cache_headers(etag: Optional[str], cache_control: str = CATALOG_CACHE_CONTROL) -> dict:
+  headers = {"Cache-Control": cache_control}
+  if etag:
+    headers["ETag"] = etag
+  return headers
+
+def not_modified(etag: str, cache_control: str = CATALOG_CACHE_CONTROL) -> Response:
+  """304 Not Modified（ボディなし）"""
+  return Response(status_code=304, headers=cache_headers(etag, cache_control))
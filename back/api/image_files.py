@@ -0,0 +1,80 @@
+"""アップロード画像の配信
+
+StaticFiles（Range・If-None-Match・If-Modified-Since に対応）に、画像の種類ごとの
+Cache-Control を付けて配信する。SHA-256 名の画像は内容が変わらないため immutable にする。
+
+IMAGE_SENDFILE を設定すると、ファイルの中身は返さずに X-Accel-Redirect（nginx）・
+X-Sendfile（Apache・lighttpd）ヘッダーだけを返し、読み出しと送信を前段のプロキシに任せる。
+設定しない場合も、サーバーが ASGI の pathsend 拡張に対応していればファイルの送信はサーバーに任せる。
+
+API とは別のプロセスで配信する場合は、DB に接続しない画像専用のアプリを起動する:
+  uvicorn api.image_files:app --port 8001
+"""
+import os
+from pathlib import Path
+
+from starlette.applications import Starlette
+from starlette.datastructures import Headers
+from starlette.exceptions import HTTPException
+from starlette.responses import FileResponse, Response
+from starlette.routing import Mount
+from starlette.staticfiles import NotModifiedResponse, StaticFiles
+
+from . import metrics
+from .image_store import image_store
+
+# "x-accel-redirect"・"x-sendfile" でプロキシに送信を任せる（空なら自前で送信）
+IMAGE_SENDFILE = os.getenv("IMAGE_SENDFILE", "").lower()
+# X-Accel-Redirect で使う nginx の internal な location（static/images を alias する）
+IMAGE_ACCEL_PREFIX = os.getenv("IMAGE_ACCEL_PREFIX", "/_images/")
+# SHA-256 名でない画像（旧形式の画像・派生画像）のキャッシュ期間
+IMAGE_CACHE_MAX_AGE = int(os.getenv("IMAGE_CACHE_MAX_AGE", str(24 * 60 * 60)))
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+image_responses = metrics.counter("image_responses_total", "Image file responses by how the body is sent", ["mode"])
+
+def image_cache_control(path: Path) -> str:
+  """画像の Cache-Control（SHA-256 名は immutable、派生画像は生成し直すと中身が変わるため期限付き）"""
+  if image_store.is_content_addressed(path):
+    return IMMUTABLE_CACHE_CONTROL
+  return f"public, max-age={IMAGE_CACHE_MAX_AGE}"
+
+class ImageFiles(StaticFiles):
+  """static/images の配信（Cache-Control の付与とプロキシへの送信の委譲）"""
+
+  def __init__(self, directory: Path = image_store.root, **kwargs):
+    super().__init__(directory=directory, **kwargs)
+
+  async def get_response(self, path: str, scope) -> Response:
+    # アップロード途中の一時ファイル（.xxx.part）などは配信しない
+    if any(part.startswith(".") for part in Path(path).parts):
+      raise HTTPException(status_code=404)
+    return await super().get_response(path, scope)
+
+  def file_response(self, full_path, stat_result: os.stat_result, scope, status_code: int = 200) -> Response:
+    full_path = Path(full_path)
+    headers = {"Cache-Control": image_cache_control(full_path)}
+    if IMAGE_SENDFILE:
+      image_responses.inc(mode=IMAGE_SENDFILE)
+      return self.offload_response(full_path, headers)
+
+    response = FileResponse(full_path, status_code=status_code, stat_result=stat_result, headers=headers)
+    if self.is_not_modified(response.headers, Headers(scope=scope)):
+      image_responses.inc(mode="not_modified")
+      return NotModifiedResponse(response.headers)
+    image_responses.inc(mode="file")
+    return response
+
+  def offload_response(self, full_path: Path, headers: dict) -> Response:
+    """中身を返さず、プロキシに送信させるヘッダーだけのレスポンス（Range・条件付きリクエストもプロキシが処理）"""
+    if IMAGE_SENDFILE == "x-accel-redirect":
+      relative = full_path.resolve().relative_to(image_store.root).as_posix()
+      headers["X-Accel-Redirect"] = IMAGE_ACCEL_PREFIX.rstrip("/") + "/" + relative
+    else:
+      headers["X-Sendfile"] = str(full_path.resolve())
+    # Content-Type は空にして、プロキシにファイルの拡張子から決めさせる
+    return Response(headers=headers, media_type=None)
+
+# 画像専用のアプリ（API とは別のプロセス・ポートで配信する場合に使う）
+app = Starlette(routes=[Mount(image_store.url_prefix, ImageFiles(), name="images")])
@@ -0,0 +1,221 @@
+"""アップロード画像のコンテンツアドレス型ストレージ
+
+画像は内容の SHA-256 から決めたパス（static/images/ab/cd/<sha256>.<拡張子>）に保存し、
+同じ画像が何度アップロードされても1つだけ保存する。ディレクトリは先頭4文字で2段に分け、
+1ディレクトリあたりのファイル数を抑える。
+
+参照数は Menu.image_url・Shop.image_path から数える（cruds/image_references.py）。
+参照がなくなった画像は、最終アップロードから猶予期間（IMAGE_GC_GRACE_SECONDS）を
+過ぎていれば削除する。アップロード直後でまだメニュー・店舗に登録されていない画像を
+消さないための猶予で、同じ画像が再アップロードされるかメニュー・店舗に登録されると猶予期間をやり直す。
+削除は claim（隠しファイルへの移動）→ 参照の再確認 → discard（削除）か restore（元に戻す）の順に行う。
+それ以前の uuid 名の画像（static/images 直下）は定期的な掃除の対象にせず、DELETE /upload/image でだけ削除する。
+"""
+import os
+import re
+import shutil
+import time
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+
+from . import metrics
+
+IMAGE_ROOT = Path(__file__).parent.parent / "static" / "images"
+IMAGE_URL_PREFIX = "/static/images"
+
+IMAGE_GC_GRACE_SECONDS = float(os.getenv("IMAGE_GC_GRACE_SECONDS", str(24 * 60 * 60)))
+
+# 派生画像の保存先（<root>/derived/<元画像のファイル名（拡張子なし）>/）
+DERIVED_DIR_NAME = "derived"
+
+# アップロード途中で残った一時ファイルを削除するまでの時間
+TEMP_FILE_MAX_AGE = 60 * 60
+TEMP_FILE_SUFFIX = ".part"
+# 削除中の画像に付ける接尾辞
+CLAIM_SUFFIX = ".deleting"
+
+_OBJECT_PATH = re.compile(r"^([0-9a-f]{2})/([0-9a-f]{2})/\1\2[0-9a-f]{60}\.[a-z0-9]+$")
+_SHARD = re.compile(r"^[0-9a-f]{2}$")
+
+deduplicated_uploads = metrics.counter("image_store_deduplicated_total", "Uploads whose content was already stored")
+reclaimed_objects = metrics.counter("image_store_reclaimed_total", "Unreferenced images removed from the store")
+reclaimed_bytes = metrics.counter("image_store_reclaimed_bytes_total", "Bytes freed by removing unreferenced images")
+
+class ImageStore:
+  """SHA-256 で名前を付けた画像ファイルの保存・削除"""
+
+  def __init__(self, root: Path, url_prefix: str):
+    self.root = root.resolve()
+    self.url_prefix = url_prefix.rstrip("/")
+
+  def path_for(self, sha256: str, extension: str) -> Path:
+    return self.root / sha256[:2] / sha256[2:4] / f"{sha256}{extension}"
+
+  def url_for(self, path: Path) -> str:
+    return f"{self.url_prefix}/{path.relative_to(self.root).as_posix()}"
+
+  def path_for_url(self, url: Optional[str]) -> Optional[Path]:
+    """URL から保存先のパスを求める（ストア外を指す URL は None）"""
+    if not url or not url.startswith(self.url_prefix + "/"):
+      return None
+    path = (self.root / url[len(self.url_prefix) + 1:]).resolve()
+    if not path.is_relative_to(self.root):
+      return None
+    return path
+
+  def is_content_addressed(self, path: Optional[Path]) -> bool:
+    """SHA-256 で名前を付けた画像か（uuid 名の旧形式の画像・派生画像は False）"""
+    if path is None:
+      return False
+    try:
+      relative = path.resolve().relative_to(self.root).as_posix()
+    except ValueError:
+      return False
+    return _OBJECT_PATH.match(relative) is not None
+
+  def is_uploaded(self, path: Optional[Path]) -> bool:
+    """アップロードした画像か（SHA-256 名の画像と直下の uuid 名の旧形式の画像。派生画像・隠しファイルは False）"""
+    if path is None:
+      return False
+    if self.is_content_addressed(path):
+      return True
+    path = path.resolve()
+    return path.parent == self.root and not path.name.startswith(".")
+
+  def temp_path(self, name: str) -> Path:
+    return self.root / f".{name}{TEMP_FILE_SUFFIX}"
+
+  def put(self, temp_path: Path, sha256: str, extension: str) -> Tuple[Path, bool]:
+    """一時ファイルを内容のハッシュの位置へ移し、(パス, 新規に保存したか) を返す
+
+    同じ内容が保存済みなら一時ファイルを捨て、更新日時を進めて削除の猶予期間をやり直す。
+    """
+    path = self.path_for(sha256, extension)
+    if path.exists():
+      os.utime(path)
+      temp_path.unlink(missing_ok=True)
+      deduplicated_uploads.inc()
+      return path, False
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # 同じ内容の同時アップロードでどちらが置き換えても中身は同じ
+    os.replace(temp_path, path)
+    return path, True
+
+  def derived_dir(self, path: Path) -> Path:
+    return self.root / DERIVED_DIR_NAME / path.stem
+
+  def derived_url_prefix(self, path: Path) -> str:
+    return f"{self.url_prefix}/{DERIVED_DIR_NAME}/{path.stem}"
+
+  def is_expired(self, path: Path, grace: float = IMAGE_GC_GRACE_SECONDS) -> bool:
+    try:
+      return time.time() - path.stat().st_mtime >= grace
+    except FileNotFoundError:
+      return False
+
+  def claim_path(self, path: Path) -> Path:
+    """削除中の画像の移動先（同じディレクトリの隠しファイル。配信・掃除の対象にならない）"""
+    return path.with_name(f".{path.name}{CLAIM_SUFFIX}")
+
+  def retain(self, path: Optional[Path]) -> bool:
+    """メニュー・店舗に登録する画像の更新日時を進め、削除の猶予期間をやり直す（コミットの前に呼ぶ）
+
+    削除のために claim 済みなら元の位置に戻す。画像がなければ False。
+    """
+    if not self.is_uploaded(path):
+      return True
+    try:
+      os.utime(path)
+      return True
+    except FileNotFoundError:
+      pass
+    try:
+      os.replace(self.claim_path(path), path)
+      os.utime(path)
+      return True
+    except FileNotFoundError:
+      return False
+
+  def claim(self, path: Path, grace: float = IMAGE_GC_GRACE_SECONDS) -> Optional[Path]:
+    """猶予期間を過ぎた画像を削除用に移動し、移動先を返す（削除しない画像は None）
+
+    移動の後に参照を確認し直し、discard で削除するか restore で戻す。
+    移動の前に retain された画像は更新日時が新しいため戻し、移動の後の retain は画像を取り戻す。
+    """
+    if not self.is_uploaded(path) or not self.is_expired(path, grace):
+      return None
+    claim = self.claim_path(path)
+    try:
+      os.rename(path, claim)
+    except FileNotFoundError:
+      return None
+    if not self.is_expired(claim, grace):
+      # 確認と移動の間に retain・再アップロードされた
+      self.restore(claim, path)
+      return None
+    return claim
+
+  def restore(self, claim: Path, path: Path) -> None:
+    """claim した画像を元に戻す（その間に同じ画像が保存されていればそちらを残す）"""
+    try:
+      if path.exists():
+        claim.unlink()
+      else:
+        os.replace(claim, path)
+    except FileNotFoundError:
+      pass
+
+  def discard(self, claim: Path, path: Path) -> int:
+    """claim した画像とその派生画像を削除し、解放したバイト数を返す（削除しなければ 0）"""
+    try:
+      size = claim.stat().st_size
+      claim.unlink()
+    except FileNotFoundError:
+      # retain で元の位置に戻された
+      return 0
+    if path.exists():
+      # その間に同じ画像が再アップロードされたため、派生画像とその記録は残す
+      return 0
+    # シャードのディレクトリは同時に保存される画像と競合しないよう、空になっても残す
+    shutil.rmtree(self.derived_dir(path), ignore_errors=True)
+    reclaimed_objects.inc()
+    reclaimed_bytes.inc(size)
+    return size
+
+  def iter_objects(self) -> Iterator[Path]:
+    """保存済みの画像（SHA-256 名のもの）を列挙"""
+    for first in _scan_dirs(self.root):
+      for second in _scan_dirs(first):
+        with os.scandir(second) as entries:
+          for entry in entries:
+            path = Path(entry.path)
+            if entry.is_file() and self.is_content_addressed(path):
+              yield path
+
+  def expired_objects(self, grace: float = IMAGE_GC_GRACE_SECONDS) -> List[Path]:
+    return [path for path in self.iter_objects() if self.is_expired(path, grace)]
+
+  def recover_claims(self) -> int:
+    """削除の途中で停止して残った claim を元に戻す（次の掃除で改めて参照を確認する）"""
+    recovered = 0
+    dirs = [self.root] + [second for first in _scan_dirs(self.root) for second in _scan_dirs(first)]
+    for directory in dirs:
+      for claim in directory.glob(f".*{CLAIM_SUFFIX}"):
+        self.restore(claim, claim.with_name(claim.name[1:-len(CLAIM_SUFFIX)]))
+        recovered += 1
+    return recovered
+
+  def remove_stale_temp_files(self, max_age: float = TEMP_FILE_MAX_AGE) -> int:
+    """アップロードの中断などで残った一時ファイルを削除"""
+    removed = 0
+    for path in self.root.glob(f".*{TEMP_FILE_SUFFIX}"):
+      if self.is_expired(path, max_age):
+        path.unlink(missing_ok=True)
+        removed += 1
+    return removed
+
+def _scan_dirs(directory: Path) -> List[Path]:
+  with os.scandir(directory) as entries:
+    return [Path(entry.path) for entry in entries if entry.is_dir() and _SHARD.match(entry.name)]
+
+image_store = ImageStore(IMAGE_ROOT, IMAGE_URL_PREFIX)
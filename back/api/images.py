@@ -0,0 +1,153 @@
+"""アップロード画像の派生画像（サイズ・形式違い）の生成
+
+アップロード後にバックグラウンドで thumb / card / full の各サイズを WebP・AVIF で生成し、
+image_variants テーブルに記録する。リサイズは CPU を使うため専用のプロセスプールで実行する。
+Pillow がインストールされていない場合は生成しない（元画像だけを返す）。
+
+参照されなくなった画像と派生画像の定期的な掃除（sweep_images）もここで行う。
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+import anyio
+
+from . import database, metrics
+from .cruds.image_references import remove_unreferenced_images
+from .cruds.image_variant import VARIANT_SIZES, invalidate_image_users, record_image_variants
+from .image_store import IMAGE_GC_GRACE_SECONDS, image_store
+
+try:
+  from PIL import features
+except ImportError:
+  features = None
+
+logger = logging.getLogger(__name__)
+
+IMAGE_WORKERS = int(os.getenv("IMAGE_WORKERS", "2"))
+IMAGE_QUALITY = {"webp": 80, "avif": 60}
+
+# 参照されなくなった画像を掃除する間隔（0 で無効）
+IMAGE_GC_INTERVAL = float(os.getenv("IMAGE_GC_INTERVAL", "3600"))
+# 掃除の際に参照を1回のクエリで確認する画像の数
+SWEEP_BATCH_SIZE = 500
+
+def _supported_formats() -> List[str]:
+  if features is None:
+    return []
+  requested = [f.strip() for f in os.getenv("IMAGE_VARIANT_FORMATS", "webp,avif").split(",") if f.strip()]
+  return [f for f in requested if f in IMAGE_QUALITY and features.check(f)]
+
+IMAGE_VARIANT_FORMATS = _supported_formats()
+
+variant_jobs_pending = metrics.gauge("image_variant_jobs_pending", "Image variant jobs queued or running")
+variant_seconds = metrics.histogram(
+  "image_variant_seconds", "Time to generate and record the variants of one image",
+  buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0),
+)
+variant_failures = metrics.counter("image_variant_failures_total", "Image variant jobs that failed")
+sweep_seconds = metrics.histogram(
+  "image_sweep_seconds", "Time to sweep unreferenced images from the store",
+  buckets=(0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0),
+)
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+def render_variants(source_path: str, out_dir: str, url_prefix: str, formats: Sequence[str]) -> List[Dict]:
+  """派生画像を生成して、image_variants に記録する値のリストを返す（プロセスプールで実行）"""
+  from PIL import Image, ImageOps
+
+  os.makedirs(out_dir, exist_ok=True)
+  variants = []
+  with Image.open(source_path) as image:
+    image.seek(0)  # アニメーション GIF は先頭フレームを使う
+    image = ImageOps.exif_transpose(image)
+    has_alpha = image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+    image = image.convert("RGBA" if has_alpha else "RGB")
+    for size, max_side in VARIANT_SIZES.items():
+      resized = image.copy()
+      resized.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+      for format in formats:
+        filename = f"{size}.{format}"
+        path = os.path.join(out_dir, filename)
+        # 書き込み途中のファイルが配信されないよう、一時ファイルから rename する
+        resized.save(path + ".tmp", format=format.upper(), quality=IMAGE_QUALITY[format])
+        os.replace(path + ".tmp", path)
+        variants.append({
+          "size": size,
+          "format": format,
+          "url": f"{url_prefix}/{filename}",
+          "width": resized.width,
+          "height": resized.height,
+          "bytes": os.path.getsize(path),
+        })
+  return variants
+
+def _get_executor() -> ProcessPoolExecutor:
+  global _executor
+  if _executor is None:
+    _executor = ProcessPoolExecutor(IMAGE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+  return _executor
+
+async def generate_variants(source_path: Path, source_url: str) -> None:
+  """派生画像を生成して記録（BackgroundTasks から実行。失敗してもアップロードは成功のまま）"""
+  if not IMAGE_VARIANT_FORMATS:
+    return
+  out_dir, url_prefix = image_store.derived_dir(source_path), image_store.derived_url_prefix(source_path)
+  started = time.perf_counter()
+  variant_jobs_pending.inc()
+  try:
+    loop = asyncio.get_running_loop()
+    variants = await loop.run_in_executor(
+      _get_executor(), render_variants, str(source_path), str(out_dir), url_prefix, IMAGE_VARIANT_FORMATS
+    )
+    async with database.AsyncSessionLocal() as db:
+      touched = await db.run_sync(record_image_variants, source_url, variants)
+    await invalidate_image_users(*touched)
+  except Exception:
+    variant_failures.inc()
+    logger.exception(f"派生画像の生成に失敗しました: {source_url}")
+  finally:
+    variant_jobs_pending.dec()
+    variant_seconds.observe(time.perf_counter() - started)
+
+async def sweep_images(grace: float = IMAGE_GC_GRACE_SECONDS) -> dict:
+  """メニュー・店舗から参照されず、猶予期間を過ぎた画像と派生画像を削除
+
+  ディレクトリの走査とファイルの削除はスレッドで行い、参照の確認だけを DB に問い合わせる。
+  """
+  started = time.perf_counter()
+  await anyio.to_thread.run_sync(image_store.recover_claims)
+  candidates = await anyio.to_thread.run_sync(image_store.expired_objects, grace)
+  removed, freed = 0, 0
+  async with database.AsyncSessionLocal() as db:
+    for i in range(0, len(candidates), SWEEP_BATCH_SIZE):
+      paths = {image_store.url_for(path): path for path in candidates[i:i + SWEEP_BATCH_SIZE]}
+      released, size = await remove_unreferenced_images(db, paths, grace)
+      removed += len(released)
+      freed += size
+  temp_files = await anyio.to_thread.run_sync(image_store.remove_stale_temp_files)
+  sweep_seconds.observe(time.perf_counter() - started)
+  return {"scanned": len(candidates), "removed": removed, "bytes": freed, "temp_files": temp_files}
+
+async def run_sweeps(interval: float = IMAGE_GC_INTERVAL) -> None:
+  """sweep_images を一定間隔で実行（起動時にタスクとして開始する）"""
+  while True:
+    await asyncio.sleep(interval)
+    try:
+      result = await sweep_images()
+      if result["removed"]:
+        logger.info(f"参照されていない画像を削除しました: {result}")
+    except Exception:
+      logger.exception("画像の掃除に失敗しました")
+
+def shutdown() -> None:
+  global _executor
+  if _executor is not None:
+    _executor.shutdown(wait=False, cancel_futures=True)
+    _executor = None
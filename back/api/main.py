@@ -1,15 +1,29 @@
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI, HTTPException
+from fastapi.responses import Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from .database import engine, Base
-from api.routers import menu, menu_single, users, shop, area, menu_favorites, favorites, auth, upload  # , genre  # 一時的にコメントアウト
+from .database import engine, async_engine, replicas, SessionLocal
+from .routing import PRIMARY_HEADER, ReadYourWritesMiddleware
+from .search import menu_index
+from .image_files import ImageFiles
+from .image_store import image_store
+from . import broadcasts, hashing, images, metrics, realtime, request_metrics
+from .schema import upgrade_database
+from api.routers import menu, menu_single, users, shop, area, menu_favorites, favorites, auth, upload, notification  # , genre  # 一時的にコメントアウト
 from api.models import users as user_models
 from api.models import area as area_models
 from api.models import menu as menu_models
 from api.models import menu as menu_models
 from api.models import shop as shop_models
 from api.models import menu_favorites as menu_favorites_models
+from api.models import menu_search as menu_search_models
+from api.models import image_variant as image_variant_models
+from api.models import menu_tombstone as menu_tombstone_models
+from api.models import menu_departure as menu_departure_models
+from api.models import notification_broadcast as notification_broadcast_models
+from api.models import catalog_version as catalog_version_models
 from api.models import shop_users as shop_user_models
+import asyncio
 import time
 import logging
 from sqlalchemy import text
@@ -18,14 +32,14 @@ logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 def create_tables():
-  """データベーステーブルを作成（リトライ機能付き）"""
+  """データベースのマイグレーションを適用（リトライ機能付き）"""
   max_retries = 30
   retry_delay = 2
   
   for attempt in range(max_retries):
     try:
-      Base.metadata.create_all(bind=engine)
-      logger.info("データベーステーブルの作成に成功しました")
+      upgrade_database(engine)
+      logger.info("データベースのマイグレーションに成功しました")
       return
     except Exception as e:
       logger.warning(f"データベース接続試行 {attempt + 1}/{max_retries} 失敗: {e}")
@@ -35,12 +49,25 @@ def create_tables():
         logger.error("データベースへの接続に失敗しました")
         raise
 
-app = FastAPI(title="Menu API", version="1.0.0")
+def build_search_index():
+  """検索インデックスを構築（未登録のメニューを補完）"""
+  db = SessionLocal()
+  try:
+    menu_index.rebuild(db)
+    logger.info("検索インデックスの構築に成功しました")
+  finally:
+    db.close()
+
+# PROFILE_ROUTES のサンプリングはルーティングの後に始める（include_router のルートも対象にするため）
+app = FastAPI(title="Menu API", version="1.0.0", dependencies=[Depends(request_metrics.profile_route)])
 
 # 静的ファイルの配信設定
 from pathlib import Path
 static_path = Path(__file__).parent.parent / "static"
 static_path.mkdir(exist_ok=True)
+image_store.root.mkdir(parents=True, exist_ok=True)
+# 画像は長期キャッシュ・プロキシへの送信の委譲に対応した専用の配信を使う（/static より先に登録）
+app.mount(image_store.url_prefix, ImageFiles(), name="images")
 app.mount("/static", StaticFiles(directory=str(static_path)), name="static")
 
 # CORS設定を強化
@@ -62,14 +89,46 @@ app.add_middleware(
         "Content-Language",
         "Content-Type",
         "Authorization",
-        "X-Requested-With"
+        "X-Requested-With",
+        "If-None-Match",
+        PRIMARY_HEADER,
     ],
+    expose_headers=["X-Next-Cursor", "ETag", "Server-Timing", PRIMARY_HEADER],
 )
 
+# 書き込み直後の読み取りをプライマリに向ける（レプリカがない場合は不要）
+if replicas:
+  app.add_middleware(ReadYourWritesMiddleware)
+
 @app.on_event("startup")
 async def startup_event():
   """アプリケーション開始時の処理"""
   create_tables()
+  build_search_index()
+  if replicas:
+    app.state.replica_health_check = asyncio.create_task(replicas.run_health_checks())
+  if images.IMAGE_GC_INTERVAL > 0:
+    app.state.image_sweep = asyncio.create_task(images.run_sweeps())
+  # 前回の停止で中断したお知らせの配信を再開し、他のワーカーで止まったジョブも引き継ぐ
+  app.state.broadcast_polling = asyncio.create_task(broadcasts.run_polling())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+  """アプリケーション終了時の処理"""
+  for task_name in ("replica_health_check", "image_sweep", "broadcast_polling"):
+    task = getattr(app.state, task_name, None)
+    if task:
+      task.cancel()
+  # 接続中の通知ストリームを閉じる（クライアントは再接続時に Last-Event-ID から再開する）
+  realtime.hub.close()
+  await broadcasts.shutdown()
+  await replicas.dispose()
+  await async_engine.dispose()
+  hashing.shutdown()
+  images.shutdown()
+
+# 最後に登録して最も外側に置き、他のミドルウェアの時間も含めて計測する（リクエストごとの SQL の記録も行う）
+app.add_middleware(request_metrics.RequestMetricsMiddleware)
 
 app.include_router(menu.router)
 app.include_router(menu_single.router)
@@ -81,6 +140,7 @@ app.include_router(menu_favorites.router)
 app.include_router(favorites.router)
 app.include_router(auth.router, prefix="/auth", tags=["auth"])
 app.include_router(upload.router)
+app.include_router(notification.router)
 
 @app.get("/health")
 def health_check():
@@ -92,6 +152,18 @@ def health_check():
   except Exception as e:
     return {"status": "unhealthy", "database": "disconnected", "error": str(e)}
 
+@app.get("/metrics", include_in_schema=False, dependencies=[Depends(request_metrics.require_metrics_access)])
+def read_metrics():
+  """Prometheus 形式のメトリクス"""
+  return Response(content=metrics.REGISTRY.render(), media_type=metrics.CONTENT_TYPE)
+
+@app.get("/metrics/profile", include_in_schema=False, dependencies=[Depends(request_metrics.require_metrics_access)])
+def read_profile(reset: bool = False):
+  """PROFILE_ROUTES のスタックのサンプル（collapsed 形式、reset=true で集計をリセット）"""
+  if request_metrics.sampler is None:
+    raise HTTPException(status_code=404, detail="PROFILE_ROUTES が設定されていません")
+  return Response(content=request_metrics.sampler.render(reset), media_type="text/plain; charset=utf-8")
+
 @app.get("/")
 def read_root():
   return {"message": "Tech Jam Cteam!"}
\ No newline at end of file
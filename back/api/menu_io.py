@@ -0,0 +1,152 @@
+"""メニューの一括入出力（CSV・JSON Lines）
+
+取り込みはリクエストボディをチャンクごとに受信し、1行（1レコード）ずつ dict にして返す。
+ボディ全体をメモリに載せず、行ごとのエラーは取り込み全体を止めずに呼び出し側へ渡す。
+書き出しも1行ずつ作り、StreamingResponse でそのまま送る。
+
+CSV は1行目をヘッダーとし、空のセルは未指定として扱う。tags は "|" 区切りで書く。
+"""
+import codecs
+import csv
+import io
+import json
+from datetime import datetime
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Tuple
+
+from fastapi import HTTPException, Request
+
+# 書き出す項目（取り込みでは id があれば既存メニューの更新、created_at・updated_at は無視する）
+MENU_EXPORT_FIELDS = [
+  "id", "shop_id", "name", "description", "price", "category", "tags",
+  "image_url", "is_available", "genre_id", "created_at", "updated_at",
+]
+
+# 差分の書き出しでは削除したメニューも deleted=true の行として返す
+MENU_CHANGE_FIELDS = MENU_EXPORT_FIELDS + ["deleted"]
+
+MEDIA_TYPES = {
+  "csv": "text/csv; charset=utf-8",
+  "ndjson": "application/x-ndjson",
+}
+
+TAG_SEPARATOR = "|"
+
+class RowError(ValueError):
+  """1行分の形式エラー（取り込み全体は続ける）"""
+
+def detect_format(content_type: Optional[str]) -> str:
+  """Content-Type から形式を判定（csv・ndjson 以外は 415）"""
+  media_type = (content_type or "").split(";", 1)[0].strip().lower()
+  if media_type in ("text/csv", "application/csv"):
+    return "csv"
+  if media_type in ("application/x-ndjson", "application/jsonl", "application/json-lines", "application/x-jsonlines"):
+    return "ndjson"
+  raise HTTPException(status_code=415, detail="text/csv または application/x-ndjson で送信してください")
+
+async def _iter_lines(request: Request) -> AsyncIterator[str]:
+  """リクエストボディを行ごとに返す（改行を含む）"""
+  buffer = ""
+  # チャンクの境界で分かれたマルチバイト文字・BOM を扱えるよう逐次デコードする
+  decoder = codecs.getincrementaldecoder("utf-8-sig")()
+  try:
+    async for chunk in request.stream():
+      buffer += decoder.decode(chunk)
+      *lines, buffer = buffer.split("\n")
+      for line in lines:
+        yield line + "\n"
+    buffer += decoder.decode(b"", final=True)
+  except UnicodeDecodeError:
+    raise HTTPException(status_code=400, detail="UTF-8 で送信してください")
+  if buffer:
+    yield buffer
+
+def _csv_value(field: str, value: str):
+  if field == "tags":
+    return [tag.strip() for tag in value.split(TAG_SEPARATOR) if tag.strip()]
+  return value
+
+async def _iter_csv(request: Request) -> AsyncIterator[Tuple[int, Optional[dict], Optional[RowError]]]:
+  header: Optional[List[str]] = None
+  pending, start, line_no = "", 0, 0
+  async for line in _iter_lines(request):
+    line_no += 1
+    if not pending:
+      start = line_no
+    pending += line
+    # 引用符の数が奇数なら、セル内の改行なので次の行とつなげる
+    if pending.count('"') % 2:
+      continue
+    record, pending = pending, ""
+    if not record.strip():
+      continue
+    try:
+      cells = next(csv.reader([record]))
+    except csv.Error as e:
+      yield start, None, RowError(f"CSV の形式が不正です: {e}")
+      continue
+    if header is None:
+      header = [cell.strip() for cell in cells]
+      continue
+    if len(cells) > len(header):
+      yield start, None, RowError("ヘッダーより列が多すぎます")
+      continue
+    yield start, {field: _csv_value(field, cell) for field, cell in zip(header, cells) if cell != ""}, None
+  if pending.strip():
+    yield start, None, RowError("引用符が閉じられていません")
+
+async def _iter_ndjson(request: Request) -> AsyncIterator[Tuple[int, Optional[dict], Optional[RowError]]]:
+  line_no = 0
+  async for line in _iter_lines(request):
+    line_no += 1
+    if not line.strip():
+      continue
+    try:
+      record = json.loads(line)
+    except ValueError as e:
+      yield line_no, None, RowError(f"JSON の形式が不正です: {e}")
+      continue
+    if not isinstance(record, dict):
+      yield line_no, None, RowError("各行は JSON オブジェクトにしてください")
+      continue
+    yield line_no, record, None
+
+def iter_records(request: Request, format: str) -> AsyncIterator[Tuple[int, Optional[dict], Optional[RowError]]]:
+  """ボディのレコードを (行番号, dict, None) か (行番号, None, RowError) で返す"""
+  return _iter_csv(request) if format == "csv" else _iter_ndjson(request)
+
+def _plain(value):
+  if isinstance(value, datetime):
+    return value.isoformat()
+  return value
+
+def menu_record(menu, fields: Iterable[str] = MENU_EXPORT_FIELDS) -> Dict:
+  """メニューを書き出し用の dict に変換"""
+  return {field: _plain(getattr(menu, field)) for field in fields}
+
+def change_record(menu) -> Dict:
+  """追加・更新したメニューを差分の行に変換"""
+  record = menu_record(menu)
+  record["deleted"] = False
+  return record
+
+def tombstone_record(tombstone) -> Dict:
+  """削除したメニューを差分の行に変換（id・shop_id と削除日時（updated_at）以外は空）"""
+  record = dict.fromkeys(MENU_CHANGE_FIELDS)
+  record.update(id=tombstone.menu_id, shop_id=tombstone.shop_id, updated_at=_plain(tombstone.deleted_at), deleted=True)
+  return record
+
+def csv_header(fields: Iterable[str] = MENU_EXPORT_FIELDS) -> str:
+  return ",".join(fields) + "\n"
+
+def csv_lines(records: Iterable[Dict], fields: Iterable[str] = MENU_EXPORT_FIELDS) -> str:
+  output = io.StringIO()
+  writer = csv.writer(output, lineterminator="\n")
+  for record in records:
+    writer.writerow([
+      TAG_SEPARATOR.join(value) if isinstance(value, list) else ("" if value is None else value)
+      for value in (record[field] for field in fields)
+    ])
+  return output.getvalue()
+
+def ndjson_lines(records: Iterable[Dict]) -> str:
+  return "".join(json.dumps(record, ensure_ascii=False) + "\n" for record in records)
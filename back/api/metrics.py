@@ -0,0 +1,189 @@
+"""Prometheus 形式のメトリクス
+
+外部ライブラリを使わない最小限の Counter / Gauge / Histogram と、
+それらをテキスト形式で出力するレジストリ。`GET /metrics` で公開する。
+"""
+import math
+import threading
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+LabelValues = Tuple[str, ...]
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+def _format_value(value: float) -> str:
+  if math.isinf(value):
+    return "+Inf" if value > 0 else "-Inf"
+  if float(value).is_integer():
+    return str(int(value))
+  return repr(float(value))
+
+def _escape(value: str) -> str:
+  return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+  if not names:
+    return ""
+  pairs = ",".join(f'{name}="{_escape(str(value))}"' for name, value in zip(names, values))
+  return "{" + pairs + "}"
+
+class Metric(ABC):
+  """メトリクスの基底クラス"""
+  type = "untyped"
+
+  def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+    self.name = name
+    self.documentation = documentation
+    self.labelnames = tuple(labelnames)
+    self._lock = threading.Lock()
+
+  def _key(self, labels: Dict[str, str]) -> LabelValues:
+    if set(labels) != set(self.labelnames):
+      raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+    return tuple(str(labels[name]) for name in self.labelnames)
+
+  @abstractmethod
+  def samples(self) -> List[Tuple[str, str, float]]:
+    """(サフィックス付きの名前, ラベル文字列, 値) のリスト"""
+
+  def render(self) -> str:
+    lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+    lines.extend(f"{name}{labels} {_format_value(value)}" for name, labels, value in self.samples())
+    return "\n".join(lines)
+
+class Counter(Metric):
+  """単調増加するカウンター"""
+  type = "counter"
+
+  def __init__(self, name, documentation, labelnames=()):
+    super().__init__(name, documentation, labelnames)
+    self._values: Dict[LabelValues, float] = {}
+
+  def inc(self, amount: float = 1, **labels) -> None:
+    key = self._key(labels)
+    with self._lock:
+      self._values[key] = self._values.get(key, 0) + amount
+
+  def value(self, **labels) -> float:
+    return self._values.get(self._key(labels), 0)
+
+  def samples(self):
+    with self._lock:
+      items = list(self._values.items())
+    return [(self.name, _format_labels(self.labelnames, key), value) for key, value in items]
+
+class Gauge(Metric):
+  """増減する値（関数を登録すると出力時に値を取得する）"""
+  type = "gauge"
+
+  def __init__(self, name, documentation, labelnames=()):
+    super().__init__(name, documentation, labelnames)
+    self._values: Dict[LabelValues, float] = {}
+    self._functions: Dict[LabelValues, Callable[[], float]] = {}
+
+  def set(self, value: float, **labels) -> None:
+    key = self._key(labels)
+    with self._lock:
+      self._values[key] = value
+
+  def inc(self, amount: float = 1, **labels) -> None:
+    key = self._key(labels)
+    with self._lock:
+      self._values[key] = self._values.get(key, 0) + amount
+
+  def dec(self, amount: float = 1, **labels) -> None:
+    self.inc(-amount, **labels)
+
+  def set_function(self, function: Callable[[], float], **labels) -> None:
+    key = self._key(labels)
+    with self._lock:
+      self._functions[key] = function
+
+  def value(self, **labels) -> float:
+    key = self._key(labels)
+    if key in self._functions:
+      return self._functions[key]()
+    return self._values.get(key, 0)
+
+  def samples(self):
+    with self._lock:
+      values = dict(self._values)
+      functions = dict(self._functions)
+    for key, function in functions.items():
+      values[key] = function()
+    return [(self.name, _format_labels(self.labelnames, key), value) for key, value in values.items()]
+
+class Histogram(Metric):
+  """値の分布（累積バケット・合計・件数）"""
+  type = "histogram"
+
+  def __init__(self, name, documentation, labelnames=(), buckets: Sequence[float] = DEFAULT_BUCKETS):
+    super().__init__(name, documentation, labelnames)
+    self.buckets = tuple(sorted(buckets)) + (math.inf,)
+    self._counts: Dict[LabelValues, List[int]] = {}
+    self._sums: Dict[LabelValues, float] = {}
+
+  def observe(self, value: float, **labels) -> None:
+    key = self._key(labels)
+    with self._lock:
+      counts = self._counts.setdefault(key, [0] * len(self.buckets))
+      for i, bound in enumerate(self.buckets):
+        if value <= bound:
+          counts[i] += 1
+          break
+      self._sums[key] = self._sums.get(key, 0) + value
+
+  def count(self, **labels) -> int:
+    return sum(self._counts.get(self._key(labels), ()))
+
+  def samples(self):
+    with self._lock:
+      items = [(key, list(counts), self._sums[key]) for key, counts in self._counts.items()]
+    samples = []
+    for key, counts, total in items:
+      cumulative = 0
+      for bound, count in zip(self.buckets, counts):
+        cumulative += count
+        labels = _format_labels(self.labelnames + ("le",), key + (_format_value(bound),))
+        samples.append((f"{self.name}_bucket", labels, cumulative))
+      labels = _format_labels(self.labelnames, key)
+      samples.append((f"{self.name}_sum", labels, total))
+      samples.append((f"{self.name}_count", labels, cumulative))
+    return samples
+
+class Registry:
+  """メトリクスの登録先"""
+
+  def __init__(self):
+    self._metrics: Dict[str, Metric] = {}
+    self._lock = threading.Lock()
+
+  def register(self, metric: Metric) -> Metric:
+    with self._lock:
+      if metric.name in self._metrics:
+        raise ValueError(f"Duplicate metric: {metric.name}")
+      self._metrics[metric.name] = metric
+    return metric
+
+  def get(self, name: str) -> Optional[Metric]:
+    return self._metrics.get(name)
+
+  def render(self) -> str:
+    with self._lock:
+      metrics = list(self._metrics.values())
+    return "\n".join(metric.render() for metric in metrics) + "\n"
+
+REGISTRY = Registry()
+
+# 出力形式の Content-Type
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def counter(name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+  return REGISTRY.register(Counter(name, documentation, labelnames))
+
+def gauge(name: str, documentation: str, labelnames: Iterable[str] = ()) -> Gauge:
+  return REGISTRY.register(Gauge(name, documentation, labelnames))
+
+def histogram(name: str, documentation: str, labelnames: Iterable[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+  return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))
@@ -4,5 +4,11 @@ from .menu import Menu
 from .shop import Shop
 from .shop_users import ShopUsers
 from .menu_favorites import MenuFavorites
+from .menu_search import MenuSearch
+from .image_variant import ImageVariant
+from .menu_tombstone import MenuTombstone
+from .notification_broadcast import NotificationBroadcast
+from .catalog_version import CatalogVersion
+from .menu_departure import MenuDeparture
 
-__all__ = ["Users", "Area", "Menu", "Shop", "ShopUsers", "MenuFavorites"]
\ No newline at end of file
+__all__ = ["Users", "Area", "Menu", "Shop", "ShopUsers", "MenuFavorites", "MenuSearch", "ImageVariant", "MenuTombstone", "NotificationBroadcast", "CatalogVersion", "MenuDeparture"]
\ No newline at end of file
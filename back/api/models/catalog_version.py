@@ -0,0 +1,13 @@
+from sqlalchemy import Column, Integer, String
+from api.database import Base
+
+class CatalogVersion(Base):
+  """一覧の版（メニューの書き込みと同じトランザクションで進め、一覧の ETag に使う）"""
+  __tablename__ = "catalog_versions"
+
+  # "menus"（全体）・"shop:{id}"（店舗ごと）
+  scope = Column(String(64), primary_key=True)
+  version = Column(Integer, nullable=False, server_default="0")
+
+  def __repr__(self):
+    return f"<CatalogVersion(scope='{self.scope}', version={self.version})>"
@@ -1,8 +1,13 @@
 from ..database import Base
-from sqlalchemy import Column, Integer, ForeignKey
+from sqlalchemy import Column, Integer, ForeignKey, Index
 
 class Favorite(Base):
   __tablename__ = "favorites"
 
   user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
-  shop_id = Column(Integer, ForeignKey("shops.id"), primary_key=True)
\ No newline at end of file
+  shop_id = Column(Integer, ForeignKey("shops.id"), primary_key=True)
+
+  # 主キー (user_id, shop_id) はユーザー側の検索に使い、店舗ごとの集計にはこちらを使う
+  __table_args__ = (
+    Index("ix_favorites_shop_id", "shop_id"),
+  )
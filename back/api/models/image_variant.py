@@ -0,0 +1,25 @@
+from sqlalchemy import Column, Integer, String, DateTime, UniqueConstraint
+from sqlalchemy.sql import func
+from api.database import Base
+
+class ImageVariant(Base):
+  """アップロード画像から生成したサイズ・形式違いの画像"""
+  __tablename__ = "image_variants"
+
+  id = Column(Integer, primary_key=True, index=True)
+  # 元画像の URL（Menu.image_url・Shop.image_path と同じ値）
+  source_url = Column(String(255), nullable=False, index=True)
+  size = Column(String(20), nullable=False)
+  format = Column(String(10), nullable=False)
+  url = Column(String(255), nullable=False)
+  width = Column(Integer, nullable=False)
+  height = Column(Integer, nullable=False)
+  bytes = Column(Integer, nullable=False)
+  created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+  __table_args__ = (
+    UniqueConstraint("source_url", "size", "format", name="uq_image_variants_source_size_format"),
+  )
+
+  def __repr__(self):
+    return f"<ImageVariant(source_url='{self.source_url}', size='{self.size}', format='{self.format}')>"
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, Float, DateTime, Boolean, ForeignKey, JSON
+from sqlalchemy import Column, Integer, String, Text, Float, DateTime, Boolean, ForeignKey, JSON, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from api.database import Base
@@ -14,8 +14,11 @@ class Menu(Base):
     price = Column(Float, nullable=False)
     category = Column(String(50), index=True)
     tags = Column(JSON, default=list)
-    image_url = Column(String(255))
+    # 画像の参照数の確認（cruds/image_references.py）に使う
+    image_url = Column(String(255), index=True)
     is_available = Column(Boolean, default=True)
+    # お気に入りの数（menu_favorites の追加・削除と同じトランザクションで増減する）
+    favorite_count = Column(Integer, nullable=False, default=0, server_default="0")
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
@@ -26,6 +29,20 @@ class Menu(Base):
     )
 
     shop = relationship("Shop", back_populates="menus")
+
+    # 一覧の絞り込み・並び順に合わせた複合インデックス（InnoDB では末尾に id が付くため id 順も索引で済む）
+    __table_args__ = (
+        # 店舗ごとの一覧: shop_id = ? AND is_available = 1 [AND category = ?]
+        Index("ix_menus_shop_available_category", "shop_id", "is_available", "category"),
+        # 全体の一覧: is_available = 1 [AND category = ?]、sort=newest・price_asc/desc
+        Index("ix_menus_available_category", "is_available", "category"),
+        Index("ix_menus_available_created", "is_available", "created_at"),
+        Index("ix_menus_available_price", "is_available", "price"),
+        # sort=popular（favorite_count, id の多い順）
+        Index("ix_menus_available_favorites", "is_available", "favorite_count"),
+        # GET /menus/export の since（未更新の行は updated_at IS NULL AND created_at >= ?）
+        Index("ix_menus_updated_created", "updated_at", "created_at"),
+    )
     
     def __repr__(self):
         return f"<Menu(name='{self.name}', price={self.price})>"
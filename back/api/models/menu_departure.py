@@ -0,0 +1,21 @@
+from sqlalchemy import Column, Integer, String, DateTime
+from sqlalchemy.sql import func
+from api.database import Base
+
+class MenuDeparture(Base):
+  """絞り込みの条件から外れたメニューの記録（店舗・エリア・カテゴリーの変更前の値）
+
+  GET /menus/export?changes=true を shop_id・area_id・category で絞り込んだ場合に、
+  条件から外れたメニューを削除として伝えるため。
+  """
+  __tablename__ = "menu_departures"
+
+  id = Column(Integer, primary_key=True)
+  menu_id = Column(Integer, nullable=False)
+  shop_id = Column(Integer, nullable=False)
+  area_id = Column(Integer, nullable=True)
+  category = Column(String(50), nullable=True)
+  departed_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False, index=True)
+
+  def __repr__(self):
+    return f"<MenuDeparture(menu_id={self.menu_id}, shop_id={self.shop_id})>"
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, ForeignKey
+from sqlalchemy import Column, Integer, ForeignKey, Index
 from sqlalchemy.orm import relationship
 from api.database import Base
 
@@ -11,4 +11,9 @@ class MenuFavorites(Base):
     menu = relationship(
         "Menu",
         back_populates="menu_favorites"
+    )
+
+    # 主キー (user_id, menu_id) はユーザー側の検索に使い、メニューごとの集計にはこちらを使う
+    __table_args__ = (
+        Index("ix_menu_favorites_menu_id", "menu_id"),
     )
\ No newline at end of file
@@ -0,0 +1,22 @@
+from sqlalchemy import Column, Integer, Text, ForeignKey, Index
+from api.database import Base
+
+class MenuSearch(Base):
+  """メニュー検索用のドキュメント（メニュー名・説明・タグ・店舗名を結合したもの）"""
+  __tablename__ = "menu_search"
+
+  menu_id = Column(Integer, ForeignKey("menus.id", ondelete="CASCADE"), primary_key=True)
+  document = Column(Text, nullable=False)
+
+  __table_args__ = (
+    # 日本語を扱えるよう ngram パーサーで FULLTEXT インデックスを作成（MySQL のみ）
+    Index(
+      "ft_menu_search_document",
+      "document",
+      mysql_prefix="FULLTEXT",
+      mysql_with_parser="ngram",
+    ),
+  )
+
+  def __repr__(self):
+    return f"<MenuSearch(menu_id={self.menu_id})>"
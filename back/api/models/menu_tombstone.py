@@ -0,0 +1,15 @@
+from sqlalchemy import Column, Integer, DateTime
+from sqlalchemy.sql import func
+from api.database import Base
+
+class MenuTombstone(Base):
+  """削除したメニューの記録（GET /menus/export の差分で削除を伝えるため）"""
+  __tablename__ = "menu_tombstones"
+
+  # メニューの id は再利用されないため、削除済みの id をそのまま主キーにする
+  menu_id = Column(Integer, primary_key=True, autoincrement=False)
+  shop_id = Column(Integer, nullable=False, index=True)
+  deleted_at = Column(DateTime(timezone=True), server_default=func.now(), nullable=False, index=True)
+
+  def __repr__(self):
+    return f"<MenuTombstone(menu_id={self.menu_id})>"
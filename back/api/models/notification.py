@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Index
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from api.database import Base
@@ -32,5 +32,12 @@ class Notification(Base):
     cascade="all, delete-orphan"
   )
 
+  __table_args__ = (
+    # ユーザーごとの通知一覧・未読の絞り込みと件数（末尾の id で新しい順にも並べられる）
+    Index("ix_notifications_user_status", "user_id", "status"),
+    # 受信箱のページング（ユーザーごとに created_at, id の新しい順）
+    Index("ix_notifications_user_created", "user_id", "created_at", "id"),
+  )
+
   def __repr__(self):
     return f"<Notification(to_user={self.user_id}, contents={self.contents})>"
\ No newline at end of file
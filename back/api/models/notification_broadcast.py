@@ -0,0 +1,34 @@
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Index
+from sqlalchemy.sql import func
+from api.database import Base
+
+class NotificationBroadcast(Base):
+  """店舗からのお知らせの一斉配信（お気に入り登録したユーザーへの配信ジョブと進捗）"""
+  __tablename__ = "notification_broadcasts"
+
+  id = Column(Integer, primary_key=True)
+  shop_id = Column(Integer, ForeignKey("shops.id"), nullable=False)
+  shop_user_id = Column(Integer, ForeignKey("shop_users.id"), nullable=True)
+  contents = Column(String(255), nullable=False)
+  # queued → running → done / failed
+  status = Column(String(20), nullable=False, default="queued")
+  # 配信先の数（開始時に数える）と配信済みの数
+  total = Column(Integer, nullable=True)
+  delivered = Column(Integer, nullable=False, default=0)
+  # 配信済みの最後のユーザー id（配信先は user_id 順に処理し、中断してもここから再開する）
+  last_user_id = Column(Integer, nullable=False, default=0)
+  # 実行中のワーカーと最終更新日時（更新が途絶えたジョブは他のワーカーが引き継ぐ）
+  worker = Column(String(64), nullable=True)
+  heartbeat_at = Column(DateTime, nullable=True)
+  error = Column(String(255), nullable=True)
+  created_at = Column(DateTime(timezone=True), server_default=func.now())
+  finished_at = Column(DateTime(timezone=True), nullable=True)
+
+  __table_args__ = (
+    # 未完了のジョブの検索
+    Index("ix_notification_broadcasts_status", "status"),
+    Index("ix_notification_broadcasts_shop_id", "shop_id"),
+  )
+
+  def __repr__(self):
+    return f"<NotificationBroadcast(id={self.id}, shop_id={self.shop_id}, status={self.status})>"
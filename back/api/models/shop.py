@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, ForeignKey
+from sqlalchemy import Column, Integer, String, Text, ForeignKey, Index
 from sqlalchemy.orm import relationship
 from api.database import Base
 
@@ -9,10 +9,13 @@ class Shop(Base):
   area_id = Column(Integer, ForeignKey("areas.id"), nullable=False)
   name = Column(String(100), nullable=False)
   shop_detail = Column(Text)
-  image_path = Column(String(255))
+  # 画像の参照数の確認（cruds/image_references.py）に使う
+  image_path = Column(String(255), index=True)
   homepage_url = Column(String(255))
   address = Column(String(255))
   phone = Column(String(20))
+  # お気に入りの数（favorites の追加・削除と同じトランザクションで増減する）
+  favorite_count = Column(Integer, nullable=False, default=0, server_default="0")
 
   area = relationship("Area", back_populates="shops")
   menus = relationship("Menu", back_populates="shop")
@@ -22,4 +25,10 @@ class Shop(Base):
     "NotificationShop",
     back_populates="shop",
     cascade="all, delete-orphan"
-  )
\ No newline at end of file
+  )
+
+  # 人気順（favorite_count, id の多い順）の一覧と、エリアごとの人気ランキングの作成
+  __table_args__ = (
+    Index("ix_shops_favorite_count", "favorite_count"),
+    Index("ix_shops_area_favorite_count", "area_id", "favorite_count"),
+  )
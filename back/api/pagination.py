@@ -0,0 +1,107 @@
+"""キーセット（カーソル）ページネーション
+
+`(ソートキー, id)` を不透明なカーソル文字列にエンコードし、
+OFFSET を使わずに次のページの先頭へ直接シークする。
+ソートキーには NULL を含まないカラムを指定すること。
+"""
+import base64
+import json
+from datetime import date, datetime
+from typing import Any, List, Optional, Sequence, Tuple
+
+from sqlalchemy import and_, or_, text
+from sqlalchemy.orm import Query
+
+# (カラム, 降順かどうか) のリスト。最後の要素は一意なキー（通常は id）にする
+SortKeys = Sequence[Tuple[Any, bool]]
+
+def _encode_value(value):
+  if isinstance(value, datetime):
+    return {"$dt": value.isoformat()}
+  if isinstance(value, date):
+    return {"$d": value.isoformat()}
+  raise TypeError(f"Unsupported cursor value: {value!r}")
+
+def _decode_value(obj):
+  if "$dt" in obj:
+    return datetime.fromisoformat(obj["$dt"])
+  if "$d" in obj:
+    return date.fromisoformat(obj["$d"])
+  return obj
+
+def encode_cursor(values: Sequence[Any]) -> str:
+  """ソートキーの値をカーソル文字列に変換"""
+  raw = json.dumps(list(values), default=_encode_value, separators=(",", ":"))
+  return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> List[Any]:
+  """カーソル文字列をソートキーの値に戻す（不正な場合は ValueError）"""
+  try:
+    padded = cursor + "=" * (-len(cursor) % 4)
+    values = json.loads(base64.urlsafe_b64decode(padded), object_hook=_decode_value)
+  except (ValueError, TypeError) as e:
+    raise ValueError("Invalid cursor") from e
+  if not isinstance(values, list):
+    raise ValueError("Invalid cursor")
+  return values
+
+def _after(keys: SortKeys, values: Sequence[Any]):
+  """(k1, k2, ...) が values より後ろにある行の条件を作成"""
+  conditions = []
+  for i, (column, descending) in enumerate(keys):
+    equals = [keys[j][0] == values[j] for j in range(i)]
+    beyond = column < values[i] if descending else column > values[i]
+    conditions.append(and_(*equals, beyond))
+  return or_(*conditions)
+
+def order_by_keys(query: Query, keys: SortKeys) -> Query:
+  """ソートキーの順に並べる"""
+  return query.order_by(*[column.desc() if descending else column.asc() for column, descending in keys])
+
+def seek(query: Query, keys: SortKeys, cursor: Optional[str]) -> Query:
+  """カーソルの位置以降に絞り込み、ソートキーの順に並べる"""
+  if cursor:
+    values = decode_cursor(cursor)
+    if len(values) != len(keys):
+      raise ValueError("Invalid cursor")
+    query = query.filter(_after(keys, values))
+  return order_by_keys(query, keys)
+
+def cursor_for(item: Any, keys: SortKeys) -> str:
+  """行のソートキーの値からカーソルを作成"""
+  return encode_cursor([getattr(item, column.key) for column, _ in keys])
+
+def split_page(rows: list, keys: SortKeys, limit: int) -> Tuple[list, Optional[str]]:
+  """limit + 1 件取得した結果を1ページ分と次ページのカーソルに分ける"""
+  if len(rows) <= limit:
+    return rows, None
+  rows = rows[:limit]
+  return rows, cursor_for(rows[-1], keys)
+
+def fetch_page(query: Query, keys: SortKeys, limit: int) -> Tuple[list, Optional[str]]:
+  """並び替え済みのクエリから1ページ分を取得し、次ページのカーソルを返す
+
+  1件多く取得して次ページの有無を判定するため、件数取得は不要。
+  """
+  return split_page(query.limit(limit + 1).all(), keys, limit)
+
+def estimate_count(query: Query) -> int:
+  """件数の概算を取得（MySQL はオプティマイザの見積もり、その他は正確な件数）"""
+  db = query.session
+  if db.get_bind().dialect.name != "mysql":
+    return query.order_by(None).count()
+  statement = query.order_by(None).statement.compile(
+    dialect=db.get_bind().dialect, compile_kwargs={"literal_binds": True}
+  )
+  plan = db.execute(text(f"EXPLAIN {statement}")).mappings().first()
+  if not plan or plan.get("rows") is None:
+    return 0
+  return int(plan["rows"] * (plan.get("filtered") or 100) / 100)
+
+def count(query: Query, mode: str = "exact") -> Optional[int]:
+  """件数取得のモードに応じて件数を返す（none の場合は None）"""
+  if mode == "none":
+    return None
+  if mode == "estimate":
+    return estimate_count(query)
+  return query.order_by(None).count()
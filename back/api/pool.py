@@ -0,0 +1,88 @@
+"""コネクションプールの設定と計測
+
+プールの設定は環境変数から読み込み、チェックアウト中の接続数・待ち時間・
+オーバーフロー・接続にかかった時間を `GET /metrics` に出力する。
+"""
+import os
+import time
+
+from sqlalchemy import exc
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+from . import metrics
+
+def _env_bool(name: str, default: bool) -> bool:
+  return os.getenv(name, str(default)).lower() in ("1", "true", "yes", "on")
+
+# create_engine / create_async_engine にそのまま渡すプールの設定
+POOL_SETTINGS = {
+  "pool_size": int(os.getenv("DB_POOL_SIZE", "5")),
+  "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "10")),
+  "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", "20")),
+  "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "300")),
+  # true: チェックアウトのたびに生存確認する / false: 切断エラー時に作り直す
+  "pool_pre_ping": _env_bool("DB_POOL_PRE_PING", True),
+  # true: 直近に返却された接続から使う（アイドル接続が recycle されやすくなる）
+  "pool_use_lifo": _env_bool("DB_POOL_USE_LIFO", False),
+}
+
+POOL_WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0)
+
+pool_checked_out = metrics.gauge("db_pool_checked_out", "Connections currently checked out", ["engine"])
+pool_idle = metrics.gauge("db_pool_idle", "Idle connections in the pool", ["engine"])
+pool_size = metrics.gauge("db_pool_size", "Configured pool size", ["engine"])
+pool_overflow = metrics.gauge("db_pool_overflow", "Overflow connections currently open", ["engine"])
+pool_wait_seconds = metrics.histogram(
+  "db_pool_wait_seconds", "Time spent waiting for a pooled connection", ["engine"], POOL_WAIT_BUCKETS
+)
+pool_timeouts = metrics.counter("db_pool_timeouts_total", "Checkouts that hit pool_timeout", ["engine"])
+pool_overflow_events = metrics.counter(
+  "db_pool_overflow_connections_total", "Connections opened beyond pool_size", ["engine"]
+)
+connect_seconds = metrics.histogram(
+  "db_connect_seconds", "Time to open a new DB connection", ["engine"], POOL_WAIT_BUCKETS
+)
+
+class _InstrumentedPoolMixin:
+  """チェックアウト待ち時間・接続時間・オーバーフローを計測するプール"""
+  metrics_name = "default"
+
+  def connect(self):
+    started = time.perf_counter()
+    try:
+      return super().connect()
+    except exc.TimeoutError:
+      pool_timeouts.inc(engine=self.metrics_name)
+      raise
+    finally:
+      pool_wait_seconds.observe(time.perf_counter() - started, engine=self.metrics_name)
+
+  def _create_connection(self):
+    if self.overflow() > 0:
+      pool_overflow_events.inc(engine=self.metrics_name)
+    started = time.perf_counter()
+    try:
+      return super()._create_connection()
+    finally:
+      connect_seconds.observe(time.perf_counter() - started, engine=self.metrics_name)
+
+  def recreate(self):
+    pool = super().recreate()
+    pool.metrics_name = self.metrics_name
+    return pool
+
+class InstrumentedQueuePool(_InstrumentedPoolMixin, QueuePool):
+  pass
+
+class InstrumentedAsyncQueuePool(_InstrumentedPoolMixin, AsyncAdaptedQueuePool):
+  pass
+
+def instrument_engine(engine: Engine, name: str) -> None:
+  """エンジンのプールにメトリクス名を設定し、ゲージを登録"""
+  engine.pool.metrics_name = name
+  # dispose() でプールが作り直されても追従するよう、毎回 engine.pool を参照する
+  pool_checked_out.set_function(lambda: engine.pool.checkedout(), engine=name)
+  pool_idle.set_function(lambda: engine.pool.checkedin(), engine=name)
+  pool_size.set_function(lambda: engine.pool.size(), engine=name)
+  pool_overflow.set_function(lambda: max(engine.pool.overflow(), 0), engine=name)
@@ -0,0 +1,181 @@
+"""SQL の計測（リクエストごとの件数・時間、遅いクエリ、N+1 の検出）
+
+エンジンのイベントで実行した SQL を記録し、次の形で出力する:
+
+- `GET /metrics`: リクエストあたりの SQL の件数・合計時間（ルートごと）と、
+  SQL の指紋（リテラルを ? に置き換えて正規化した SQL）ごとの実行回数・時間
+- `Server-Timing` ヘッダー: そのリクエストの SQL の件数と合計時間（ブラウザの開発者ツールで確認できる）
+- ログ: SQL_SLOW_QUERY_SECONDS を超えたクエリと、同じ指紋を SQL_N_PLUS_ONE_THRESHOLD 回より多く
+  実行したリクエスト（ループの中でクエリを発行している N+1 の疑い）
+
+StreamingResponse の本文を返す間に実行した SQL は、ヘッダーを送った後なので Server-Timing には含まれない。
+"""
+import hashlib
+import heapq
+import logging
+import os
+import re
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+# これより遅いクエリをログに出す
+SQL_SLOW_QUERY_SECONDS = float(os.getenv("SQL_SLOW_QUERY_SECONDS", "0.2"))
+# 1リクエストで同じ指紋のクエリをこの回数より多く実行したら N+1 の疑いとして警告（0 で無効）
+SQL_N_PLUS_ONE_THRESHOLD = int(os.getenv("SQL_N_PLUS_ONE_THRESHOLD", "10"))
+# 指紋ごとのメトリクスの上限（超えた分は fingerprint="other" にまとめる）
+SQL_MAX_FINGERPRINTS = int(os.getenv("SQL_MAX_FINGERPRINTS", "500"))
+# リクエストごとに記録する遅いクエリの件数（警告のログに出す）
+SQL_SLOWEST_PER_REQUEST = 3
+SQL_SERVER_TIMING = os.getenv("SQL_SERVER_TIMING", "true").lower() in ("1", "true", "yes", "on")
+
+QUERY_COUNT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 200, 500)
+QUERY_SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+request_queries = metrics.histogram(
+  "db_queries_per_request", "SQL statements executed per request", ["route"], QUERY_COUNT_BUCKETS
+)
+request_query_seconds = metrics.histogram(
+  "db_query_seconds_per_request", "Total SQL time per request", ["route"], QUERY_SECONDS_BUCKETS
+)
+statement_seconds = metrics.histogram(
+  "db_statement_seconds", "SQL statement execution time", ["engine", "operation"], QUERY_SECONDS_BUCKETS
+)
+fingerprint_calls = metrics.counter("db_fingerprint_calls_total", "SQL statements executed by fingerprint", ["fingerprint"])
+fingerprint_seconds = metrics.counter("db_fingerprint_seconds_total", "SQL time by fingerprint", ["fingerprint"])
+fingerprint_info = metrics.gauge("db_fingerprint_info", "Normalized SQL of each fingerprint", ["fingerprint", "query"])
+slow_queries = metrics.counter("db_slow_queries_total", "SQL statements slower than SQL_SLOW_QUERY_SECONDS", ["fingerprint"])
+n_plus_one = metrics.counter("db_n_plus_one_total", "Requests that repeated one SQL fingerprint too many times", ["route"])
+
+_STRING = re.compile(r"'(?:[^'\\]|\\.|'')*'")
+_NUMBER = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?(?:e[+-]?\d+)?\b", re.IGNORECASE)
+_PARAMETER = re.compile(r"%\(\w+\)s|%s|\?|(?<!:):\w+")
+_PARAMETER_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)")
+_ROW_LIST = re.compile(r"\(\?\)(?:\s*,\s*\(\?\))+")
+_SPACE = re.compile(r"\s+")
+
+@lru_cache(maxsize=2048)
+def normalize_sql(statement: str) -> str:
+  """リテラル・パラメーターを ? に置き換え、IN (...) や複数行の VALUES の長さの違いをまとめる"""
+  sql = _STRING.sub("?", statement)
+  sql = _NUMBER.sub("?", sql)
+  sql = _PARAMETER.sub("?", sql)
+  sql = _PARAMETER_LIST.sub("(?)", sql)
+  sql = _ROW_LIST.sub("(?)", sql)
+  return _SPACE.sub(" ", sql).strip()
+
+@lru_cache(maxsize=2048)
+def fingerprint(statement: str) -> Tuple[str, str]:
+  """(指紋の ID, 正規化した SQL)"""
+  normalized = normalize_sql(statement)
+  return hashlib.blake2b(normalized.encode(), digest_size=6).hexdigest(), normalized
+
+@dataclass
+class RequestQueries:
+  """1リクエストで実行した SQL の記録"""
+  count: int = 0
+  seconds: float = 0.0
+  fingerprints: Counter = field(default_factory=Counter)
+  statements: Dict[str, str] = field(default_factory=dict)
+  # (時間, 指紋の ID) の最小ヒープ（遅い順に SQL_SLOWEST_PER_REQUEST 件）
+  slowest: List[Tuple[float, str]] = field(default_factory=list)
+
+  def record(self, key: str, normalized: str, seconds: float) -> None:
+    self.count += 1
+    self.seconds += seconds
+    self.fingerprints[key] += 1
+    self.statements.setdefault(key, normalized)
+    entry = (seconds, key)
+    if len(self.slowest) < SQL_SLOWEST_PER_REQUEST:
+      heapq.heappush(self.slowest, entry)
+    elif entry > self.slowest[0]:
+      heapq.heapreplace(self.slowest, entry)
+
+  def slowest_statements(self) -> List[Tuple[float, str]]:
+    return sorted(self.slowest, reverse=True)
+
+  def repeated(self, threshold: int) -> List[Tuple[str, str, int]]:
+    """threshold 回より多く実行した (指紋の ID, 正規化した SQL, 回数)"""
+    return [
+      (key, self.statements[key], count)
+      for key, count in self.fingerprints.most_common() if count > threshold
+    ]
+
+_current: ContextVar[Optional[RequestQueries]] = ContextVar("request_queries", default=None)
+
+_known_fingerprints = set()
+_known_lock = threading.Lock()
+
+def _metric_key(key: str, normalized: str) -> str:
+  """指紋ごとのメトリクスのラベル（種類が上限を超えたら other にまとめる）"""
+  if key in _known_fingerprints:
+    return key
+  with _known_lock:
+    if key not in _known_fingerprints:
+      if len(_known_fingerprints) >= SQL_MAX_FINGERPRINTS:
+        return "other"
+      _known_fingerprints.add(key)
+      fingerprint_info.set(1, fingerprint=key, query=normalized[:500])
+  return key
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+  context._query_started = time.perf_counter()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+  started = getattr(context, "_query_started", None)
+  if started is None:
+    return
+  elapsed = time.perf_counter() - started
+  key, normalized = fingerprint(statement)
+  operation = normalized.split(" ", 1)[0].lower()
+  statement_seconds.observe(elapsed, engine=getattr(conn.engine.pool, "metrics_name", "default"), operation=operation)
+  metric_key = _metric_key(key, normalized)
+  fingerprint_calls.inc(fingerprint=metric_key)
+  fingerprint_seconds.inc(elapsed, fingerprint=metric_key)
+  if elapsed >= SQL_SLOW_QUERY_SECONDS:
+    slow_queries.inc(fingerprint=metric_key)
+    logger.warning(f"遅いクエリ ({elapsed * 1000:.1f}ms) [{key}]: {normalized}")
+  queries = _current.get()
+  if queries is not None:
+    queries.record(key, normalized, elapsed)
+
+def instrument_queries(engine: Engine) -> None:
+  """エンジンで実行する SQL を計測（非同期エンジンは sync_engine を渡す）"""
+  if not event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+def start_request() -> RequestQueries:
+  """このリクエスト（コンテキスト）で実行する SQL の記録を始める"""
+  queries = RequestQueries()
+  _current.set(queries)
+  return queries
+
+def finish_request(queries: RequestQueries, route: str, headers) -> None:
+  """メトリクスに記録し、Server-Timing を付け、N+1 の疑いがあれば警告"""
+  request_queries.observe(queries.count, route=route)
+  request_query_seconds.observe(queries.seconds, route=route)
+  if SQL_SERVER_TIMING:
+    timing = f'db;dur={queries.seconds * 1000:.1f};desc="{queries.count} queries"'
+    existing = headers.get("Server-Timing")
+    headers["Server-Timing"] = f"{existing}, {timing}" if existing else timing
+  if SQL_N_PLUS_ONE_THRESHOLD <= 0:
+    return
+  repeated = queries.repeated(SQL_N_PLUS_ONE_THRESHOLD)
+  if repeated:
+    n_plus_one.inc(route=route)
+    for key, normalized, count in repeated:
+      logger.warning(f"N+1 の疑い: {route} で同じクエリを {count} 回実行しました [{key}]: {normalized}")
+    slowest = ", ".join(f"[{key}] {seconds * 1000:.1f}ms" for seconds, key in queries.slowest_statements())
+    logger.warning(f"{route} の SQL: {queries.count} 件・{queries.seconds * 1000:.1f}ms、遅い順: {slowest}")
@@ -0,0 +1,82 @@
+"""エリアごとの人気ランキング（お気に入り数の多い順）
+
+ランキングはエリアごとに上位 POPULAR_TOP_N 件の倍まで（id, お気に入り数）を保持し、
+最初の読み込み時と POPULAR_REFRESH_SECONDS ごとに favorite_count のインデックスから作り直す。
+その間はお気に入りの追加・削除のたびに該当エリアのランキングだけを更新するため、
+お気に入りのテーブルを集計することはない。
+
+保持している範囲外の項目は、すべて末尾の項目以下の順位になる（この前提で順位を確定できない
+変更があった場合は、次の読み込み時に作り直す）。
+"""
+import os
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from .cache import SharedCache, TieredCache, TTLCache, response_cache
+
+POPULAR_TOP_N = int(os.getenv("POPULAR_TOP_N", "20"))
+# 作り直す間隔（他のワーカーでの増減・販売状況の変更はこの間隔以内に反映される）
+POPULAR_REFRESH_SECONDS = float(os.getenv("POPULAR_REFRESH_SECONDS", "300"))
+
+def _order(entry: List[int]) -> Tuple[int, int]:
+  # favorite_count DESC, id DESC と同じ順序
+  return entry[1], entry[0]
+
+def apply_change(ranking: Dict, item_id: int, count: int, capacity: int, top_n: int = POPULAR_TOP_N) -> Optional[Dict]:
+  """項目のお気に入り数の変更をランキングに反映（順位を確定できない場合は None）"""
+  complete = ranking["complete"]  # エリアのすべての項目を保持している
+  entries = [entry for entry in ranking["entries"] if entry[0] != item_id]
+  if count > 0 and (complete or (entries and (count, item_id) > _order(entries[-1]))):
+    entries.append([item_id, count])
+    entries.sort(key=_order, reverse=True)
+  if len(entries) > capacity:
+    entries = entries[:capacity]
+    complete = False
+  if not complete and len(entries) < top_n:
+    return None
+  return {"entries": entries, "complete": complete, "built_at": ranking["built_at"]}
+
+class PopularRankings:
+  """エリア id → ランキングのキャッシュ"""
+
+  def __init__(self, kind: str, top_n: int = POPULAR_TOP_N, shared: Optional[SharedCache] = None):
+    self.kind = kind
+    self.top_n = top_n
+    self.capacity = top_n * 2
+    # 共有キャッシュがあれば他のワーカーの更新を数秒で取り込み、なければプロセス内で保持し続ける
+    local_ttl = 5.0 if shared is not None else POPULAR_REFRESH_SECONDS
+    self.cache = TieredCache(
+      f"ranking_{kind}",
+      TTLCache(maxsize=1024, ttl=local_ttl, name=f"ranking_{kind}"),
+      shared=shared,
+      shared_ttl=POPULAR_REFRESH_SECONDS,
+    )
+
+  async def get(self, area_id: int, load: Callable[[int], Awaitable[List[Tuple[int, int]]]]) -> List[int]:
+    """ランキングの id を順に返す（なければ await load(件数) で (id, お気に入り数) を読み込んで作成）"""
+    key = str(area_id)
+    ranking = await self.cache.get(key)
+    if ranking is None or time.time() - ranking["built_at"] > POPULAR_REFRESH_SECONDS:
+      rows = await load(self.capacity)
+      ranking = {
+        "entries": [[item_id, count] for item_id, count in rows],
+        "complete": len(rows) < self.capacity,
+        "built_at": time.time(),
+      }
+      await self.cache.set(key, ranking)
+    return [item_id for item_id, _ in ranking["entries"]]
+
+  async def update(self, area_id: int, item_id: int, count: int) -> None:
+    """お気に入り数の変更を反映（ランキングを作成していないエリアは何もしない）"""
+    key = str(area_id)
+    ranking = await self.cache.get(key)
+    if ranking is None:
+      return
+    updated = apply_change(ranking, item_id, count, self.capacity, self.top_n)
+    if updated is None:
+      await self.cache.delete(key)
+    else:
+      await self.cache.set(key, updated)
+
+menu_rankings = PopularRankings("menus", shared=response_cache.shared)
+shop_rankings = PopularRankings("shops", shared=response_cache.shared)
@@ -0,0 +1,265 @@
+"""通知のリアルタイム配信（SSE / WebSocket）
+
+- NotificationHub: このプロセスで接続中のユーザーごとの購読を管理する pub/sub
+- InMemoryBus: 同じプロセスの中だけで届けるバス（REALTIME_BUS_URL が memory:// または未設定）
+- RedisBus: Redis の pub/sub で全ワーカーに届けるバス（REALTIME_BUS_URL=redis://...）
+
+通知を作成した側は publish_notifications でバスに送り、各ワーカーのハブが自分の接続に振り分ける。
+接続ごとのキューは REALTIME_QUEUE_SIZE 件までで、溢れた（クライアントの受信が追いつかない）場合は
+キューを捨てて DB から取り直す。再接続時は Last-Event-ID（最後に受け取った通知の id）以降を DB から補う。
+"""
+import asyncio
+import json
+import logging
+import os
+from typing import AsyncIterator, Callable, Dict, Iterable, List, Optional, Set
+
+from . import database, metrics
+from .cruds.notification import AsyncNotificationCRUD
+from .schemas.notification import NotificationOut
+
+logger = logging.getLogger(__name__)
+
+# 接続ごとに溜めておけるイベントの数
+REALTIME_QUEUE_SIZE = int(os.getenv("REALTIME_QUEUE_SIZE", "100"))
+# イベントがない間も接続を保つために送る heartbeat の間隔
+REALTIME_HEARTBEAT_SECONDS = float(os.getenv("REALTIME_HEARTBEAT_SECONDS", "15"))
+# 再接続時に DB から補う通知の上限（超える場合は受信箱を取り直すよう resync を送る）
+REALTIME_REPLAY_LIMIT = int(os.getenv("REALTIME_REPLAY_LIMIT", "100"))
+REALTIME_BUS_URL = os.getenv("REALTIME_BUS_URL")
+REALTIME_BUS_CHANNEL = os.getenv("REALTIME_BUS_CHANNEL", "notifications")
+
+# heartbeat を表すイベント
+HEARTBEAT = {"type": "ping"}
+_CLOSED = object()
+
+open_streams = metrics.gauge("realtime_connections", "Open notification streams")
+published_events = metrics.counter("realtime_events_published_total", "Notification events published to the bus")
+delivered_events = metrics.counter("realtime_events_delivered_total", "Notification events queued to open streams")
+slow_consumers = metrics.counter("realtime_queue_overflows_total", "Streams that fell behind and were resynced from the database")
+publish_failures = metrics.counter("realtime_publish_failures_total", "Failed publishes to the bus")
+
+class Subscription:
+  """1つの接続の購読（溢れたら overflowed を立て、受信側が DB から取り直す）"""
+
+  def __init__(self, user_id: int, maxsize: int = REALTIME_QUEUE_SIZE):
+    self.user_id = user_id
+    self.queue: asyncio.Queue = asyncio.Queue(maxsize)
+    self.overflowed = False
+
+  def push(self, event: dict) -> None:
+    if self.overflowed:
+      return
+    try:
+      self.queue.put_nowait(event)
+      delivered_events.inc()
+    except asyncio.QueueFull:
+      self.overflowed = True
+      slow_consumers.inc()
+
+  def reset(self) -> None:
+    """溜まったイベントを捨てる（この後 DB から取り直す）"""
+    while not self.queue.empty():
+      if self.queue.get_nowait() is _CLOSED:
+        self.queue.put_nowait(_CLOSED)
+        break
+    self.overflowed = False
+
+  def close(self) -> None:
+    # 溢れていても確実に受信側を止められるよう、1件空けてから入れる
+    if self.queue.full():
+      self.queue.get_nowait()
+    self.queue.put_nowait(_CLOSED)
+
+class InMemoryBus:
+  """Redis を使わない環境・テスト用のバス（同じプロセスのハブにだけ届く）"""
+  local = True
+
+  def __init__(self):
+    self._handlers: List[Callable[[str], None]] = []
+
+  async def publish(self, message: str) -> None:
+    for handler in list(self._handlers):
+      handler(message)
+
+  async def listen(self, handler: Callable[[str], None], resync: Callable[[], None]) -> None:
+    self._handlers.append(handler)
+    try:
+      await asyncio.Event().wait()
+    finally:
+      self._handlers.remove(handler)
+
+class RedisBus:
+  """Redis の pub/sub で全ワーカーに届けるバス"""
+  local = False
+
+  def __init__(self, url: str, channel: str = REALTIME_BUS_CHANNEL):
+    try:
+      import redis.asyncio as redis
+    except ImportError as e:
+      raise RuntimeError("REALTIME_BUS_URL を使うには redis パッケージが必要です") from e
+    self.channel = channel
+    self._redis = redis.Redis.from_url(url, decode_responses=True)
+
+  async def publish(self, message: str) -> None:
+    await self._redis.publish(self.channel, message)
+
+  async def listen(self, handler: Callable[[str], None], resync: Callable[[], None]) -> None:
+    connected_before = False
+    while True:
+      try:
+        async with self._redis.pubsub() as pubsub:
+          await pubsub.subscribe(self.channel)
+          if connected_before:
+            # 切断中のイベントは届かないため、接続中のストリームに DB から取り直させる
+            resync()
+          connected_before = True
+          async for message in pubsub.listen():
+            if message["type"] == "message":
+              handler(message["data"])
+      except asyncio.CancelledError:
+        raise
+      except Exception:
+        logger.exception("通知のバスから切断されました。再接続します")
+        await asyncio.sleep(1)
+
+def create_bus(url: Optional[str]):
+  """バスを作成（url が未設定・memory:// ならプロセス内のバス）"""
+  if not url or url == "memory://":
+    return InMemoryBus()
+  return RedisBus(url)
+
+class NotificationHub:
+  """接続中のユーザーへ通知を振り分ける pub/sub"""
+
+  def __init__(self, bus):
+    self.bus = bus
+    self._subscribers: Dict[int, Set[Subscription]] = {}
+    self._listener: Optional[asyncio.Task] = None
+
+  def _ensure_listening(self) -> None:
+    # 最初の接続で開始（テストなどでイベントループが変わった場合も開始し直す）
+    loop = asyncio.get_running_loop()
+    if self._listener is None or self._listener.done() or self._listener.get_loop() is not loop:
+      self._listener = loop.create_task(self.bus.listen(self.dispatch, self.resync))
+
+  def subscribe(self, user_id: int) -> Subscription:
+    self._ensure_listening()
+    subscription = Subscription(user_id)
+    self._subscribers.setdefault(user_id, set()).add(subscription)
+    open_streams.inc()
+    return subscription
+
+  def unsubscribe(self, subscription: Subscription) -> None:
+    subscriptions = self._subscribers.get(subscription.user_id)
+    if subscriptions is None or subscription not in subscriptions:
+      return
+    subscriptions.discard(subscription)
+    if not subscriptions:
+      del self._subscribers[subscription.user_id]
+    open_streams.dec()
+
+  def dispatch(self, message: str) -> None:
+    """バスから受け取ったイベントを宛先のユーザーの接続に入れる"""
+    for event in json.loads(message):
+      for subscription in self._subscribers.get(event["user_id"], ()):
+        subscription.push(event)
+
+  def resync(self) -> None:
+    for subscriptions in self._subscribers.values():
+      for subscription in subscriptions:
+        subscription.overflowed = True
+
+  async def publish(self, events: List[dict]) -> None:
+    """イベントをバスに送る（失敗しても通知の作成は成功させる）"""
+    if not events:
+      return
+    try:
+      await self.bus.publish(json.dumps(events, ensure_ascii=False))
+      published_events.inc(len(events))
+    except Exception:
+      publish_failures.inc()
+      logger.exception("通知のイベントを送れませんでした")
+
+  async def publish_notifications(self, notifications: Iterable) -> None:
+    """作成した通知を宛先のユーザーの接続に届ける"""
+    if self.bus.local:
+      # 同じプロセスにしか届かないので、接続していないユーザーの分は変換しない
+      notifications = [n for n in notifications if n.user_id in self._subscribers]
+    await self.publish([notification_event(n) for n in notifications])
+
+  def close(self) -> None:
+    for subscriptions in list(self._subscribers.values()):
+      for subscription in list(subscriptions):
+        subscription.close()
+    if self._listener is not None:
+      self._listener.cancel()
+
+def notification_event(notification) -> dict:
+  return {
+    "type": "notification",
+    "id": notification.id,
+    "user_id": notification.user_id,
+    "data": NotificationOut.model_validate(notification).model_dump(mode="json"),
+  }
+
+hub = NotificationHub(create_bus(REALTIME_BUS_URL))
+
+async def _missed_events(user_id: int, after_id: int) -> List[dict]:
+  """after_id より後の通知（多すぎる場合は最新の id の resync だけを返す）"""
+  # レプリカの遅延で取りこぼさないようプライマリから読む
+  async with database.AsyncSessionLocal() as db:
+    crud = AsyncNotificationCRUD(db)
+    notifications = await crud.get_after(user_id, after_id, REALTIME_REPLAY_LIMIT + 1)
+    if len(notifications) > REALTIME_REPLAY_LIMIT:
+      return [{"type": "resync", "id": await crud.latest_id(user_id), "user_id": user_id}]
+  return [notification_event(n) for n in notifications]
+
+async def _latest_id(user_id: int) -> int:
+  async with database.AsyncSessionLocal() as db:
+    return await AsyncNotificationCRUD(db).latest_id(user_id)
+
+async def stream(user_id: int, last_event_id: Optional[int] = None) -> AsyncIterator[dict]:
+  """ユーザーへのイベントを順に返す（イベントがない間は HEARTBEAT）
+
+  last_event_id を指定した場合は、それより後の通知を DB から補ってから届いたものを返す。
+  """
+  subscription = hub.subscribe(user_id)
+  try:
+    catch_up = last_event_id is not None
+    # 指定がなければ接続した時点から（溢れた場合はここから取り直す）
+    last_id = last_event_id if catch_up else await _latest_id(user_id)
+    replayed: Set[int] = set()
+    # resync を送った場合、その id までの通知はクライアントが受信箱から取り直す
+    covered = 0
+    while True:
+      if catch_up or subscription.overflowed:
+        # 購読を始めた後に読むため、読み込み中に作成された通知もキューで受け取れる（重複は除く）
+        catch_up = False
+        subscription.reset()
+        replayed = set()
+        for event in await _missed_events(user_id, last_id):
+          if event["type"] == "resync":
+            covered = event["id"]
+          replayed.add(event["id"])
+          last_id = max(last_id, event["id"])
+          yield event
+      try:
+        event = await asyncio.wait_for(subscription.queue.get(), REALTIME_HEARTBEAT_SECONDS)
+      except asyncio.TimeoutError:
+        yield HEARTBEAT
+        continue
+      if event is _CLOSED:
+        return
+      if event["id"] in replayed or event["id"] <= covered:
+        continue
+      last_id = max(last_id, event["id"])
+      yield event
+  finally:
+    hub.unsubscribe(subscription)
+
+def format_sse(event: dict) -> str:
+  """SSE の1イベント分のテキスト（heartbeat はコメント行）"""
+  if event is HEARTBEAT:
+    return ": ping\n\n"
+  return f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event.get('data'), ensure_ascii=False)}\n\n"
@@ -0,0 +1,240 @@
+"""HTTP リクエストの計測
+
+ルート（/menus/{menu_id} などのテンプレート）ごとのレイテンシー・ステータスコード・
+リクエスト／レスポンスのサイズと、処理中のリクエスト数を `GET /metrics` に出力する。
+リクエストごとの SQL の記録（api/query_stats.py）の開始・集計も同じミドルウェアで行う。
+BaseHTTPMiddleware を使わない ASGI ミドルウェアにして、リクエストごとのオーバーヘッドを小さくする。
+
+`GET /metrics`・`GET /metrics/profile` は、METRICS_TOKEN の Bearer トークンを付けたリクエストか、
+METRICS_ALLOWED_NETWORKS の送信元からのリクエストだけに返す（require_metrics_access）。
+
+PROFILE_ROUTES にルートを指定すると、そのルートの処理中だけスタックをサンプリングし（アプリ全体の依存関係
+profile_route で、ルーティングの後に照合する）、
+フレームグラフ用の collapsed 形式（flamegraph.pl・speedscope で読める）で
+`GET /metrics/profile` に出力する。サンプリングはプロセス内の全スレッドが対象のため、
+同時に処理している他のリクエストのスタックも混ざる。検証環境や負荷の低い時間帯に使う。
+"""
+import hmac
+import ipaddress
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from pathlib import Path
+from typing import Dict, Optional
+
+from fastapi import HTTPException, Request
+from starlette.datastructures import MutableHeaders
+from starlette.requests import HTTPConnection
+
+from . import metrics, query_stats
+
+# スタックをサンプリングするルート（カンマ区切り、"*" で全ルート、空なら無効）
+PROFILE_ROUTES = {route.strip() for route in os.getenv("PROFILE_ROUTES", "").split(",") if route.strip()}
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.005"))
+# 記録するスタックの種類の上限（超えた分は (truncated) にまとめる）
+PROFILE_MAX_STACKS = int(os.getenv("PROFILE_MAX_STACKS", "10000"))
+
+# /metrics の取得に必要な Bearer トークン（空なら METRICS_ALLOWED_NETWORKS の送信元だけに返す）
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+# トークンなしで /metrics を取得できる送信元（カンマ区切りの CIDR）
+METRICS_ALLOWED_NETWORKS = [
+  ipaddress.ip_network(network.strip(), strict=False)
+  for network in os.getenv("METRICS_ALLOWED_NETWORKS", "127.0.0.0/8,::1/128").split(",") if network.strip()
+]
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000, 100000000)
+
+requests_total = metrics.counter("http_requests_total", "HTTP requests by route and status code", ["method", "route", "status"])
+request_seconds = metrics.histogram(
+  "http_request_duration_seconds", "Time until the response body is fully sent", ["method", "route"], LATENCY_BUCKETS
+)
+request_size = metrics.histogram("http_request_size_bytes", "Request body size", ["method", "route"], SIZE_BUCKETS)
+response_size = metrics.histogram("http_response_size_bytes", "Response body size", ["method", "route"], SIZE_BUCKETS)
+requests_in_flight = metrics.gauge("http_requests_in_flight", "Requests currently being processed")
+profile_samples = metrics.counter("profile_samples_total", "Stack samples taken for PROFILE_ROUTES", ["route"])
+
+def route_path(scope) -> Optional[str]:
+  """照合したルートのパスのテンプレート（include_router の prefix を含む、ルーティング前は None）"""
+  # FastAPI 0.143 の include_router では scope["route"] が prefix を含まない元のルート（/auth/login が /login）になるため、
+  # FastAPI が scope に記録する、実際に照合したルートのテンプレートを優先する
+  context = scope.get("fastapi", {}).get("effective_route_context")
+  return getattr(context, "path_format", None) or getattr(scope.get("route"), "path", None)
+
+def route_label(scope) -> str:
+  """メトリクスのラベルにするルートのパス（/menus/{menu_id} など、どのルートにも一致しなければ unmatched）"""
+  path = route_path(scope)
+  if path:
+    return path
+  # マウントしたアプリ（/static/images など）には scope["route"] が設定されないため、マウント先のパスを使う
+  if "app_root_path" in scope:
+    return scope.get("root_path", "")[len(scope["app_root_path"]):] or "unmatched"
+  return "unmatched"
+
+def _allowed_address(host: str) -> bool:
+  try:
+    address = ipaddress.ip_address(host)
+  except ValueError:
+    return False
+  if getattr(address, "ipv4_mapped", None) is not None:
+    address = address.ipv4_mapped
+  return any(address in network for network in METRICS_ALLOWED_NETWORKS)
+
+def require_metrics_access(request: Request) -> None:
+  """/metrics・/metrics/profile の取得を許可するか（許可しなければ 403）
+
+  送信元はプロキシを経由するとプロキシのアドレスになるため、プロキシ側で遮断するか METRICS_TOKEN を使う。
+  """
+  if METRICS_TOKEN:
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    if scheme.lower() == "bearer" and hmac.compare_digest(token.encode(), METRICS_TOKEN.encode()):
+      return
+  if request.client is not None and _allowed_address(request.client.host):
+    return
+  raise HTTPException(status_code=403, detail="Forbidden")
+
+_ROOT = str(Path(__file__).resolve().parent.parent) + os.sep
+
+def _frame_name(code) -> str:
+  filename = code.co_filename
+  if filename.startswith(_ROOT):
+    filename = filename[len(_ROOT):]
+  elif "site-packages" + os.sep in filename:
+    filename = filename.split("site-packages" + os.sep, 1)[1]
+  return f"{code.co_name} ({filename}:{code.co_firstlineno})"
+
+class StackSampler:
+  """対象のルートを処理している間、一定間隔で全スレッドのスタックを集計する"""
+
+  def __init__(self, routes, interval: float = PROFILE_INTERVAL, max_stacks: int = PROFILE_MAX_STACKS):
+    self.routes = set(routes)
+    self.interval = interval
+    self.max_stacks = max_stacks
+    self.stacks: Counter = Counter()
+    self._active: Dict[str, int] = {}
+    self._lock = threading.Lock()
+    self._wake = threading.Event()
+    self._thread: Optional[threading.Thread] = None
+
+  def wants(self, route: str) -> bool:
+    return "*" in self.routes or route in self.routes
+
+  def enter(self, route: str) -> None:
+    with self._lock:
+      self._active[route] = self._active.get(route, 0) + 1
+      if self._thread is None:
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+      self._wake.set()
+
+  def exit(self, route: str) -> None:
+    with self._lock:
+      self._active[route] -= 1
+      if not self._active[route]:
+        del self._active[route]
+      if not self._active:
+        self._wake.clear()
+
+  def _run(self) -> None:
+    while True:
+      self._wake.wait()
+      self.sample()
+      time.sleep(self.interval)
+
+  def sample(self) -> None:
+    with self._lock:
+      routes = sorted(self._active)
+    if not routes:
+      return
+    # 複数のルートを同時に処理している場合は、どのルートのスタックか区別できない
+    root = routes[0] if len(routes) == 1 else "(" + "|".join(routes) + ")"
+    current = threading.get_ident()
+    for thread_id, frame in sys._current_frames().items():
+      if thread_id == current:
+        continue
+      names = []
+      while frame is not None:
+        names.append(_frame_name(frame.f_code))
+        frame = frame.f_back
+      # アプリのコードを実行していないスレッド（待機中のワーカー・イベントループの select）は除く
+      if not any(f" (api{os.sep}" in name for name in names):
+        continue
+      stack = root + ";" + ";".join(reversed(names))
+      with self._lock:
+        if stack not in self.stacks and len(self.stacks) >= self.max_stacks:
+          stack = root + ";(truncated)"
+        self.stacks[stack] += 1
+      profile_samples.inc(route=root)
+
+  def render(self, reset: bool = False) -> str:
+    """collapsed 形式（"フレーム;フレーム;... 回数" の行）"""
+    with self._lock:
+      stacks = self.stacks
+      if reset:
+        self.stacks = Counter()
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+sampler = StackSampler(PROFILE_ROUTES) if PROFILE_ROUTES else None
+
+async def profile_route(connection: HTTPConnection):
+  """対象のルートなら、処理中だけスタックをサンプリングする（FastAPI(dependencies=...) に登録する）
+
+  include_router で追加したルートは app.router.routes を照合しても見つからないため、
+  ルーティングの後に scope に記録されたルートで判定する。
+  """
+  route = route_path(connection.scope)
+  if sampler is None or connection.scope["type"] != "http" or not route or not sampler.wants(route):
+    yield
+    return
+  sampler.enter(route)
+  try:
+    yield
+  finally:
+    sampler.exit(route)
+
+class RequestMetricsMiddleware:
+  """ルートごとのレイテンシー・ステータス・サイズ・処理中の数と、リクエストごとの SQL を記録する ASGI ミドルウェア"""
+
+  def __init__(self, app):
+    self.app = app
+
+  async def __call__(self, scope, receive, send):
+    if scope["type"] != "http":
+      await self.app(scope, receive, send)
+      return
+
+    started = time.perf_counter()
+    status = 500
+    received = sent = 0
+    queries = query_stats.start_request()
+
+    async def receive_wrapper():
+      nonlocal received
+      message = await receive()
+      if message["type"] == "http.request":
+        received += len(message.get("body", b""))
+      return message
+
+    async def send_wrapper(message):
+      nonlocal status, sent
+      if message["type"] == "http.response.start":
+        status = message["status"]
+        # ヘッダーを送る前に、それまでの SQL を集計して Server-Timing に出力する
+        query_stats.finish_request(queries, route_label(scope), MutableHeaders(scope=message))
+      elif message["type"] == "http.response.body":
+        sent += len(message.get("body", b""))
+      await send(message)
+
+    requests_in_flight.inc()
+    try:
+      await self.app(scope, receive_wrapper, send_wrapper)
+    finally:
+      requests_in_flight.dec()
+      method = scope["method"]
+      route = route_label(scope)
+      requests_total.inc(method=method, route=route, status=status)
+      request_seconds.observe(time.perf_counter() - started, method=method, route=route)
+      request_size.observe(received, method=method, route=route)
+      response_size.observe(sent, method=method, route=route)
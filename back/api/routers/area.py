@@ -1,12 +1,47 @@
-from fastapi import APIRouter, Depends
-from sqlalchemy.orm import Session
-from ..database import get_db
+from fastapi import APIRouter, Depends, Query, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+from .. import http_cache
+from ..database import get_async_read_db
 from ..cruds import area as area_crud
-from ..schemas.shop import ShopWithMenus
-from typing import List
+from ..cruds import popularity as popularity_crud
+from ..rankings import POPULAR_TOP_N
+from ..schemas.menu import PopularMenuResponse
+from ..schemas.shop import PopularShopRead, ShopWithMenus
+from typing import List, Optional
 
 router = APIRouter(prefix="/areas", tags=["areas"])
 
 @router.get("/{area_id}/menus", response_model=List[ShopWithMenus])
-def read_menus_by_area(area_id: int, db: Session = Depends(get_db)):
-    return area_crud.get_menus_by_area(db, area_id)
\ No newline at end of file
+async def read_menus_by_area(
+    area_id: int,
+    skip: int = Query(0, ge=0),
+    limit: Optional[int] = Query(None, ge=1, le=100),
+    menus_per_shop: Optional[int] = Query(None, ge=1),
+    db: AsyncSession = Depends(get_async_read_db)
+):
+    """エリア内の店舗ごとのメニューを取得（skip / limit は店舗単位）"""
+    return await db.run_sync(
+        area_crud.get_menus_by_area, area_id, skip=skip, limit=limit, menus_per_shop=menus_per_shop
+    )
+
+@router.get("/{area_id}/popular/menus", response_model=List[PopularMenuResponse])
+async def read_popular_menus(
+    area_id: int,
+    response: Response,
+    limit: int = Query(POPULAR_TOP_N, ge=1, le=POPULAR_TOP_N),
+    db: AsyncSession = Depends(get_async_read_db)
+):
+    """エリアのお気に入り数の多いメニュー（エリアごとに保持しているランキングから返す）"""
+    http_cache.set_cache_headers(response, None)
+    return await popularity_crud.get_popular_menus(db, area_id, limit)
+
+@router.get("/{area_id}/popular/shops", response_model=List[PopularShopRead])
+async def read_popular_shops(
+    area_id: int,
+    response: Response,
+    limit: int = Query(POPULAR_TOP_N, ge=1, le=POPULAR_TOP_N),
+    db: AsyncSession = Depends(get_async_read_db)
+):
+    """エリアのお気に入り数の多い店舗"""
+    http_cache.set_cache_headers(response, None)
+    return await popularity_crud.get_popular_shops(db, area_id, limit)
@@ -1,9 +1,12 @@
 from datetime import timedelta
+from typing import Optional
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from ..database import get_db
+from .. import database
+from ..database import get_db, get_async_db
 from ..schemas.auth import (
   UserCreate, UserResponse, UserLogin, UserUpdate,
   ShopUserCreate, ShopUserResponse, ShopUserLogin,
@@ -14,126 +17,182 @@ from ..cruds.auth import (
   create_shop_user, authenticate_shop_user, get_shop_user_by_username, get_shop_user_by_email,
   update_user
 )
-from ..auth import create_access_token, verify_token, ACCESS_TOKEN_EXPIRE_MINUTES
+from ..hashing import hash_password
+from ..auth import (
+  create_access_token, verify_token_cached, principal_cache, Principal, ACCESS_TOKEN_EXPIRE_MINUTES
+)
 
 router = APIRouter()
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/login")
+# ヘッダーのないリクエストも受け付ける（ストリーム接続用）
+oauth2_scheme_optional = OAuth2PasswordBearer(tokenUrl="auth/login", auto_error=False)
 
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-  """現在のユーザーを取得（一般ユーザー）"""
-  credentials_exception = HTTPException(
+def _credentials_exception() -> HTTPException:
+  return HTTPException(
     status_code=status.HTTP_401_UNAUTHORIZED,
     detail="Could not validate credentials",
     headers={"WWW-Authenticate": "Bearer"},
   )
-  
+
+def _token_subject(token: str, user_type: str) -> str:
+  """トークンを検証してユーザー名（sub）を返す"""
   try:
-    payload = verify_token(token)
+    payload = verify_token_cached(token)
     username: str = payload.get("sub")
-    user_type: str = payload.get("user_type")
-    if username is None or user_type != "user":
-      raise credentials_exception
+    if username is None or payload.get("user_type") != user_type:
+      raise _credentials_exception()
   except:
-    raise credentials_exception
-  
+    raise _credentials_exception()
+  return username
+
+def _to_principal(user, user_type: str) -> Principal:
+  return Principal(id=user.id, username=user.username, user_type=user_type, shop_id=getattr(user, "shop_id", None))
+
+async def _load_principal(token: str, user_type: str, lookup, db: AsyncSession) -> Principal:
+  """キャッシュ済みのユーザーを返す（なければ DB から取得してキャッシュ）"""
+  username = _token_subject(token, user_type)
+  principal = principal_cache.get((user_type, username))
+  if principal is None:
+    user = await db.run_sync(lookup, username)
+    if user is None:
+      raise _credentials_exception()
+    principal = _to_principal(user, user_type)
+    principal_cache.set((user_type, username), principal)
+  return principal
+
+def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+  """現在のユーザーを取得（一般ユーザー）"""
+  username = _token_subject(token, "user")
   user = get_user_by_username(db, username=username)
   if user is None:
-    raise credentials_exception
+    raise _credentials_exception()
+  principal_cache.set(("user", username), _to_principal(user, "user"))
   return user
 
 def get_current_shop_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
   """現在の店舗ユーザーを取得"""
-  credentials_exception = HTTPException(
-    status_code=status.HTTP_401_UNAUTHORIZED,
-    detail="Could not validate credentials",
-    headers={"WWW-Authenticate": "Bearer"},
-  )
-  
-  try:
-    payload = verify_token(token)
-    username: str = payload.get("sub")
-    user_type: str = payload.get("user_type")
-    if username is None or user_type != "shop_user":
-      raise credentials_exception
-  except:
-    raise credentials_exception
-  
+  username = _token_subject(token, "shop_user")
   shop_user = get_shop_user_by_username(db, username=username)
   if shop_user is None:
-    raise credentials_exception
+    raise _credentials_exception()
+  principal_cache.set(("shop_user", username), _to_principal(shop_user, "shop_user"))
   return shop_user
 
-@router.post("/register", response_model=UserResponse)
-def register_user(user: UserCreate, db: Session = Depends(get_db)):
-  """一般ユーザー登録"""
+async def get_current_principal(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)) -> Principal:
+  """現在の一般ユーザーの id などを取得（キャッシュ済みなら DB を参照しない）"""
+  return await _load_principal(token, "user", get_user_by_username, db)
+
+async def get_current_shop_principal(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_async_db)) -> Principal:
+  """現在の店舗ユーザーの id・shop_id などを取得（キャッシュ済みなら DB を参照しない）"""
+  return await _load_principal(token, "shop_user", get_shop_user_by_username, db)
+
+async def get_optional_principal(
+  token: Optional[str] = Depends(oauth2_scheme_optional), db: AsyncSession = Depends(get_async_db)
+) -> Optional[Principal]:
+  """ログイン中の一般ユーザー（未ログイン・無効なトークン・店舗ユーザーは None）
+
+  誰でも見られる一覧に、ログイン中のユーザー向けの情報を付け加えるために使う。
+  """
+  if not token:
+    return None
+  try:
+    return await _load_principal(token, "user", get_user_by_username, db)
+  except HTTPException:
+    return None
+
+async def authenticate_stream(token: Optional[str]) -> Principal:
+  """ストリーム接続（SSE・WebSocket）の一般ユーザーを取得
+
+  接続が長く続くため、依存関係のセッションを使わず確認の間だけ DB セッションを開く。
+  """
+  if not token:
+    raise _credentials_exception()
+  async with database.AsyncSessionLocal() as db:
+    return await _load_principal(token, "user", get_user_by_username, db)
+
+def _check_user_conflicts(db: Session, username: str, email: str):
+  """一般ユーザー登録時の重複チェック"""
   # ユーザー名の重複チェック（一般ユーザー）
-  if get_user_by_username(db, user.username):
+  if get_user_by_username(db, username):
     raise HTTPException(
       status_code=400,
       detail="Username already registered as general user"
     )
   
   # ユーザー名の重複チェック（店舗ユーザー）
-  if get_shop_user_by_username(db, user.username):
+  if get_shop_user_by_username(db, username):
     raise HTTPException(
       status_code=400,
       detail="Username already registered as shop user"
     )
   
   # メールアドレスの重複チェック（一般ユーザー）
-  if get_user_by_email(db, user.email):
+  if get_user_by_email(db, email):
     raise HTTPException(
       status_code=400,
       detail="Email already registered as general user"
     )
   
   # メールアドレスの重複チェック（店舗ユーザー）
-  if get_shop_user_by_email(db, user.email):
+  if get_shop_user_by_email(db, email):
     raise HTTPException(
       status_code=400,
       detail="Email already registered as shop user"
     )
-  
-  return create_user(db=db, user=user)
 
-@router.post("/shop/register", response_model=ShopUserResponse)
-def register_shop_user(shop_user: ShopUserCreate, db: Session = Depends(get_db)):
-  """店舗ユーザー登録"""
+def _check_shop_user_conflicts(db: Session, username: str, email: str):
+  """店舗ユーザー登録時の重複チェック"""
   # ユーザー名の重複チェック（店舗ユーザー）
-  if get_shop_user_by_username(db, shop_user.username):
+  if get_shop_user_by_username(db, username):
     raise HTTPException(
       status_code=400,
       detail="Username already registered as shop user"
     )
   
   # ユーザー名の重複チェック（一般ユーザー）
-  if get_user_by_username(db, shop_user.username):
+  if get_user_by_username(db, username):
     raise HTTPException(
       status_code=400,
       detail="Username already registered as general user"
     )
   
   # メールアドレスの重複チェック（店舗ユーザー）
-  if get_shop_user_by_email(db, shop_user.email):
+  if get_shop_user_by_email(db, email):
     raise HTTPException(
       status_code=400,
       detail="Email already registered as shop user"
     )
   
   # メールアドレスの重複チェック（一般ユーザー）
-  if get_user_by_email(db, shop_user.email):
+  if get_user_by_email(db, email):
     raise HTTPException(
       status_code=400,
       detail="Email already registered as general user"
     )
-  
-  return create_shop_user(db=db, shop_user=shop_user)
+
+# パスワードのハッシュ化・検証は専用のプロセスプールで実行する（api/hashing.py）
+# ハッシュ化を待つ間に DB 接続を保持しないよう、先にトランザクションを終える
+@router.post("/register", response_model=UserResponse)
+async def register_user(user: UserCreate, db: AsyncSession = Depends(get_async_db)):
+  """一般ユーザー登録"""
+  await db.run_sync(_check_user_conflicts, user.username, user.email)
+  await db.commit()
+  hashed_password = await hash_password(user.password)
+  return await db.run_sync(create_user, user, hashed_password)
+
+@router.post("/shop/register", response_model=ShopUserResponse)
+async def register_shop_user(shop_user: ShopUserCreate, db: AsyncSession = Depends(get_async_db)):
+  """店舗ユーザー登録"""
+  await db.run_sync(_check_shop_user_conflicts, shop_user.username, shop_user.email)
+  await db.commit()
+  hashed_password = await hash_password(shop_user.password)
+  return await db.run_sync(create_shop_user, shop_user, hashed_password)
 
 @router.post("/login", response_model=Token)
-def login_for_access_token(user_login: UserLogin, db: Session = Depends(get_db)):
+async def login_for_access_token(user_login: UserLogin, db: AsyncSession = Depends(get_async_db)):
   """ログイン（一般ユーザー）"""
-  user = authenticate_user(db, user_login.email, user_login.password)
+  user = await authenticate_user(db, user_login.email, user_login.password)
   if not user:
     raise HTTPException(
       status_code=status.HTTP_401_UNAUTHORIZED,
@@ -147,9 +206,9 @@ def login_for_access_token(user_login: UserLogin, db: Session = Depends(get_db))
   return {"access_token": access_token, "token_type": "bearer", "user_type": "user"}
 
 @router.post("/shop/login", response_model=Token)
-def login_shop_user_for_access_token(shop_user_login: ShopUserLogin, db: Session = Depends(get_db)):
+async def login_shop_user_for_access_token(shop_user_login: ShopUserLogin, db: AsyncSession = Depends(get_async_db)):
   """ログイン（店舗ユーザー）"""
-  shop_user = authenticate_shop_user(db, shop_user_login.username, shop_user_login.password)
+  shop_user = await authenticate_shop_user(db, shop_user_login.username, shop_user_login.password)
   if not shop_user:
     raise HTTPException(
       status_code=status.HTTP_401_UNAUTHORIZED,
@@ -1,65 +1,337 @@
-from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlalchemy.orm import Session
-from typing import Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.background import BackgroundTask
+from pydantic import ValidationError
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Literal, Optional, Tuple
+import asyncio
+import os
+from api import http_cache, menu_io
+from api.cache import query_key, response_cache
 from api.schemas.menu import MenuCreate, MenuUpdate, MenuResponse, MenuListResponse
-from api.cruds.menu import MenuCRUD
-from ..database import get_db
-from api.routers.auth import get_current_shop_user
-from api.models.shop_users import ShopUsers
+from api.cruds.menu import (
+  MENU_BATCH_SIZE, AsyncMenuCRUD, MenuCRUD, MenuImportResult, menu_etag, menu_departure_query, menu_export_query, menu_response_key, menu_tombstone_query,
+)
+from api.cruds.image_variant import attach_image_variants
+from ..database import get_async_db, get_async_read_db, run_on_primary
+from api.auth import Principal
+from api.routers.auth import get_current_shop_principal, get_optional_principal
+from api.cruds.menu_favorites import AsyncMenuFavoritesCRUD
 
 router = APIRouter(prefix="/menus", tags=["menus"])
 
+# 一括取り込みの最大行数と、レスポンスに含めるエラーの最大件数
+MENU_IMPORT_MAX_ROWS = int(os.getenv("MENU_IMPORT_MAX_ROWS", "10000"))
+MAX_REPORTED_ERRORS = 100
+
+# ボディをストリーミングで読むため、OpenAPI にはリクエストボディの形式だけを記載する
+IMPORT_MENUS_REQUEST_BODY = {
+  "requestBody": {
+    "required": True,
+    "content": {
+      "text/csv": {"schema": {"type": "string"}},
+      "application/x-ndjson": {"schema": {"type": "string"}},
+    },
+  }
+}
+
+# GET /menus/export の同時実行数（超えたら 503）と、差分の起点を前倒しする秒数
+MENU_EXPORT_CONCURRENCY = int(os.getenv("MENU_EXPORT_CONCURRENCY", "2"))
+MENU_EXPORT_SINCE_OVERLAP = int(os.getenv("MENU_EXPORT_SINCE_OVERLAP", "60"))
+
+_export_slots: Optional[asyncio.Semaphore] = None
+
 @router.get("/", response_model=MenuListResponse)
-def get_menus(
+async def get_menus(
+  request: Request,
+  response: Response,
   page: int = Query(1, ge=1),
   per_page: int = Query(10, ge=1, le=100),
   category: Optional[str] = None,
   search: Optional[str] = None,
   shop_id: Optional[int] = None,
   available_only: bool = True,
-  db: Session = Depends(get_db)
+  sort: Optional[Literal["id", "newest", "price_asc", "price_desc", "popular"]] = None,
+  cursor: Optional[str] = None,
+  count: Literal["exact", "estimate", "none"] = "exact",
+  db: AsyncSession = Depends(get_async_read_db),
+  current_user: Optional[Principal] = Depends(get_optional_principal)
 ):
-  """メニュー一覧を取得"""
+  """メニュー一覧を取得
+
+  cursor を指定すると page の代わりに前回の next_cursor の位置から取得する。
+  count=none で総数の取得を省略、count=estimate で概算の総数を返す。
+  メニューの版が変わっていなければ、行を取得せずに 304 を返す
+  （検索結果は店舗名にも依存するため search 指定時は、お気に入り数は版に含まれないため
+  sort=popular の場合は ETag を付けない）。
+  ログイン中の一般ユーザーには、各メニューがお気に入りかどうか（is_favorite）も返す。
+  """
   skip = (page - 1) * per_page
-  crud = MenuCRUD(db)
+  crud = AsyncMenuCRUD(db)
+
+  # お気に入りの状態はユーザーごとに異なるため、共有キャッシュには保存させない
+  favorite_set = None
+  cache_control = http_cache.CATALOG_CACHE_CONTROL
+  if current_user is not None:
+    favorite_set = await AsyncMenuFavoritesCRUD.get_favorite_set(current_user.id)
+    cache_control = http_cache.PRIVATE_CACHE_CONTROL
+  response.headers["Vary"] = "Authorization"
+
+  etag = None
+  if search is None and sort != "popular":
+    version = await crud.get_catalog_version(shop_id)
+    etag = http_cache.make_etag("menus", version, query_key(
+      page=page, per_page=per_page, category=category, shop_id=shop_id,
+      available_only=available_only, sort=sort, cursor=cursor, count=count,
+    ), *((current_user.id, favorite_set.digest) if favorite_set is not None else ()))
+    if http_cache.etag_matches(request, etag):
+      not_modified = http_cache.not_modified(etag, cache_control)
+      not_modified.headers["Vary"] = "Authorization"
+      return not_modified
   
-  menus = crud.get_menus(
-    skip=skip, 
-    limit=per_page, 
-    category=category, 
-    search=search,
-    shop_id=shop_id,
-    available_only=available_only
-  )
-  total = crud.get_menus_count(
-    category=category, 
-    search=search,
-    shop_id=shop_id,
-    available_only=available_only
-  )
+  try:
+    menus, total, next_cursor = await crud.get_menus_page(
+      skip=skip, 
+      limit=per_page, 
+      category=category, 
+      search=search,
+      shop_id=shop_id,
+      available_only=available_only,
+      sort=sort,
+      cursor=cursor,
+      count=count
+    )
+  except ValueError:
+    raise HTTPException(status_code=400, detail="Invalid cursor")
+  await db.run_sync(attach_image_variants, menus, "image_url", "card")
+  if favorite_set is not None:
+    for menu in menus:
+      menu.is_favorite = menu.id in favorite_set
   
+  http_cache.set_cache_headers(response, etag, cache_control)
   return MenuListResponse(
     items=menus,
     total=total,
-    page=page,
-    per_page=per_page
+    page=None if cursor else page,
+    per_page=per_page,
+    next_cursor=next_cursor
+  )
+
+def _import_row(record: Dict, shop_id: int) -> Tuple[Optional[int], Dict]:
+  """取り込む1行を MenuCreate で検証し、(id, 書き込む値) を返す（shop_id は省略時に自店舗）"""
+  record = dict(record)
+  menu_id = record.pop("id", None)
+  record.setdefault("shop_id", shop_id)
+  menu = MenuCreate.model_validate(record)
+  if menu.shop_id != shop_id:
+    raise ValueError("自店舗以外のメニューは取り込めません")
+  if menu_id is not None:
+    if isinstance(menu_id, bool) or not str(menu_id).isdigit():
+      raise ValueError("id は整数で指定してください")
+    menu_id = int(menu_id)
+  return menu_id, menu.model_dump()
+
+def _error_message(error: Exception) -> str:
+  if isinstance(error, ValidationError):
+    return "; ".join(f"{'.'.join(map(str, e['loc']))}: {e['msg']}" for e in error.errors(include_url=False))
+  return str(error)
+
+@router.post("/bulk", openapi_extra=IMPORT_MENUS_REQUEST_BODY)
+async def import_menus(
+  request: Request,
+  atomic: bool = True,
+  db: AsyncSession = Depends(get_async_db),
+  current_user: Principal = Depends(get_current_shop_principal)
+):
+  """自店舗のメニューを一括で取り込む（CSV・JSON Lines）
+
+  1行ずつ MenuCreate で検証しながら MENU_BATCH_SIZE 行ごとにまとめて書き込み、最後に1回だけコミットする。
+  id を指定した行は自店舗の既存メニューを置き換え、shop_id は省略すると自店舗になる。
+  atomic=true では1行でもエラーがあれば何も書き込まずに 422 を返し、
+  atomic=false ではエラーの行だけを飛ばして取り込む。
+  """
+  format = menu_io.detect_format(request.headers.get("content-type"))
+  crud = AsyncMenuCRUD(db)
+  result = MenuImportResult()
+  rows, batch = 0, []
+  async for line, record, error in menu_io.iter_records(request, format):
+    rows += 1
+    if rows > MENU_IMPORT_MAX_ROWS:
+      await crud.finish_import(result, commit=False)
+      raise HTTPException(status_code=413, detail=f"一度に取り込めるのは {MENU_IMPORT_MAX_ROWS} 行までです")
+    if error is None:
+      try:
+        menu_id, values = _import_row(record, current_user.shop_id)
+      except ValueError as e:  # ValidationError も ValueError のサブクラス
+        error = e
+    if error is not None:
+      result.errors.append((line, _error_message(error)))
+      continue
+    batch.append((line, menu_id, values))
+    if len(batch) >= MENU_BATCH_SIZE:
+      # atomic でエラーが出た後は書き込まず、確認だけを続けてエラーを全て報告する
+      await crud.import_menus(current_user.shop_id, batch, result, write=not (atomic and result.errors))
+      batch = []
+  if batch:
+    await crud.import_menus(current_user.shop_id, batch, result, write=not (atomic and result.errors))
+
+  committed = not (atomic and result.errors)
+  await crud.finish_import(result, commit=committed)
+  return JSONResponse(
+    status_code=200 if committed else 422,
+    content={
+      "committed": committed,
+      "rows": rows,
+      "created": result.created if committed else 0,
+      "updated": result.updated if committed else 0,
+      "error_count": len(result.errors),
+      "errors": [{"line": line, "error": message} for line, message in sorted(result.errors)[:MAX_REPORTED_ERRORS]],
+    },
   )
 
+@router.get("/bulk")
+async def export_menus(
+  format: Literal["csv", "ndjson"] = "ndjson",
+  db: AsyncSession = Depends(get_async_read_db),
+  current_user: Principal = Depends(get_current_shop_principal)
+):
+  """自店舗の全メニューを書き出す（POST /menus/bulk でそのまま取り込める形式）
+
+  GET /menus/export と同じく、サーバーサイドカーソルで MENU_BATCH_SIZE 行ずつ ORM オブジェクトを作らずに読んで送る。
+  """
+  crud = AsyncMenuCRUD(db)
+  shop_id = current_user.shop_id
+  query = menu_export_query(menu_io.MENU_EXPORT_FIELDS, shop_id)
+
+  async def body():
+    if format == "csv":
+      yield menu_io.csv_header()
+    async for rows in crud.stream(query):
+      records = [menu_io.menu_record(row) for row in rows]
+      yield menu_io.csv_lines(records) if format == "csv" else menu_io.ndjson_lines(records)
+
+  return StreamingResponse(
+    body(),
+    media_type=menu_io.MEDIA_TYPES[format],
+    headers={"Content-Disposition": f'attachment; filename="menus-shop{shop_id}.{format}"'},
+  )
+
+@router.get("/export")
+async def export_catalog(
+  format: Literal["csv", "ndjson"] = "ndjson",
+  shop_id: Optional[int] = None,
+  area_id: Optional[int] = None,
+  category: Optional[str] = None,
+  since: Optional[datetime] = None,
+  changes: bool = False,
+  db: AsyncSession = Depends(get_async_read_db)
+):
+  """メニューを全件書き出す（NDJSON・CSV）
+
+  サーバーサイドカーソルで MENU_BATCH_SIZE 行ずつ読んで送るため、件数によらずメモリ使用量は一定。
+  since を指定すると、その日時以降に追加・更新したメニューだけを返す。
+  changes=true（since が必要）では、since 以降に削除したメニューも deleted=true の行として最後に返す。
+  shop_id・area_id・category で絞り込んだ場合は、店舗・エリア・カテゴリーの変更で条件から外れたメニューも
+  deleted=true の行として返す。
+  次回の since には X-Next-Since ヘッダーの値を使う（コミットの遅れを見込んで少し前倒ししてある）。
+  タイムゾーン付きの since は UTC に変換して比較する。
+  """
+  global _export_slots
+  if changes and since is None:
+    raise HTTPException(status_code=400, detail="changes=true には since が必要です")
+  if since is not None and since.tzinfo is not None:
+    since = since.astimezone(timezone.utc).replace(tzinfo=None)
+  if _export_slots is None:
+    _export_slots = asyncio.Semaphore(MENU_EXPORT_CONCURRENCY)
+  # 枠は await を挟まずに確認して取る（空いていれば acquire は待たずに返るため、
+  # 同時に届いた書き出しが確認だけ通り、枠を待ちながらレプリカの接続を持ち続けることはない）
+  if _export_slots.locked():
+    raise HTTPException(status_code=503, detail="Too many exports in progress", headers={"Retry-After": "10"})
+  await _export_slots.acquire()
+  released = False
+
+  def release():
+    # 送信の終了・送信されずに終わったレスポンスのどちらから呼ばれても1回だけ戻す
+    nonlocal released
+    if not released:
+      released = True
+      _export_slots.release()
+
+  crud = AsyncMenuCRUD(db)
+  try:
+    next_since = await crud.get_database_time() - timedelta(seconds=MENU_EXPORT_SINCE_OVERLAP)
+  except BaseException:
+    release()
+    raise
+  fields = menu_io.MENU_CHANGE_FIELDS if changes else menu_io.MENU_EXPORT_FIELDS
+  query = menu_export_query(menu_io.MENU_EXPORT_FIELDS, shop_id, area_id, category, since)
+
+  def lines(records):
+    return menu_io.csv_lines(records, fields) if format == "csv" else menu_io.ndjson_lines(records)
+
+  async def body():
+    try:
+      if format == "csv":
+        yield menu_io.csv_header(fields)
+      async for rows in crud.stream(query):
+        yield lines([menu_io.change_record(row) if changes else menu_io.menu_record(row) for row in rows])
+      if changes:
+        async for rows in crud.stream(menu_tombstone_query(since, shop_id, area_id)):
+          yield lines([menu_io.tombstone_record(row) for row in rows])
+        if shop_id is not None or area_id is not None or category:
+          async for rows in crud.stream(menu_departure_query(since, shop_id, area_id, category)):
+            yield lines([menu_io.tombstone_record(row) for row in rows])
+    finally:
+      release()
+
+  return StreamingResponse(
+    body(),
+    background=BackgroundTask(release),
+    media_type=menu_io.MEDIA_TYPES[format],
+    headers={
+      "Content-Disposition": f'attachment; filename="menus.{format}"',
+      "X-Next-Since": next_since.isoformat(),
+    },
+  )
+
+def _load_menu_response(db, menu_id: int) -> Optional[dict]:
+  """メニュー1件のレスポンスのボディ（見つからなければ None）"""
+  menu = MenuCRUD(db).get_menu(menu_id)
+  if menu is None:
+    return None
+  attach_image_variants(db, [menu], "image_url", "full")
+  return MenuResponse.model_validate(menu).model_dump(mode="json")
+
+async def menu_detail(request: Request, menu_id: int) -> Response:
+  """メニュー1件のレスポンス（/menu/{id} と /menus/{id} で共用）
+
+  キャッシュ済みならそれを返し、If-None-Match が一致する場合は 304 を返す。
+  キャッシュは全クライアントで共有するため、遅れたレプリカではなくプライマリから読み込む。
+  """
+  key = menu_response_key(menu_id)
+  data = await response_cache.get(key)
+  if data is None:
+    data = await run_on_primary(_load_menu_response, menu_id)
+    if data is None:
+      raise HTTPException(status_code=404, detail="Menu not found")
+    await response_cache.set(key, data)
+  etag = menu_etag(data)
+  if http_cache.etag_matches(request, etag):
+    return http_cache.not_modified(etag)
+  return JSONResponse(data, headers=http_cache.cache_headers(etag))
+
 @router.get("/{menu_id}", response_model=MenuResponse)
-def get_menu(menu_id: int, db: Session = Depends(get_db)):
+async def get_menu(request: Request, menu_id: int):
   """メニューの詳細を取得"""
-  crud = MenuCRUD(db)
-  menu = crud.get_menu(menu_id)
-  if menu is None:
-    raise HTTPException(status_code=404, detail="Menu not found")
-  return menu
+  return await menu_detail(request, menu_id)
 
 @router.post("/", response_model=MenuResponse)
 @router.post("/", response_model=MenuResponse)
-def create_menu(
+async def create_menu(
   menu: MenuCreate,
-  db: Session = Depends(get_db),
-  current_user: ShopUsers = Depends(get_current_shop_user)
+  db: AsyncSession = Depends(get_async_db),
+  current_user: Principal = Depends(get_current_shop_principal)
 ):
   """新しいメニューを作成"""
   # 店舗ユーザーが自分の店舗のメニューのみ作成できるようにチェック
@@ -70,29 +342,29 @@ def create_menu(
   if not menu.shop_id:
     raise HTTPException(status_code=400, detail="shop_id is required")
 
-  crud = MenuCRUD(db)
-  return crud.create_menu(menu)
+  crud = AsyncMenuCRUD(db)
+  return await crud.create_menu(menu)
 
 @router.post("/test", response_model=MenuResponse)
-def create_menu_test(menu: MenuCreate, db: Session = Depends(get_db)):
+async def create_menu_test(menu: MenuCreate, db: AsyncSession = Depends(get_async_db)):
   """新しいメニューを作成（テスト用、認証なし）"""
-  crud = MenuCRUD(db)
-  return crud.create_menu(menu)
+  crud = AsyncMenuCRUD(db)
+  return await crud.create_menu(menu)
 
 @router.put("/{menu_id}", response_model=MenuResponse)
-def update_menu(menu_id: int, menu: MenuUpdate, db: Session = Depends(get_db)):
+async def update_menu(menu_id: int, menu: MenuUpdate, db: AsyncSession = Depends(get_async_db)):
   """メニューを更新"""
-  crud = MenuCRUD(db)
-  updated_menu = crud.update_menu(menu_id, menu)
+  crud = AsyncMenuCRUD(db)
+  updated_menu = await crud.update_menu(menu_id, menu)
   if updated_menu is None:
     raise HTTPException(status_code=404, detail="Menu not found")
   return updated_menu
 
 @router.delete("/{menu_id}")
-def delete_menu(menu_id: int, db: Session = Depends(get_db)):
+async def delete_menu(menu_id: int, db: AsyncSession = Depends(get_async_db)):
   """メニューを削除"""
-  crud = MenuCRUD(db)
-  success = crud.delete_menu(menu_id)
+  crud = AsyncMenuCRUD(db)
+  success = await crud.delete_menu(menu_id)
   if not success:
     raise HTTPException(status_code=404, detail="Menu not found")
   return {"message": "Menu deleted successfully"}
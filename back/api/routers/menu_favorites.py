@@ -1,61 +1,68 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List
-from ..schemas.menu_favorites import MenuFavoritesBase, MenuFavoritesResponse
-from ..cruds.menu_favorites import MenuFavoritesCRUD
-from ..database import get_db
+from ..schemas.menu_favorites import MENU_FAVORITE_STATUS_MAX_IDS, MenuFavoritesBase, MenuFavoritesResponse, MenuFavoriteStatuses
+from ..cruds.menu_favorites import AsyncMenuFavoritesCRUD
+from ..database import get_async_db, get_async_read_db
 
 router = APIRouter(prefix="/menu_favorites", tags=["menu_favorites"])
 
 @router.post("/", response_model=MenuFavoritesResponse)
-def add_favorite(
+async def add_favorite(
   favorite: MenuFavoritesBase, 
-  db: Session = Depends(get_db)
+  db: AsyncSession = Depends(get_async_db)
 ):
   """メニューをお気に入りに追加"""
-  crud = MenuFavoritesCRUD(db)
+  crud = AsyncMenuFavoritesCRUD(db)
   
-  existing = crud.get_favorite(favorite.user_id, favorite.menu_id)
+  existing = await crud.get_favorite(favorite.user_id, favorite.menu_id)
   if existing:
       raise HTTPException(status_code=400, detail="Already in favorites")
   
-  created_favorite = crud.add_favorite(favorite)
+  created_favorite = await crud.add_favorite(favorite)
   return created_favorite
 
 @router.delete("/")
-def remove_favorite(
+async def remove_favorite(
   user_id: int, 
   menu_id: int, 
-  db: Session = Depends(get_db)
+  db: AsyncSession = Depends(get_async_db)
 ):
   """お気に入りから削除"""
-  crud = MenuFavoritesCRUD(db)
+  crud = AsyncMenuFavoritesCRUD(db)
   
-  favorite = crud.get_favorite(user_id, menu_id)
+  favorite = await crud.get_favorite(user_id, menu_id)
   if not favorite:
     raise HTTPException(status_code=404, detail="Favorite not found")
   
-  crud.remove_favorite(user_id, menu_id)
+  await crud.remove_favorite(user_id, menu_id)
   return {"message": "Removed from favorites"}
 
 @router.get("/user/{user_id}", response_model=List[MenuFavoritesResponse])
-def get_user_favorites(
+async def get_user_favorites(
   user_id: int, 
-  db: Session = Depends(get_db)
+  db: AsyncSession = Depends(get_async_read_db)
 ):
   """ユーザーのお気に入り一覧を取得"""
-  crud = MenuFavoritesCRUD(db)
-  favorites = crud.get_user_favorites(user_id)
+  crud = AsyncMenuFavoritesCRUD(db)
+  favorites = await crud.get_user_favorites(user_id)
   return favorites
 
 @router.get("/check")
-def check_favorite(
+async def check_favorite(
   user_id: int, 
-  menu_id: int, 
-  db: Session = Depends(get_db)
+  menu_id: int
 ):
   """メニューがお気に入りかどうか確認"""
-  crud = MenuFavoritesCRUD(db)
-  favorite = crud.get_favorite(user_id, menu_id)
-  return {"is_favorite": favorite is not None}
+  favorite_set = await AsyncMenuFavoritesCRUD.get_favorite_set(user_id)
+  return {"is_favorite": menu_id in favorite_set}
+
+@router.get("/status", response_model=MenuFavoriteStatuses)
+async def check_favorite_statuses(
+  user_id: int,
+  menu_ids: List[int] = Query(..., min_length=1, max_length=MENU_FAVORITE_STATUS_MAX_IDS)
+):
+  """複数のメニューのお気に入り状態をまとめて確認（?menu_ids=1&menu_ids=2 のように指定）"""
+  favorite_set = await AsyncMenuFavoritesCRUD.get_favorite_set(user_id)
+  return MenuFavoriteStatuses(user_id=user_id, statuses=favorite_set.statuses(menu_ids))
 
@@ -1,16 +1,10 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Request
 from ..schemas.menu import MenuResponse
-from ..cruds.menu import MenuCRUD
-from ..database import get_db
+from .menu import menu_detail
 
 router = APIRouter(prefix="/menu", tags=["menu-single"])
 
 @router.get("/{menu_id}", response_model=MenuResponse)
-def get_menu(menu_id: int, db: Session = Depends(get_db)):
+async def get_menu(request: Request, menu_id: int):
   """メニューの詳細を取得（単数形パス）"""
-  crud = MenuCRUD(db)
-  menu = crud.get_menu(menu_id)
-  if menu is None:
-    raise HTTPException(status_code=404, detail="Menu not found")
-  return menu
+  return await menu_detail(request, menu_id)
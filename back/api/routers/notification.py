@@ -1,43 +1,195 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from typing import List
-from ..schemas.notification import NotificationCreate, NotificationOut
-from ..cruds.notification import NotificationCRUD
-from ..database import get_db
+import asyncio
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, WebSocket, WebSocketDisconnect, status as http_status
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Literal, Optional
+from .. import broadcasts, realtime
+from ..schemas.notification import (
+  BroadcastCreate, BroadcastOut, NotificationCreate, NotificationOut, NotificationPage, NotificationReadRequest,
+  NotificationReadResult, UnreadCount,
+)
+from ..cruds import notification_broadcast as broadcast_crud
+from ..cruds.notification import AsyncNotificationCRUD
+from ..database import get_async_db, get_async_read_db
+from ..auth import Principal
+from ..routers.auth import authenticate_stream, get_current_principal, get_current_shop_principal, oauth2_scheme_optional
 
 router = APIRouter(prefix="/notifications", tags=["notifications"])
 
-# 通知を作成
+# 通知を作成（店舗ユーザーのみ、送信元は自店舗になる）
 @router.post("/", response_model=NotificationOut, status_code=201)
-def create_notification(notification: NotificationCreate, db: Session = Depends(get_db)):
-  crud = NotificationCRUD(db)
-  return crud.create_notification(notification)
-
-# 通知一覧取得（ユーザー別）
-@router.get("/user/{user_id}", response_model=List[NotificationOut])
-def get_user_notifications(user_id: int, db: Session = Depends(get_db)):
-  crud = NotificationCRUD(db)
-  notifications = crud.get_user_notifications(user_id)
-  if not notifications:
-    raise HTTPException(status_code=404, detail="Notification not found")
-  return notifications
+async def create_notification(
+  notification: NotificationCreate,
+  db: AsyncSession = Depends(get_async_db),
+  current_shop_user: Principal = Depends(get_current_shop_principal)
+):
+  notification = notification.model_copy(update={"shop_id": current_shop_user.shop_id, "shop_user_id": current_shop_user.id})
+  crud = AsyncNotificationCRUD(db)
+  created = await crud.create_notification(notification)
+  await realtime.hub.publish_notifications([created])
+  return created
+
+# お気に入り登録したユーザー全員へのお知らせ（配信はジョブとして後から行う）
+@router.post("/broadcasts", response_model=BroadcastOut, status_code=202)
+async def create_broadcast(
+  data: BroadcastCreate,
+  db: AsyncSession = Depends(get_async_db),
+  current_shop_user: Principal = Depends(get_current_shop_principal)
+):
+  """
+  ジョブを登録してすぐに返す。配信の進捗は GET /notifications/broadcasts/{broadcast_id} で確認する。
+  """
+  broadcast = await db.run_sync(
+    broadcast_crud.create_broadcast, current_shop_user.shop_id, current_shop_user.id, data.contents
+  )
+  broadcasts.enqueue(broadcast.id)
+  return broadcast
+
+# お知らせの配信状況（自店舗のもののみ）
+@router.get("/broadcasts/{broadcast_id}", response_model=BroadcastOut)
+async def get_broadcast(
+  broadcast_id: int,
+  db: AsyncSession = Depends(get_async_db),
+  current_shop_user: Principal = Depends(get_current_shop_principal)
+):
+  broadcast = await db.run_sync(broadcast_crud.get_broadcast, broadcast_id, current_shop_user.shop_id)
+  if broadcast is None:
+    raise HTTPException(status_code=404, detail="Broadcast not found")
+  return broadcast
+
+# 新着通知の受信（Server-Sent Events）
+@router.get("/stream")
+async def stream_notifications(
+  token: Optional[str] = Depends(oauth2_scheme_optional),
+  access_token: Optional[str] = None,
+  last_event_id: Optional[int] = None,
+  last_event_id_header: Optional[int] = Header(None, alias="Last-Event-ID")
+):
+  """
+  通知が作成されるたびに notification イベントを送る（id は通知の id）。
+  EventSource はヘッダーを付けられないため、トークンは access_token クエリでも受け付ける。
+  再接続時はブラウザが送る Last-Event-ID（または last_event_id クエリ）より後の通知から送る。
+  resync イベントが届いた場合は受信箱を取り直す。
+  """
+  current_user = await authenticate_stream(token or access_token)
+  resume_from = last_event_id_header if last_event_id_header is not None else last_event_id
+
+  async def events():
+    yield f"retry: {int(realtime.REALTIME_HEARTBEAT_SECONDS * 1000)}\n\n"
+    async for event in realtime.stream(current_user.id, resume_from):
+      yield realtime.format_sse(event)
+
+  return StreamingResponse(
+    events(),
+    media_type="text/event-stream",
+    # プロキシでバッファリング・キャッシュされないようにする
+    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+  )
+
+# 新着通知の受信（WebSocket）
+@router.websocket("/ws")
+async def notifications_websocket(
+  websocket: WebSocket,
+  access_token: Optional[str] = None,
+  last_event_id: Optional[int] = None
+):
+  """
+  SSE と同じイベントを JSON で送る（{"type": "notification" | "resync" | "ping", "id": ..., "data": ...}）。
+  """
+  try:
+    current_user = await authenticate_stream(access_token)
+  except HTTPException:
+    await websocket.close(code=http_status.WS_1008_POLICY_VIOLATION)
+    return
+  await websocket.accept()
+
+  async def send_events():
+    async for event in realtime.stream(current_user.id, last_event_id):
+      await websocket.send_json({key: event[key] for key in ("type", "id", "data") if key in event})
+
+  async def wait_for_disconnect():
+    # クライアントからのメッセージは使わず、切断だけを待つ
+    try:
+      while True:
+        await websocket.receive_text()
+    except WebSocketDisconnect:
+      pass
+
+  sender = asyncio.create_task(send_events())
+  receiver = asyncio.create_task(wait_for_disconnect())
+  done, pending = await asyncio.wait({sender, receiver}, return_when=asyncio.FIRST_COMPLETED)
+  for task in pending:
+    task.cancel()
+  await asyncio.gather(*pending, return_exceptions=True)
+  if sender in done:
+    sender.result()
+    # サーバーの終了でストリームが閉じた
+    await websocket.close(code=http_status.WS_1001_GOING_AWAY)
+
+# 受信箱（ログイン中のユーザーの通知を新しい順に取得）
+@router.get("/", response_model=NotificationPage)
+async def get_inbox(
+  limit: int = Query(20, ge=1, le=100),
+  cursor: Optional[str] = None,
+  status: Optional[Literal["unread", "read"]] = None,
+  db: AsyncSession = Depends(get_async_read_db),
+  current_user: Principal = Depends(get_current_principal)
+):
+  """
+  続きがある場合は next_cursor を返すので、次のリクエストの cursor に指定する。
+  通知がなければ空の items を返す。
+  """
+  crud = AsyncNotificationCRUD(db)
+  try:
+    notifications, next_cursor = await crud.get_inbox_page(current_user.id, limit, cursor, status)
+  except ValueError:
+    raise HTTPException(status_code=400, detail="Invalid cursor")
+  unread_count = await crud.count_unread(current_user.id)
+  return NotificationPage(items=notifications, next_cursor=next_cursor, unread_count=unread_count)
+
+# 未読の件数（ヘッダーのバッジ用）
+@router.get("/unread_count", response_model=UnreadCount)
+async def get_unread_count(
+  db: AsyncSession = Depends(get_async_read_db),
+  current_user: Principal = Depends(get_current_principal)
+):
+  crud = AsyncNotificationCRUD(db)
+  return UnreadCount(unread_count=await crud.count_unread(current_user.id))
+
+# 通知を既読に変更（id を指定してまとめて）
+@router.put("/read", response_model=NotificationReadResult)
+async def mark_many_as_read(
+  data: NotificationReadRequest,
+  db: AsyncSession = Depends(get_async_db),
+  current_user: Principal = Depends(get_current_principal)
+):
+  crud = AsyncNotificationCRUD(db)
+  updated = await crud.mark_many_as_read(current_user.id, data.ids)
+  return NotificationReadResult(updated=updated, unread_count=await crud.count_unread(current_user.id))
 
 # 通知を既読に変更（個別）
 @router.put("/read/{notification_id}", response_model=NotificationOut)
-def mark_as_read(notification_id: int, db: Session = Depends(get_db)):
-  crud = NotificationCRUD(db)
-  updated = crud.mark_as_read(notification_id)
+async def mark_as_read(
+  notification_id: int,
+  db: AsyncSession = Depends(get_async_db),
+  current_user: Principal = Depends(get_current_principal)
+):
+  crud = AsyncNotificationCRUD(db)
+  updated = await crud.mark_as_read(current_user.id, notification_id)
   if not updated:
     raise HTTPException(status_code=404, detail="Notification not found")
   return updated
 
-# 通知を既読に変更（一括）
-@router.put("/read_all/{user_id}")
-def mark_all_as_read(user_id: int, db: Session = Depends(get_db)):
+# 通知を既読に変更（全件）
+@router.put("/read_all", response_model=NotificationReadResult)
+async def mark_all_as_read(
+  db: AsyncSession = Depends(get_async_db),
+  current_user: Principal = Depends(get_current_principal)
+):
   """
   通知一覧ページを開いたタイミングで呼び出す。
   ユーザーのすべての通知を既読にします。
   """
-  crud = NotificationCRUD(db)
-  crud.mark_all_as_read(user_id)
-  return {"message": "All notifications marked as read"}
\ No newline at end of file
+  crud = AsyncNotificationCRUD(db)
+  updated = await crud.mark_all_as_read(current_user.id)
+  return NotificationReadResult(updated=updated, unread_count=0)
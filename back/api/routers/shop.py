@@ -1,51 +1,99 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import JSONResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
+from typing import Literal, Optional
+from .. import http_cache
+from ..cache import query_key, response_cache
 from ..cruds import shop as cruds
+from ..cruds.image_variant import attach_image_variants
 from ..schemas.shop import ShopBase, ShopCreate, ShopRead, ShopUpdate
-from ..database import get_db
-from ..models import Users, ShopUsers
-from ..routers.auth import get_current_user
+from ..database import get_async_db, run_on_primary
+from ..auth import Principal
+from ..models import ShopUsers
+from ..routers.auth import get_current_principal
 router = APIRouter(prefix="/shops", tags=["shops"])
 
 # 新しいショップを作成し、作成された内容を返す
 @router.post("/", response_model=ShopRead)
-def create_shop(
+async def create_shop(
     shop: ShopCreate,
-    db: Session = Depends(get_db),
-  current_user: Users = Depends(get_current_user)
+    db: AsyncSession = Depends(get_async_db),
+  current_user: Principal = Depends(get_current_principal)
 ):
-    db_shop = cruds.create_shop(db, shop)
+    db_shop = await cruds.create_shop(db, shop)
     # --- ユーザーと店舗の紐付け ---
     shop_user = ShopUsers(user_id=current_user.id, shop_id=db_shop.id)
     db.add(shop_user)
-    db.commit()
+    await db.commit()
     return db_shop
 
+# キャッシュするレスポンスのボディ（全クライアントで共有するため、遅れたレプリカではなくプライマリから読み込む）
+def _load_shops_page(db: Session, skip: int, limit: int, cursor: Optional[str], sort: Optional[str]) -> dict:
+  shops, next_cursor = cruds.get_shops_page(db, skip, limit, cursor, sort)
+  attach_image_variants(db, shops, "image_path", "card")
+  return {
+    "items": [ShopRead.model_validate(shop).model_dump(mode="json") for shop in shops],
+    "next_cursor": next_cursor,
+  }
+
+def _load_shop(db: Session, shop_id: int) -> Optional[dict]:
+  shop = cruds.get_shop_by_id(db, shop_id)
+  if not shop:
+    return None
+  attach_image_variants(db, [shop], "image_path", "full")
+  return ShopRead.model_validate(shop).model_dump(mode="json")
+
 # 全ショップの一覧を取得（最大100件まで）
+# 続きがある場合は X-Next-Cursor ヘッダーに次ページのカーソルを返す
+# sort=popular でお気に入りの多い順（順位はレスポンスのキャッシュの期間だけ遅れることがある）
 @router.get("/", response_model=list[ShopRead])
-def read_shops(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-  return cruds.get_shops(db, skip, limit)
+async def read_shops(
+  skip: int = 0,
+  limit: int = 100,
+  cursor: Optional[str] = None,
+  sort: Optional[Literal["id", "popular"]] = None,
+):
+  version = await response_cache.version(cruds.SHOP_LIST_NAMESPACE)
+  key = f"{cruds.SHOP_LIST_NAMESPACE}:v{version}:" + query_key(skip=skip, limit=limit, cursor=cursor, sort=sort)
+  cached = await response_cache.get(key)
+  if cached is None:
+    try:
+      cached = await run_on_primary(_load_shops_page, skip, limit, cursor, sort)
+    except ValueError:
+      raise HTTPException(status_code=400, detail="Invalid cursor")
+    await response_cache.set(key, cached)
+  headers = {"X-Next-Cursor": cached["next_cursor"]} if cached["next_cursor"] else None
+  return JSONResponse(cached["items"], headers=headers)
 
 # /shops/1 などで1件のショップを取得
+# If-None-Match が一致する場合は 304 を返す
 @router.get("/{shop_id}", response_model=ShopRead)
-def read_shop(shop_id: int, db: Session = Depends(get_db)):
-  shop = cruds.get_shop_by_id(db, shop_id)
-  if not shop:
-    raise HTTPException(status_code=404, detail="Shop not found")
-  return shop
+async def read_shop(request: Request, shop_id: int):
+  key = cruds.shop_response_key(shop_id)
+  data = await response_cache.get(key)
+  if data is None:
+    data = await run_on_primary(_load_shop, shop_id)
+    if data is None:
+      raise HTTPException(status_code=404, detail="Shop not found")
+    await response_cache.set(key, data)
+  etag = cruds.shop_etag(data)
+  if http_cache.etag_matches(request, etag):
+    return http_cache.not_modified(etag)
+  return JSONResponse(data, headers=http_cache.cache_headers(etag))
 
 # /shops/{shop_id} にアクセスで、該当IDのショップが更新される
 @router.put("/{shop_id}", response_model=ShopRead)
-def update_shop(shop_id: int, shop: ShopUpdate, db: Session = Depends(get_db)):
-  updated_shop = cruds.update_shop(db, shop_id, shop)
+async def update_shop(shop_id: int, shop: ShopUpdate, db: AsyncSession = Depends(get_async_db)):
+  updated_shop = await cruds.update_shop(db, shop_id, shop)
   if updated_shop is None:
     raise HTTPException(status_code=404, detail="Shop not found")
   return updated_shop
 
 # /shops/{shop_id} でショップを削除
 @router.delete("/{shop_id}", response_model=ShopRead)
-def delete_shop(shop_id: int, db: Session = Depends(get_db)):
-  deleted_shop = cruds.delete_shop(db, shop_id)
+async def delete_shop(shop_id: int, db: AsyncSession = Depends(get_async_db)):
+  deleted_shop = await cruds.delete_shop(db, shop_id)
   if deleted_shop is None:
     raise HTTPException(status_code=404, detail="Shop not found")
   return deleted_shop
\ No newline at end of file
@@ -1,97 +1,97 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException
+import anyio
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Request
 from fastapi.responses import JSONResponse
-import os
-import uuid
-from pathlib import Path
-import shutil
+from sqlalchemy.ext.asyncio import AsyncSession
+from .. import images
+from ..cruds.image_references import count_image_references, remove_unreferenced_images
+from ..cruds.image_variant import get_image_variants
+from ..database import get_async_db
+from ..image_store import image_store
+from ..uploads import receive_image
 
 router = APIRouter(prefix="/upload", tags=["upload"])
 
-# アップロード用ディレクトリ
-UPLOAD_DIR = Path(__file__).parent.parent.parent / "static" / "images"
+# アップロード用ディレクトリ（画像は内容の SHA-256 で名前を付けて保存する）
+UPLOAD_DIR = image_store.root
 UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
 
-# 許可する画像ファイルの拡張子
-ALLOWED_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".webp"}
+# ファイルサイズ制限（5MB）
+MAX_FILE_SIZE = 5 * 1024 * 1024  # 5MB
 
-def is_allowed_file(filename: str) -> bool:
-    """ファイル拡張子が許可されているかチェック"""
-    return Path(filename).suffix.lower() in ALLOWED_EXTENSIONS
+# multipart を自前でストリーミング解析するため、OpenAPI にはリクエストボディの形式だけを記載する
+UPLOAD_IMAGE_REQUEST_BODY = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["file"],
+                    "properties": {"file": {"type": "string", "format": "binary"}},
+                }
+            }
+        },
+    }
+}
 
-@router.post("/image")
-async def upload_image(file: UploadFile = File(...)):
-    """画像ファイルをアップロード"""
-    # ファイルサイズ制限（5MB）
-    MAX_FILE_SIZE = 5 * 1024 * 1024  # 5MB
-    
-    # ファイルが選択されているかチェック
-    if not file.filename:
-        raise HTTPException(status_code=400, detail="ファイルが選択されていません")
-    
-    # ファイル拡張子チェック
-    if not is_allowed_file(file.filename):
-        raise HTTPException(
-            status_code=400, 
-            detail="許可されていないファイル形式です。JPG, JPEG, PNG, GIF, WebPのみ対応しています"
-        )
-    
-    # ファイルサイズチェック
-    file_content = await file.read()
-    if len(file_content) > MAX_FILE_SIZE:
-        raise HTTPException(status_code=400, detail="ファイルサイズが大きすぎます（最大5MB）")
-    
-    # ユニークなファイル名を生成
-    file_extension = Path(file.filename).suffix
-    unique_filename = f"{uuid.uuid4()}{file_extension}"
-    file_path = UPLOAD_DIR / unique_filename
+@router.post("/image", openapi_extra=UPLOAD_IMAGE_REQUEST_BODY)
+async def upload_image(request: Request, background_tasks: BackgroundTasks, db: AsyncSession = Depends(get_async_db)):
+    """画像ファイルをアップロード
+
+    ボディをチャンクごとに受信して一時ファイルに書き込み、5MB を超えた時点で打ち切る。
+    形式は拡張子ではなく先頭バイトで判定する。
+    同じ画像が保存済みなら新たに保存せず、保存済みの画像の URL を返す。
+    サイズ・形式違いの派生画像はレスポンスを返した後にバックグラウンドで生成する。
+    """
+    stored = await receive_image(request, "file", image_store, MAX_FILE_SIZE)
     
-    try:
-        # ファイルを保存
-        with open(file_path, "wb") as buffer:
-            buffer.write(file_content)
-        
-        # 保存されたファイルのURLを返す
-        file_url = f"/static/images/{unique_filename}"
-        
-        return JSONResponse(
-            status_code=200,
-            content={
-                "success": True,
-                "message": "ファイルが正常にアップロードされました",
-                "url": file_url,
-                "filename": unique_filename
-            }
-        )
+    # 保存されたファイルのURLを返す
+    file_url = image_store.url_for(stored.path)
+    # 保存済みの画像は派生画像も記録済みなら生成し直さない
+    if stored.created or not await db.run_sync(get_image_variants, [file_url], "full"):
+        background_tasks.add_task(images.generate_variants, stored.path, file_url)
     
-    except Exception as e:
-        # アップロードに失敗した場合、ファイルが作成されていれば削除
-        if file_path.exists():
-            file_path.unlink()
-        
-        raise HTTPException(
-            status_code=500, 
-            detail=f"ファイルのアップロードに失敗しました: {str(e)}"
-        )
+    return JSONResponse(
+        status_code=200,
+        content={
+            "success": True,
+            "message": "ファイルが正常にアップロードされました",
+            "url": file_url,
+            "filename": stored.path.relative_to(image_store.root).as_posix(),
+            "size": stored.size,
+            "sha256": stored.sha256,
+            "content_type": stored.content_type,
+            "deduplicated": not stored.created,
+        }
+    )
+
+@router.delete("/image/{filename:path}")
+async def delete_image(filename: str, db: AsyncSession = Depends(get_async_db)):
+    """画像ファイルを削除
 
-@router.delete("/image/{filename}")
-async def delete_image(filename: str):
-    """画像ファイルを削除"""
-    file_path = UPLOAD_DIR / filename
+    同じ画像を複数のメニュー・店舗で共有するため、参照されている画像は削除しない。
+    参照の確認と削除の間にメニュー・店舗に登録されないよう、定期的な掃除と同じく
+    claim → 参照の再確認 → 削除の順に（猶予期間なしで）スレッドで行う。
+    """
+    file_url = f"{image_store.url_prefix}/{filename}"
+    file_path = image_store.path_for_url(file_url)
     
-    if not file_path.exists():
+    # 削除できるのはアップロードした画像（直下の旧形式の画像と SHA-256 名の画像）だけ
+    if not image_store.is_uploaded(file_path) or not await anyio.to_thread.run_sync(file_path.is_file):
         raise HTTPException(status_code=404, detail="ファイルが見つかりません")
+    if await db.run_sync(count_image_references, file_url):
+        raise HTTPException(status_code=409, detail="メニューまたは店舗で使用中の画像は削除できません")
     
-    try:
-        file_path.unlink()
-        return JSONResponse(
-            status_code=200,
-            content={
-                "success": True,
-                "message": "ファイルが正常に削除されました"
-            }
-        )
-    except Exception as e:
-        raise HTTPException(
-            status_code=500,
-            detail=f"ファイルの削除に失敗しました: {str(e)}"
-        )
+    released, _ = await remove_unreferenced_images(db, {file_url: file_path}, grace=0)
+    if not released:
+        # 確認の後に登録された（または同時に削除された）
+        if await anyio.to_thread.run_sync(file_path.is_file):
+            raise HTTPException(status_code=409, detail="メニューまたは店舗で使用中の画像は削除できません")
+        raise HTTPException(status_code=404, detail="ファイルが見つかりません")
+    return JSONResponse(
+        status_code=200,
+        content={
+            "success": True,
+            "message": "ファイルが正常に削除されました"
+        }
+    )
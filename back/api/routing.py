@@ -0,0 +1,173 @@
+"""読み取りレプリカへの振り分け
+
+GET エンドポイントのセッションを読み取りレプリカ（ラウンドロビン）に振り分ける。
+ヘルスチェックに失敗したレプリカは外し、利用可能なレプリカがなければプライマリを使う。
+
+書き込みを行ったクライアントは READ_AFTER_WRITE_SECONDS の間プライマリから読む（read-your-writes）。
+- ログイン中のユーザー: トークンのユーザーを記録し、同じユーザーの読み取りをプライマリに向ける
+  （CACHE_REDIS_URL を設定していれば他のワーカーにも伝わる）
+- それ以外: 書き込みのレスポンスの X-Read-Primary-Until ヘッダーを、クライアントが以降のリクエストに付けて送る
+クロスオリジンの fetch でも Cookie に頼らずに動くよう、どちらもヘッダーだけで判定する。
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from typing import Iterable, List, Optional
+
+import anyio
+from fastapi import HTTPException
+from starlette.datastructures import Headers, MutableHeaders
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+
+from . import metrics
+from .auth import verify_token_cached
+from .cache import TieredCache, TTLCache, response_cache
+
+logger = logging.getLogger(__name__)
+
+READ_AFTER_WRITE_SECONDS = float(os.getenv("READ_AFTER_WRITE_SECONDS", "5"))
+REPLICA_HEALTH_CHECK_INTERVAL = float(os.getenv("REPLICA_HEALTH_CHECK_INTERVAL", "10"))
+
+# 書き込みのレスポンスに付け、クライアントが以降のリクエストに付けて送り返すヘッダー（UNIX 時刻）
+PRIMARY_HEADER = "X-Read-Primary-Until"
+
+READ_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+replica_up = metrics.gauge("db_replica_up", "Whether the read replica passed its last health check", ["replica"])
+replica_reads = metrics.counter("db_read_sessions_total", "Read sessions by target database", ["target"])
+
+# 直前に書き込みを行ったユーザー → プライマリから読む期限
+primary_readers = TieredCache(
+  "read_primary",
+  TTLCache(maxsize=int(os.getenv("READ_AFTER_WRITE_CACHE_SIZE", "10000")), ttl=READ_AFTER_WRITE_SECONDS, name="read_primary"),
+  shared=response_cache.shared,
+  shared_ttl=READ_AFTER_WRITE_SECONDS,
+)
+
+class Replica:
+  """読み取りレプリカ（同期・非同期のエンジンの組）"""
+
+  def __init__(self, name: str, engine: Engine, async_engine: Optional[AsyncEngine] = None):
+    self.name = name
+    self.engine = engine
+    self.async_engine = async_engine
+    self.healthy = True
+    self.session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    self.async_session_factory = (
+      async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+      if async_engine is not None else None
+    )
+    replica_up.set(1, replica=name)
+
+  def check(self) -> bool:
+    """SELECT 1 が通るか確認して状態を更新"""
+    try:
+      with self.engine.connect() as connection:
+        connection.execute(text("SELECT 1"))
+      healthy = True
+    except Exception as e:
+      healthy = False
+      if self.healthy:
+        logger.warning(f"レプリカ {self.name} のヘルスチェックに失敗しました: {e}")
+    if healthy and not self.healthy:
+      logger.info(f"レプリカ {self.name} が復旧しました")
+    self.healthy = healthy
+    replica_up.set(1 if healthy else 0, replica=self.name)
+    return healthy
+
+  async def dispose(self) -> None:
+    self.engine.dispose()
+    if self.async_engine is not None:
+      await self.async_engine.dispose()
+
+class ReplicaSet:
+  """正常なレプリカをラウンドロビンで選ぶ"""
+
+  def __init__(self, replicas: Iterable[Replica] = ()):
+    self.replicas: List[Replica] = list(replicas)
+    self._lock = threading.Lock()
+    self._next = 0
+
+  def __bool__(self) -> bool:
+    return bool(self.replicas)
+
+  def choose(self) -> Optional[Replica]:
+    """次のレプリカを返す（正常なものがなければ None）"""
+    with self._lock:
+      for _ in range(len(self.replicas)):
+        replica = self.replicas[self._next % len(self.replicas)]
+        self._next += 1
+        if replica.healthy:
+          return replica
+    return None
+
+  def check(self) -> None:
+    for replica in self.replicas:
+      replica.check()
+
+  async def run_health_checks(self, interval: float = REPLICA_HEALTH_CHECK_INTERVAL) -> None:
+    """定期的にヘルスチェックを実行（キャンセルされるまで続ける）"""
+    while True:
+      await anyio.to_thread.run_sync(self.check)
+      await asyncio.sleep(interval)
+
+  async def dispose(self) -> None:
+    for replica in self.replicas:
+      await replica.dispose()
+
+def principal_key(headers: Headers) -> Optional[str]:
+  """Authorization ヘッダーのトークンのユーザー（"user_type:ユーザー名"、未ログイン・無効なトークンは None）"""
+  scheme, _, token = headers.get("authorization", "").partition(" ")
+  if scheme.lower() != "bearer" or not token:
+    return None
+  try:
+    payload = verify_token_cached(token)
+  except HTTPException:
+    return None
+  if payload.get("sub") is None:
+    return None
+  return f"{payload.get('user_type')}:{payload['sub']}"
+
+async def prefers_primary(headers: Headers) -> bool:
+  """直前に書き込みを行ったクライアントかどうか"""
+  try:
+    if float(headers.get(PRIMARY_HEADER, 0)) > time.time():
+      return True
+  except ValueError:
+    pass
+  key = principal_key(headers)
+  if key is None:
+    return False
+  until = await primary_readers.get(key)
+  return until is not None and until > time.time()
+
+class ReadYourWritesMiddleware:
+  """書き込みに成功したクライアントの読み取りを、しばらくプライマリに向ける ASGI ミドルウェア
+
+  レスポンスを送り始める前にユーザーを記録し、PRIMARY_HEADER を付ける
+  （クライアントがレスポンスを受け取った時点で、次の読み取りはプライマリに向く）。
+  """
+
+  def __init__(self, app):
+    self.app = app
+
+  async def __call__(self, scope, receive, send):
+    if scope["type"] != "http" or scope["method"] in READ_METHODS:
+      await self.app(scope, receive, send)
+      return
+
+    async def send_wrapper(message):
+      if message["type"] == "http.response.start" and message["status"] < 400:
+        until = time.time() + READ_AFTER_WRITE_SECONDS
+        key = principal_key(Headers(scope=scope))
+        if key is not None:
+          await primary_readers.set(key, until)
+        MutableHeaders(scope=message)[PRIMARY_HEADER] = f"{until:.3f}"
+      await send(message)
+
+    await self.app(scope, receive, send_wrapper)
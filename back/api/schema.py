@@ -0,0 +1,37 @@
+"""データベースのスキーマ管理（Alembic）
+
+起動時に `alembic upgrade head` 相当を実行し、スキーマを最新にする。
+複数のワーカーが同時に起動しても1つずつ実行されるよう、MySQL では GET_LOCK で排他する。
+"""
+from pathlib import Path
+
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+
+ALEMBIC_INI = Path(__file__).parent.parent / "alembic.ini"
+MIGRATION_LOCK = "menu_app_migrations"
+MIGRATION_LOCK_TIMEOUT = 300
+
+def alembic_config() -> Config:
+  return Config(str(ALEMBIC_INI))
+
+def upgrade_database(engine: Engine) -> None:
+  """未適用のマイグレーションを適用（create_all で作成済みの DB もそのまま移行できる）"""
+  config = alembic_config()
+  with engine.connect() as connection:
+    locked = connection.dialect.name == "mysql"
+    if locked:
+      acquired = connection.execute(
+        text("SELECT GET_LOCK(:name, :timeout)"), {"name": MIGRATION_LOCK, "timeout": MIGRATION_LOCK_TIMEOUT}
+      ).scalar()
+      if acquired != 1:
+        raise RuntimeError("マイグレーションのロックを取得できませんでした")
+    try:
+      config.attributes["connection"] = connection
+      command.upgrade(config, "head")
+      connection.commit()
+    finally:
+      if locked:
+        connection.execute(text("SELECT RELEASE_LOCK(:name)"), {"name": MIGRATION_LOCK})
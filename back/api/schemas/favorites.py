@@ -1,4 +1,8 @@
 from pydantic import BaseModel, Field
+from typing import Dict
+
+# 一度にお気に入りかどうかを確認できる店舗の数
+FAVORITE_STATUS_MAX_IDS = 200
 
 class FavoriteBase(BaseModel):
   user_id: int = Field(..., description="ID of the user")
@@ -6,4 +10,8 @@ class FavoriteBase(BaseModel):
 
 class FavoriteRead(FavoriteBase):
   class Config:
-    from_attributes = True
\ No newline at end of file
+    from_attributes = True
+
+class FavoriteStatuses(BaseModel):
+  user_id: int
+  statuses: Dict[int, bool]  # shop_id → お気に入りかどうか
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field
-from typing import Optional, List
+from typing import Dict, Optional, List
 from datetime import datetime
 
 class MenuBase(BaseModel):
@@ -11,6 +11,8 @@ class MenuBase(BaseModel):
   category: Optional[str] = Field(None, max_length=50)
   tags: Optional[List[str]] = Field(default_factory=list, max_items=10)
   image_url: Optional[str] = None
+  # エンドポイントに応じたサイズの派生画像 {形式: URL}（未生成なら空）
+  image_variants: Dict[str, str] = Field(default_factory=dict)
   is_available: bool = True
 
   class Config:
@@ -49,8 +51,17 @@ class MenuResponse(MenuBase):
   class Config:
     from_attributes = True
 
+class PopularMenuResponse(MenuResponse):
+  # お気に入りの数（ETag・レスポンスのキャッシュに含めないため、人気順の一覧だけで返す）
+  favorite_count: int = 0
+
+class MenuListItem(MenuResponse):
+  # ログイン中のユーザーのお気に入りかどうか（未ログインの場合は None）
+  is_favorite: Optional[bool] = None
+
 class MenuListResponse(BaseModel):
-  items: list[MenuResponse]
-  total: int
-  page: int
+  items: list[MenuListItem]
+  total: Optional[int] = None  # count=none の場合は None
+  page: Optional[int] = None  # カーソル指定時は None
   per_page: int
+  next_cursor: Optional[str] = None
@@ -1,4 +1,8 @@
 from pydantic import BaseModel, Field
+from typing import Dict
+
+# 一度にお気に入りかどうかを確認できるメニューの数
+MENU_FAVORITE_STATUS_MAX_IDS = 200
 
 class MenuFavoritesBase(BaseModel):
     user_id: int = Field(..., description="ID of the user")
@@ -7,3 +11,7 @@ class MenuFavoritesBase(BaseModel):
 class MenuFavoritesResponse(MenuFavoritesBase):
     class Config:
         from_attributes = True
+
+class MenuFavoriteStatuses(BaseModel):
+    user_id: int
+    statuses: Dict[int, bool]  # menu_id → お気に入りかどうか
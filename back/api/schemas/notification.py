@@ -1,7 +1,10 @@
-from pydantic import BaseModel
-from typing import Optional
+from pydantic import BaseModel, Field
+from typing import List, Optional
 from datetime import datetime
 
+# 一括既読で一度に指定できる通知の数
+MARK_READ_MAX_IDS = 500
+
 class NotificationBase(BaseModel):
   contents: str
   user_id: int
@@ -13,8 +16,40 @@ class NotificationCreate(NotificationBase):
   pass
 
 class NotificationOut(NotificationBase):
-  notification_id: int
+  id: int
   created_at: datetime
 
   class Config:
-    orm_mode = True
\ No newline at end of file
+    from_attributes = True
+
+class NotificationPage(BaseModel):
+  items: List[NotificationOut]
+  next_cursor: Optional[str] = None
+  unread_count: int
+
+class UnreadCount(BaseModel):
+  unread_count: int
+
+class NotificationReadRequest(BaseModel):
+  ids: List[int] = Field(..., min_length=1, max_length=MARK_READ_MAX_IDS)
+
+class NotificationReadResult(BaseModel):
+  updated: int  # 既読にした件数（既に既読・他のユーザーの通知は数えない）
+  unread_count: int
+
+class BroadcastCreate(BaseModel):
+  contents: str = Field(..., min_length=1, max_length=255)
+
+class BroadcastOut(BaseModel):
+  id: int
+  shop_id: int
+  contents: str
+  status: str  # queued / running / done / failed
+  total: Optional[int] = None  # 配信先の数（配信を開始するまでは None）
+  delivered: int
+  error: Optional[str] = None
+  created_at: Optional[datetime] = None
+  finished_at: Optional[datetime] = None
+
+  class Config:
+    from_attributes = True
@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Optional, List
+from typing import Dict, Optional, List
 from .menu import MenuBase
 
 class ShopBase(BaseModel):
@@ -16,10 +16,16 @@ class ShopCreate(ShopBase):
 
 class ShopRead(ShopBase):
   id: int
+  # エンドポイントに応じたサイズの派生画像 {形式: URL}（未生成なら空）
+  image_variants: Dict[str, str] = {}
 
   class Config:
     from_attributes = True
 
+class PopularShopRead(ShopRead):
+  # お気に入りの数（ETag・レスポンスのキャッシュに含めないため、人気順の一覧だけで返す）
+  favorite_count: int = 0
+
 class ShopUpdate(BaseModel):
   area_id: Optional[int] = None
   name: Optional[str] = None
@@ -30,6 +36,7 @@ class ShopUpdate(BaseModel):
   phone: Optional[str] = None
 
 class ShopWithMenus(BaseModel):
+  id: int
   name: str
   menus: List[MenuBase]
 
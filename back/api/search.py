@@ -0,0 +1,178 @@
+"""メニュー検索インデックス
+
+メニュー名・説明・タグ・店舗名から検索用ドキュメントを作り、
+`SEARCH_BACKEND` に応じて以下のどちらかでインデックスを管理する。
+
+- fulltext: MySQL の FULLTEXT インデックス（ngram パーサー）を `menu_search` テーブルに張る
+- ngram: プロセス内の n-gram 転置インデックス（SQLite などでの開発用）
+"""
+import os
+import threading
+import unicodedata
+from collections import defaultdict
+from typing import Dict, List, Optional, Set
+
+from sqlalchemy import case, delete, false, insert
+from sqlalchemy.dialects import mysql
+from sqlalchemy.orm import Query, Session, joinedload
+
+from .models.menu import Menu
+from .models.menu_search import MenuSearch
+
+SEARCH_BACKEND = os.getenv("SEARCH_BACKEND", "fulltext")
+SEARCH_MAX_RESULTS = int(os.getenv("SEARCH_MAX_RESULTS", "1000"))
+
+# MySQL の ngram_token_size のデフォルトに合わせる
+NGRAM_SIZE = 2
+
+def normalize(text: str) -> str:
+  """全角・半角や大文字・小文字の揺れを吸収"""
+  return unicodedata.normalize("NFKC", text).lower()
+
+def build_document(menu: Menu) -> str:
+  """メニューから検索用ドキュメントを作成"""
+  parts = [menu.name, menu.description]
+  parts.extend(menu.tags or [])
+  if menu.shop is not None:
+    parts.append(menu.shop.name)
+  return normalize(" ".join(part for part in parts if part))
+
+def ngrams(text: str, n: int = NGRAM_SIZE) -> List[str]:
+  """空白で区切った語ごとに n-gram を生成（n 文字未満の語はそのまま）"""
+  grams = []
+  for word in normalize(text).split():
+    if len(word) <= n:
+      grams.append(word)
+      continue
+    grams.extend(word[i:i + n] for i in range(len(word) - n + 1))
+  return grams
+
+class FulltextMenuIndex:
+  """MySQL FULLTEXT（ngram パーサー）による検索インデックス"""
+
+  def index(self, db: Session, menu: Menu) -> None:
+    """メニューのドキュメントを登録・更新（呼び出し側のトランザクション内で書き込む）"""
+    db.merge(MenuSearch(menu_id=menu.id, document=build_document(menu)))
+
+  def index_many(self, db: Session, menus: List[Menu]) -> None:
+    """複数メニューのドキュメントをまとめて登録・更新（DELETE と複数行 INSERT の2文）"""
+    if not menus:
+      return
+    db.execute(delete(MenuSearch).where(MenuSearch.menu_id.in_([menu.id for menu in menus])))
+    db.execute(insert(MenuSearch), [{"menu_id": menu.id, "document": build_document(menu)} for menu in menus])
+
+  def remove(self, db: Session, menu_id: int) -> None:
+    """メニューのドキュメントを削除"""
+    db.execute(delete(MenuSearch).where(MenuSearch.menu_id == menu_id))
+
+  def apply(self, query: Query, search: str, rank: bool = True) -> Query:
+    """検索条件を追加（rank=True の場合は関連度の高い順に並べる）"""
+    score = mysql.match(MenuSearch.document, against=normalize(search)).in_natural_language_mode()
+    query = query.join(MenuSearch, MenuSearch.menu_id == Menu.id).filter(score)
+    if rank:
+      query = query.order_by(score.desc())
+    return query
+
+  def rebuild(self, db: Session) -> None:
+    """ドキュメントが存在しないメニューをまとめて登録"""
+    missing = (
+      db.query(Menu)
+      .outerjoin(MenuSearch, MenuSearch.menu_id == Menu.id)
+      .filter(MenuSearch.menu_id.is_(None))
+      .options(joinedload(Menu.shop))
+    )
+    for menu in missing.yield_per(500):
+      db.add(MenuSearch(menu_id=menu.id, document=build_document(menu)))
+    db.commit()
+
+class NgramMenuIndex:
+  """プロセス内の n-gram 転置インデックス"""
+
+  def __init__(self, n: int = NGRAM_SIZE):
+    self.n = n
+    self._lock = threading.Lock()
+    self._postings: Dict[str, Dict[int, int]] = defaultdict(dict)
+    self._grams: Dict[int, Set[str]] = {}
+
+  def add(self, menu_id: int, document: str) -> None:
+    """ドキュメントを登録（既存のものは置き換える）"""
+    counts: Dict[str, int] = defaultdict(int)
+    for gram in ngrams(document, self.n):
+      counts[gram] += 1
+    with self._lock:
+      self._discard(menu_id)
+      for gram, count in counts.items():
+        self._postings[gram][menu_id] = count
+      self._grams[menu_id] = set(counts)
+
+  def _discard(self, menu_id: int) -> None:
+    for gram in self._grams.pop(menu_id, ()):
+      postings = self._postings.get(gram)
+      if postings is None:
+        continue
+      postings.pop(menu_id, None)
+      if not postings:
+        del self._postings[gram]
+
+  def index(self, db: Session, menu: Menu) -> None:
+    self.add(menu.id, build_document(menu))
+
+  def index_many(self, db: Session, menus: List[Menu]) -> None:
+    for menu in menus:
+      self.add(menu.id, build_document(menu))
+
+  def remove(self, db: Session, menu_id: int) -> None:
+    with self._lock:
+      self._discard(menu_id)
+
+  def search(self, text: str, limit: int = SEARCH_MAX_RESULTS) -> List[int]:
+    """全ての n-gram を含むメニューIDを関連度順に返す"""
+    grams = set(ngrams(text, self.n))
+    if not grams:
+      return []
+    with self._lock:
+      postings = [self._postings.get(gram) for gram in grams]
+      if not all(postings):
+        return []
+      # 出現件数の少ない n-gram から絞り込む
+      postings.sort(key=len)
+      candidates = set(postings[0])
+      for posting in postings[1:]:
+        candidates.intersection_update(posting)
+        if not candidates:
+          return []
+      total = len(self._grams)
+      scores = {
+        menu_id: sum(posting[menu_id] * total / len(posting) for posting in postings)
+        for menu_id in candidates
+      }
+    return sorted(scores, key=lambda menu_id: (-scores[menu_id], menu_id))[:limit]
+
+  def apply(self, query: Query, search: str, rank: bool = True) -> Query:
+    menu_ids = self.search(search)
+    if not menu_ids:
+      return query.filter(false())
+    query = query.filter(Menu.id.in_(menu_ids))
+    if rank:
+      ranking = case({menu_id: i for i, menu_id in enumerate(menu_ids)}, value=Menu.id)
+      query = query.order_by(ranking)
+    return query
+
+  def rebuild(self, db: Session) -> None:
+    """DB の全メニューからインデックスを作り直す"""
+    with self._lock:
+      self._postings.clear()
+      self._grams.clear()
+    for menu in db.query(Menu).options(joinedload(Menu.shop)).yield_per(500):
+      self.add(menu.id, build_document(menu))
+
+def create_menu_index(backend: Optional[str] = None):
+  """設定に応じた検索インデックスを作成"""
+  backend = backend or SEARCH_BACKEND
+  if backend == "fulltext":
+    return FulltextMenuIndex()
+  if backend == "ngram":
+    return NgramMenuIndex()
+  raise ValueError(f"Unknown SEARCH_BACKEND: {backend}")
+
+menu_index = create_menu_index()
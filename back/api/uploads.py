@@ -0,0 +1,213 @@
+"""画像アップロードのストリーミング受信
+
+multipart のリクエストボディをチャンクごとに解析し、ファイル部分を一時ファイルへ
+書き込みながら、サイズ上限の確認・SHA-256 の計算・マジックバイトによる形式判定を行う。
+ボディ全体をメモリに載せず、上限を超えた時点で受信を打ち切る。
+"""
+import hashlib
+import uuid
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+import anyio
+from fastapi import HTTPException, Request
+
+from .image_store import ImageStore
+
+try:
+  from python_multipart.multipart import MultipartParser, parse_options_header
+except ModuleNotFoundError:
+  from multipart.multipart import MultipartParser, parse_options_header
+
+# 形式判定に使う先頭バイト数（WebP は 12 バイト必要）
+SNIFF_BYTES = 12
+
+# Content-Length で事前に弾く際に許容する multipart の境界・ヘッダー分
+MULTIPART_OVERHEAD = 16 * 1024
+
+UNSUPPORTED_TYPE = "許可されていないファイル形式です。JPG, JPEG, PNG, GIF, WebPのみ対応しています"
+
+def sniff_image(head: bytes) -> Optional[Tuple[str, str]]:
+  """先頭バイトから画像形式を判定し、(拡張子, Content-Type) を返す（画像でなければ None）"""
+  if head.startswith(b"\xff\xd8\xff"):
+    return ".jpg", "image/jpeg"
+  if head.startswith(b"\x89PNG\r\n\x1a\n"):
+    return ".png", "image/png"
+  if head[:6] in (b"GIF87a", b"GIF89a"):
+    return ".gif", "image/gif"
+  if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+    return ".webp", "image/webp"
+  return None
+
+@dataclass
+class StoredUpload:
+  """保存したアップロードファイル"""
+  path: Path
+  original_filename: str
+  size: int
+  sha256: str
+  extension: str
+  content_type: str
+  # 同じ内容の画像が保存済みでなく、新たに保存したか
+  created: bool = True
+
+def _too_large(max_size: int) -> HTTPException:
+  return HTTPException(status_code=400, detail=f"ファイルサイズが大きすぎます（最大{max_size // (1024 * 1024)}MB）")
+
+class _ImageReceiver:
+  """MultipartParser のコールバックを受け、指定フィールドのファイルを一時ファイルに書き込む"""
+
+  def __init__(self, field_name: str, store: ImageStore, max_size: int):
+    self.field_name = field_name
+    self.store = store
+    self.max_size = max_size
+    self.events: List[Tuple[str, object]] = []
+    self.temp_path: Optional[Path] = None
+    self.original_filename: Optional[str] = None
+    self.size = 0
+    self.sha256 = hashlib.sha256()
+    self.detected: Optional[Tuple[str, str]] = None
+    self._file = None
+    self._receiving = False
+    self._head = bytearray()
+    self._headers = {}
+    self._header_field = bytearray()
+    self._header_value = bytearray()
+
+  # --- パーサーのコールバック（同期）。ここではイベントを溜めるだけにする ---
+
+  def on_part_begin(self):
+    self._headers = {}
+
+  def on_header_field(self, data: bytes, start: int, end: int):
+    self._header_field += data[start:end]
+
+  def on_header_value(self, data: bytes, start: int, end: int):
+    self._header_value += data[start:end]
+
+  def on_header_end(self):
+    self._headers[bytes(self._header_field).lower()] = bytes(self._header_value)
+    self._header_field.clear()
+    self._header_value.clear()
+
+  def on_headers_finished(self):
+    _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+    filename = options.get(b"filename")
+    self.events.append((
+      "part",
+      (options.get(b"name", b"").decode("latin-1"), filename.decode("utf-8", "replace") if filename is not None else None),
+    ))
+
+  def on_part_data(self, data: bytes, start: int, end: int):
+    self.events.append(("data", bytes(data[start:end])))
+
+  def on_part_end(self):
+    self.events.append(("end", None))
+
+  def callbacks(self) -> dict:
+    return {
+      "on_part_begin": self.on_part_begin,
+      "on_header_field": self.on_header_field,
+      "on_header_value": self.on_header_value,
+      "on_header_end": self.on_header_end,
+      "on_headers_finished": self.on_headers_finished,
+      "on_part_data": self.on_part_data,
+      "on_part_end": self.on_part_end,
+    }
+
+  # --- 溜めたイベントの処理（非同期） ---
+
+  async def process_events(self):
+    events, self.events = self.events, []
+    for kind, value in events:
+      if kind == "part":
+        name, filename = value
+        # 対象フィールドの最初のファイルだけを受け取り、それ以外は読み捨てる
+        self._receiving = name == self.field_name and bool(filename) and self.temp_path is None
+        if self._receiving:
+          self.original_filename = filename
+          self.temp_path = self.store.temp_path(uuid.uuid4().hex)
+          self._file = await anyio.open_file(self.temp_path, "wb")
+      elif kind == "data" and self._receiving:
+        await self._write(value)
+      elif kind == "end" and self._receiving:
+        self._receiving = False
+        self._check_type()
+        await self._file.aclose()
+        self._file = None
+
+  async def _write(self, data: bytes):
+    self.size += len(data)
+    if self.size > self.max_size:
+      raise _too_large(self.max_size)
+    if self.detected is None:
+      self._head += data[:SNIFF_BYTES - len(self._head)]
+      if len(self._head) >= SNIFF_BYTES:
+        self._check_type()
+    self.sha256.update(data)
+    await self._file.write(data)
+
+  def _check_type(self):
+    if self.detected is None:
+      self.detected = sniff_image(bytes(self._head))
+      if self.detected is None:
+        raise HTTPException(status_code=400, detail=UNSUPPORTED_TYPE)
+
+  def complete(self) -> Tuple[str, str]:
+    """受信の完了を確認し、判定した (拡張子, Content-Type) を返す"""
+    if self.temp_path is None:
+      raise HTTPException(status_code=400, detail="ファイルが選択されていません")
+    if self._file is not None:
+      raise HTTPException(status_code=400, detail="アップロードが途中で終了しました")
+    self._check_type()
+    return self.detected
+
+  async def cleanup(self):
+    if self._file is not None:
+      await self._file.aclose()
+      self._file = None
+    if self.temp_path is not None:
+      await anyio.Path(self.temp_path).unlink(missing_ok=True)
+      self.temp_path = None
+
+async def receive_image(request: Request, field_name: str, store: ImageStore, max_size: int) -> StoredUpload:
+  """multipart/form-data の field_name の画像を store に保存
+
+  ファイル名は内容の SHA-256 から決め、拡張子は判定した形式から決める（同じ画像は1つだけ保存）。
+  一時ファイルに書き込んでから rename するため、途中の状態のファイルは公開されない。
+  """
+  content_type, params = parse_options_header(request.headers.get("content-type", ""))
+  if content_type != b"multipart/form-data" or b"boundary" not in params:
+    raise HTTPException(status_code=400, detail="multipart/form-data で送信してください")
+  content_length = request.headers.get("content-length")
+  if content_length and content_length.isdigit() and int(content_length) > max_size + MULTIPART_OVERHEAD:
+    raise _too_large(max_size)
+
+  receiver = _ImageReceiver(field_name, store, max_size)
+  parser = MultipartParser(params[b"boundary"], receiver.callbacks())
+  try:
+    async for chunk in request.stream():
+      parser.write(chunk)
+      await receiver.process_events()
+    parser.finalize()
+    await receiver.process_events()
+
+    extension, mime_type = receiver.complete()
+    sha256 = receiver.sha256.hexdigest()
+    path, created = await anyio.to_thread.run_sync(store.put, receiver.temp_path, sha256, extension)
+    receiver.temp_path = None
+    return StoredUpload(
+      path=path,
+      original_filename=receiver.original_filename,
+      size=receiver.size,
+      sha256=sha256,
+      extension=extension,
+      content_type=mime_type,
+      created=created,
+    )
+  except ValueError as e:
+    # multipart の形式エラー（python-multipart の例外は ValueError のサブクラス）
+    raise HTTPException(status_code=400, detail=f"リクエストの形式が不正です: {e}")
+  finally:
+    await receiver.cleanup()
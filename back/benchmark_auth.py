@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+認証の依存関係（get_current_shop_user など）のベンチマークスクリプト
+
+毎回トークンを検証してユーザーを SELECT する従来の方式と、
+検証済みトークン・ユーザーをキャッシュする方式（ORM / Principal）を比較し、
+1リクエストあたりの SQL 実行回数とレイテンシ（p50 / p99）を表示する。
+
+使い方:
+  python benchmark_auth.py                                 # SQLite（一時ファイル、aiosqlite が必要）で実行
+  python benchmark_auth.py --url mysql+pymysql://...       # 既存の DB で実行（非同期は aiomysql）
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+
+from api.database import Base
+from api.models import Area, Shop
+from api.models import users, notification, notification_users, notification_shop  # noqa: F401 リレーション解決用
+from api.models.shop_users import ShopUsers
+from api.auth import create_access_token, verify_token, principal_cache, token_cache
+from api.cruds.auth import get_shop_user_by_username
+from api.routers.auth import get_current_shop_user, get_current_shop_principal
+
+ASYNC_DRIVERS = {"sqlite": "sqlite+aiosqlite", "mysql+pymysql": "mysql+aiomysql"}
+
+def async_url(url: str) -> str:
+  driver, rest = url.split("://", 1)
+  return f"{ASYNC_DRIVERS.get(driver, driver)}://{rest}"
+
+def seed(Session, users: int):
+  """テストデータを作成（パスワードハッシュは計測に使わないためダミー）"""
+  db = Session()
+  try:
+    if db.query(ShopUsers).count():
+      return
+    db.add(Area(id=1, name="Tokyo"))
+    db.add(Shop(id=1, area_id=1, name="Shop 1"))
+    db.flush()
+    db.add_all(
+      ShopUsers(shop_id=1, username=f"shop{i}", email=f"shop{i}@example.com", password_hash="x")
+      for i in range(users)
+    )
+    db.commit()
+  finally:
+    db.close()
+
+def percentile(samples, p):
+  ordered = sorted(samples)
+  return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+def report(label, latencies, statements):
+  print(
+    f"{label:<24} statements/req={statistics.mean(statements):.2f} "
+    f"p50={percentile(latencies, 50):.3f}ms p99={percentile(latencies, 99):.3f}ms"
+  )
+
+def run(Session, counter, label, fetch, tokens, requests):
+  latencies = []
+  statements = []
+  for i in range(requests):
+    db = Session()
+    try:
+      counter["n"] = 0
+      started = time.perf_counter()
+      fetch(tokens[i % len(tokens)], db)
+      latencies.append((time.perf_counter() - started) * 1000)
+      statements.append(counter["n"])
+    finally:
+      db.close()
+  report(label, latencies, statements)
+
+async def run_async(AsyncSession, counter, label, tokens, requests):
+  latencies = []
+  statements = []
+  for i in range(requests):
+    async with AsyncSession() as db:
+      counter["n"] = 0
+      started = time.perf_counter()
+      await get_current_shop_principal(tokens[i % len(tokens)], db)
+      latencies.append((time.perf_counter() - started) * 1000)
+      statements.append(counter["n"])
+  report(label, latencies, statements)
+  await AsyncSession.kw["bind"].dispose()
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("--url", default=f"sqlite:///{os.path.join(tempfile.gettempdir(), 'benchmark_auth.db')}")
+  parser.add_argument("--users", type=int, default=50)
+  parser.add_argument("--requests", type=int, default=2000)
+  args = parser.parse_args()
+
+  engine = create_engine(args.url)
+  Base.metadata.create_all(bind=engine)
+  Session = sessionmaker(bind=engine, autoflush=False)
+  seed(Session, args.users)
+
+  async_engine = create_async_engine(async_url(args.url))
+  AsyncSession = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
+  counter = {"n": 0}
+
+  @event.listens_for(engine, "before_cursor_execute")
+  def count_statement(*_):
+    counter["n"] += 1
+
+  @event.listens_for(async_engine.sync_engine, "before_cursor_execute")
+  def count_async_statement(*_):
+    counter["n"] += 1
+
+  tokens = [create_access_token({"sub": f"shop{i}", "user_type": "shop_user"}) for i in range(args.users)]
+
+  def before(token, db):
+    payload = verify_token(token)
+    get_shop_user_by_username(db, username=payload["sub"])
+
+  token_cache.clear()
+  principal_cache.clear()
+  run(Session, counter, "before (verify + select)", before, tokens, args.requests)
+  run(Session, counter, "after (ORM user)", lambda token, db: get_current_shop_user(token, db), tokens, args.requests)
+  principal_cache.clear()
+  asyncio.run(run_async(AsyncSession, counter, "after (principal)", tokens, args.requests))
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+メニュー一覧（GET /menus）のベンチマークスクリプト
+
+一覧と総数を別々のクエリで取得する従来の方式と、
+COUNT(*) OVER() で1回に取得し総数をキャッシュする方式を比較し、
+1リクエストあたりの SQL 実行回数とレイテンシ（p50 / p99）を表示する。
+
+使い方:
+  python benchmark_menu_list.py                       # SQLite（メモリ）で実行
+  python benchmark_menu_list.py --url mysql+pymysql://...  # 既存の DB で実行
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from api.database import Base
+from api.models import Area, Shop, Menu
+from api.models import users, notification, notification_users, notification_shop  # noqa: F401 リレーション解決用
+from api.cruds.menu import MenuCRUD, menu_count_cache
+
+def seed(Session, shops: int, menus_per_shop: int):
+  """テストデータを作成"""
+  db = Session()
+  try:
+    if db.query(Menu).count():
+      return
+    db.add(Area(id=1, name="Tokyo"))
+    db.add_all(Shop(id=i, area_id=1, name=f"Shop {i}") for i in range(1, shops + 1))
+    db.flush()
+    db.add_all(
+      Menu(shop_id=shop_id, name=f"Menu {shop_id}-{i}", price=100 + i, category="main" if i % 2 else "drink")
+      for shop_id in range(1, shops + 1)
+      for i in range(menus_per_shop)
+    )
+    db.commit()
+  finally:
+    db.close()
+
+def percentile(samples, p):
+  ordered = sorted(samples)
+  return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+def run(Session, counter, label, fetch, requests):
+  latencies = []
+  statements = []
+  for i in range(requests):
+    db = Session()
+    try:
+      counter["n"] = 0
+      started = time.perf_counter()
+      fetch(MenuCRUD(db), i)
+      latencies.append((time.perf_counter() - started) * 1000)
+      statements.append(counter["n"])
+    finally:
+      db.close()
+  print(
+    f"{label:<24} statements/req={statistics.mean(statements):.2f} "
+    f"p50={percentile(latencies, 50):.2f}ms p99={percentile(latencies, 99):.2f}ms"
+  )
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+  parser.add_argument("--url", default="sqlite://")
+  parser.add_argument("--shops", type=int, default=200)
+  parser.add_argument("--menus-per-shop", type=int, default=50)
+  parser.add_argument("--requests", type=int, default=500)
+  args = parser.parse_args()
+
+  engine = create_engine(args.url)
+  Base.metadata.create_all(bind=engine)
+  Session = sessionmaker(bind=engine, autoflush=False)
+  seed(Session, args.shops, args.menus_per_shop)
+
+  counter = {"n": 0}
+
+  @event.listens_for(engine, "before_cursor_execute")
+  def count_statement(*_):
+    counter["n"] += 1
+
+  pages = 20
+  filters = [{"category": "main"}, {"category": "drink"}, {}]
+
+  def before(crud, i):
+    menu_count_cache.clear()
+    params = filters[i % len(filters)]
+    crud.get_menus_page(skip=(i % pages) * 10, limit=10, count="none", **params)
+    crud.get_menus_count(**params)
+
+  def after_uncached(crud, i):
+    menu_count_cache.clear()
+    crud.get_menus_page(skip=(i % pages) * 10, limit=10, count="exact", **filters[i % len(filters)])
+
+  def after(crud, i):
+    crud.get_menus_page(skip=(i % pages) * 10, limit=10, count="exact", **filters[i % len(filters)])
+
+  menu_count_cache.clear()
+  run(Session, counter, "before (page + count)", before, args.requests)
+  run(Session, counter, "after (window)", after_uncached, args.requests)
+  run(Session, counter, "after (window + cache)", after, args.requests)
+
+if __name__ == "__main__":
+  main()
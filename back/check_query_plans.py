@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+クエリの実行計画のチェックスクリプト
+
+主要なクエリ（メニュー一覧の絞り込み・並び替え、差分の書き出し、画像の参照数、
+お気に入り・通知の検索、人気順・エリアごとの人気ランキング）を EXPLAIN し、マイグレーションで追加したインデックスが
+使われているかを確認する。使われていないクエリがあれば終了コード 1 で終わる。
+インデックスやクエリを変更したときの回帰チェックに使う。
+
+使い方:
+  python check_query_plans.py                              # SQLite（メモリ）で実行
+  python check_query_plans.py --url mysql+pymysql://...     # 空の検証用 DB で実行（テストデータを投入する）
+"""
+import argparse
+import os
+import re
+import sys
+from datetime import datetime, timedelta
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from sqlalchemy import create_engine, func, select, text
+from sqlalchemy.orm import sessionmaker
+
+from api.database import Base
+from api.models import Area, Shop, Menu, MenuFavorites, Users
+from api.models import notification_users, notification_shop  # noqa: F401 リレーション解決用
+from api.models.favorites import Favorite
+from api.models.notification import Notification
+from api.cruds.menu import MENU_SORTS, MenuCRUD, menu_departure_query, menu_export_query
+from api.cruds.notification import NOTIFICATION_SORT_KEYS
+from api.cruds.popularity import top_shops_query
+from api.cruds.shop import SHOP_SORTS
+from api.menu_io import MENU_EXPORT_FIELDS
+from api import pagination
+
+def seed(Session, shops: int, menus_per_shop: int, users: int):
+  """テストデータを作成（値の分布は本番に近づける）"""
+  db = Session()
+  try:
+    if db.query(Menu).count():
+      return
+    db.add_all(Area(id=i, name=f"Area {i}") for i in range(1, 11))
+    db.add_all(
+      Shop(id=i, area_id=1 + i % 10, name=f"Shop {i}", image_path=f"/static/images/shop{i}.png")
+      for i in range(1, shops + 1)
+    )
+    db.add_all(Users(id=i, username=f"user{i}", email=f"user{i}@example.com", password_hash="x") for i in range(1, users + 1))
+    db.flush()
+    base = datetime(2024, 1, 1)
+    db.add_all(
+      Menu(
+        shop_id=shop_id,
+        name=f"Menu {shop_id}-{i}",
+        price=100 + (shop_id * 37 + i * 11) % 2000,
+        category=("main", "drink", "side", "dessert")[i % 4],
+        image_url=f"/static/images/menu{shop_id}-{i}.png",
+        is_available=i % 10 != 0,
+        created_at=base + timedelta(hours=shop_id * menus_per_shop + i),
+        # 大半は一度も更新されていない（updated_at が NULL）
+        updated_at=base + timedelta(days=200, hours=i) if i % 20 == 0 else None,
+      )
+      for shop_id in range(1, shops + 1)
+      for i in range(menus_per_shop)
+    )
+    db.flush()
+    db.add_all(
+      MenuFavorites(user_id=user_id, menu_id=menu_id)
+      for user_id in range(1, users + 1)
+      for menu_id in range(user_id, shops * menus_per_shop, max(1, users // 3))
+    )
+    db.add_all(
+      Favorite(user_id=user_id, shop_id=shop_id)
+      for user_id in range(1, users + 1)
+      for shop_id in range(1 + user_id % 7, shops + 1, 1 + user_id % 13)
+    )
+    db.add_all(
+      Notification(user_id=user_id, contents=f"通知 {i}", status="read" if i % 5 else "unread")
+      for user_id in range(1, users + 1)
+      for i in range(20)
+    )
+    db.flush()
+    # お気に入り数はマイグレーション 0005 と同じ方法で集計する
+    db.execute(text("UPDATE menus SET favorite_count = (SELECT COUNT(*) FROM menu_favorites WHERE menu_favorites.menu_id = menus.id)"))
+    db.execute(text("UPDATE shops SET favorite_count = (SELECT COUNT(*) FROM favorites WHERE favorites.shop_id = shops.id)"))
+    db.commit()
+  finally:
+    db.close()
+
+def menu_list(db, sort="id", **filters):
+  """GET /menus と同じ絞り込み・並び順のクエリ（MenuCRUD のクエリ組み立てをそのまま使う）"""
+  query = MenuCRUD(db)._filtered_query(rank=False, **filters)
+  return pagination.seek(query, MENU_SORTS[sort], None).limit(11).statement
+
+def checks(db):
+  """(説明, 文, 対象テーブル, 使われるべきインデックス) の一覧"""
+  # 差分の書き出しは直近の変更だけを取りに来る（最新の1日分）
+  since = db.query(func.max(Menu.created_at)).scalar() - timedelta(days=1)
+  return [
+    ("menus: shop_id + is_available + category", menu_list(db, shop_id=7, category="drink"), "menus",
+     {"ix_menus_shop_available_category"}),
+    ("menus: shop_id + is_available", menu_list(db, shop_id=7), "menus",
+     {"ix_menus_shop_available_category"}),
+    ("menus: is_available + category", menu_list(db, category="drink"), "menus",
+     {"ix_menus_available_category"}),
+    ("menus: sort=newest", menu_list(db, sort="newest"), "menus",
+     {"ix_menus_available_created"}),
+    ("menus: sort=price_asc", menu_list(db, sort="price_asc"), "menus",
+     {"ix_menus_available_price"}),
+    ("menus: sort=popular", menu_list(db, sort="popular"), "menus",
+     {"ix_menus_available_favorites"}),
+    ("shops: sort=popular", pagination.seek(db.query(Shop), SHOP_SORTS["popular"], None).limit(101).statement, "shops",
+     {"ix_shops_favorite_count"}),
+    ("rankings: area top shops", top_shops_query(db, 3, 40).statement, "shops",
+     {"ix_shops_area_favorite_count"}),
+    ("export: since", menu_export_query(MENU_EXPORT_FIELDS, since=since), "menus",
+     {"ix_menus_updated_created"}),
+    ("export: shop_id", menu_export_query(MENU_EXPORT_FIELDS, shop_id=7), "menus",
+     {"ix_menus_shop_available_category"}),
+    ("export: departures since", menu_departure_query(since, area_id=3), "menu_departures",
+     {"ix_menu_departures_departed_at"}),
+    ("images: menus.image_url", select(func.count(Menu.id)).where(Menu.image_url == "/static/images/menu3-4.png"), "menus",
+     {"ix_menus_image_url"}),
+    ("images: shops.image_path", select(func.count(Shop.id)).where(Shop.image_path == "/static/images/shop3.png"), "shops",
+     {"ix_shops_image_path"}),
+    ("menu_favorites: menu_id", select(func.count()).select_from(MenuFavorites).where(MenuFavorites.menu_id == 42), "menu_favorites",
+     {"ix_menu_favorites_menu_id"}),
+    ("notifications: user_id + status", select(Notification.id).where(Notification.user_id == 3, Notification.status == "unread"), "notifications",
+     {"ix_notifications_user_status"}),
+    ("notifications: inbox page", pagination.order_by_keys(db.query(Notification).filter(Notification.user_id == 3), NOTIFICATION_SORT_KEYS).limit(21).statement, "notifications",
+     {"ix_notifications_user_created"}),
+  ]
+
+def explain(connection, statement, table: str):
+  """使われたインデックス名の集合と、実行計画の要約を返す"""
+  compiled = statement.compile(dialect=connection.dialect)
+  params = tuple(compiled.params[name] for name in compiled.positiontup) if compiled.positional else compiled.params
+  if connection.dialect.name == "mysql":
+    rows = connection.exec_driver_sql(f"EXPLAIN {compiled.string}", params).mappings().all()
+    rows = [row for row in rows if row["table"] == table]
+    return {row["key"] for row in rows if row["key"]}, "; ".join(f"type={row['type']} key={row['key']} rows={row['rows']}" for row in rows)
+  rows = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled.string}", params).all()
+  details = [row[-1] for row in rows]
+  keys = {match for detail in details for match in re.findall(r"INDEX (\w+)", detail)}
+  return keys, "; ".join(details)
+
+def main():
+  parser = argparse.ArgumentParser(description="クエリの実行計画のチェック")
+  parser.add_argument("--url", default="sqlite://", help="SQLAlchemy の接続 URL（デフォルト: SQLite メモリ）")
+  parser.add_argument("--shops", type=int, default=200)
+  parser.add_argument("--menus-per-shop", type=int, default=50)
+  parser.add_argument("--users", type=int, default=300)
+  args = parser.parse_args()
+
+  engine = create_engine(args.url)
+  Base.metadata.create_all(engine)
+  Session = sessionmaker(bind=engine)
+  seed(Session, args.shops, args.menus_per_shop, args.users)
+  with engine.begin() as connection:
+    # 統計情報を更新して、実データに近い条件でオプティマイザに選ばせる
+    for table in ("menus", "shops", "menu_favorites", "notifications"):
+      connection.execute(text(f"ANALYZE TABLE {table}" if engine.dialect.name == "mysql" else f"ANALYZE {table}"))
+
+  failures = 0
+  db = Session()
+  try:
+    with engine.connect() as connection:
+      for label, statement, table, expected in checks(db):
+        keys, plan = explain(connection, statement, table)
+        ok = bool(keys & expected)
+        failures += not ok
+        print(f"{'OK  ' if ok else 'FAIL'} {label:<42} {plan}")
+  finally:
+    db.close()
+
+  if failures:
+    print(f"\n{failures} 件のクエリで想定したインデックスが使われていません")
+    sys.exit(1)
+  print("\n全てのクエリで想定したインデックスが使われています")
+
+if __name__ == "__main__":
+  main()
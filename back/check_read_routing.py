@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+読み取りレプリカへの振り分けのチェックスクリプト
+
+プライマリとレプリカのスタンドイン（デフォルトは SQLite のファイル2つ）でアプリを組み立て、
+レプリケーションの遅れ（プライマリへの書き込みがレプリカに届いていない状態）を再現して次を確認する。
+- 未ログインの読み取りはレプリカ、書き込みはプライマリに届く
+- 書き込んだユーザー（Bearer トークン）の直後の読み取りはプライマリに届く（read-your-writes）
+- X-Read-Primary-Until ヘッダーを送り返したクライアントの読み取りもプライマリに届く
+- キャッシュするお気に入りの集合と詳細のレスポンスは、レプリカではなくプライマリから読み込む
+- READ_AFTER_WRITE_SECONDS を過ぎるとレプリカに戻る
+- ヘルスチェックに失敗したレプリカはラウンドロビンから外れる
+
+使い方:
+  python check_read_routing.py                                     # SQLite のファイル2つで実行
+  python check_read_routing.py --primary mysql+pymysql://... --replica mysql+pymysql://...
+                                                                   # レプリケーションしていない空の検証用 DB の組で実行
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from urllib.parse import urlencode
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+def parse_args():
+  parser = argparse.ArgumentParser(description="読み取りレプリカへの振り分けのチェック")
+  parser.add_argument("--primary", help="プライマリの SQLAlchemy の接続 URL（デフォルト: 一時ディレクトリの SQLite）")
+  parser.add_argument("--replica", help="レプリカの SQLAlchemy の接続 URL（デフォルト: 一時ディレクトリの SQLite）")
+  parser.add_argument("--read-after-write", type=float, default=1.0, help="READ_AFTER_WRITE_SECONDS")
+  return parser.parse_args()
+
+args = parse_args()
+workdir = tempfile.mkdtemp(prefix="read-routing-")
+primary_url = args.primary or f"sqlite:///{workdir}/primary.db"
+replica_url = args.replica or f"sqlite:///{workdir}/replica.db"
+# 2つ目のレプリカは接続できない URL にして、ヘルスチェックで外れることを確認する
+broken_url = f"sqlite:///{workdir}/missing/replica.db"
+
+# api を読み込む前に接続先を設定する
+os.environ["DATABASE_URL"] = primary_url
+os.environ["DATABASE_REPLICA_URLS"] = f"{replica_url},{broken_url}"
+os.environ["READ_AFTER_WRITE_SECONDS"] = str(args.read_after_write)
+os.environ.setdefault("SEARCH_BACKEND", "ngram")
+
+from sqlalchemy.orm import sessionmaker
+
+from api import database
+from api.auth import create_access_token
+from api.main import app
+from api.models import Area, Shop, ShopUsers
+from api.routing import PRIMARY_HEADER, replica_reads
+from api.schema import upgrade_database
+
+async def request(method: str, path: str, params=None, headers=None, body=None):
+  """アプリを ASGI で直接呼び出し、(ステータス, ヘッダー, JSON) を返す"""
+  payload = json.dumps(body).encode() if body is not None else b""
+  raw_headers = [(name.lower().encode(), str(value).encode()) for name, value in (headers or {}).items()]
+  if body is not None:
+    raw_headers.append((b"content-type", b"application/json"))
+  scope = {
+    "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": method, "scheme": "http",
+    "path": path, "raw_path": path.encode(), "root_path": "", "query_string": urlencode(params or {}).encode(),
+    "headers": raw_headers, "client": ("127.0.0.1", 50000), "server": ("testserver", 80),
+  }
+  messages = [{"type": "http.request", "body": payload, "more_body": False}]
+  response = {"headers": {}, "body": b""}
+
+  async def receive():
+    return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+  async def send(message):
+    if message["type"] == "http.response.start":
+      response["status"] = message["status"]
+      response["headers"] = {name.decode().lower(): value.decode() for name, value in message["headers"]}
+    elif message["type"] == "http.response.body":
+      response["body"] += message.get("body", b"")
+
+  await app(scope, receive, send)
+  return response["status"], response["headers"], json.loads(response["body"] or b"null")
+
+def seed(engine, with_shop_user: bool):
+  """両方に同じ初期データを入れる（店舗ユーザーは認証に使うプライマリだけ）"""
+  db = sessionmaker(bind=engine)()
+  try:
+    if db.get(Shop, 1) is None:
+      db.add(Area(id=1, name="Area 1"))
+      db.add(Shop(id=1, area_id=1, name="Shop 1"))
+      db.flush()
+    if with_shop_user and db.query(ShopUsers).filter(ShopUsers.username == "routing-check").first() is None:
+      db.add(ShopUsers(shop_id=1, username="routing-check", email="routing-check@example.com", password_hash="x"))
+    db.commit()
+  finally:
+    db.close()
+
+def reads(target: str) -> float:
+  return replica_reads.value(target=target)
+
+async def menu_names(headers=None):
+  status, _, body = await request("GET", "/menus/", {"shop_id": 1, "count": "none", "per_page": 100}, headers)
+  assert status == 200, body
+  return {item["name"] for item in body["items"]}
+
+async def run_checks():
+  results = []
+
+  def check(label: str, ok: bool, detail: str = ""):
+    results.append(ok)
+    print(f"{'OK  ' if ok else 'FAIL'} {label:<64} {detail}")
+
+  replica, broken = database.replicas.replicas
+  database.replicas.check()
+  check("health check: broken replica is taken out", replica.healthy and not broken.healthy,
+        f"{replica.name}={replica.healthy} {broken.name}={broken.healthy}")
+
+  token = create_access_token({"sub": "routing-check", "user_type": "shop_user"})
+  auth = {"Authorization": f"Bearer {token}"}
+  name = f"routing-check {time.time():.0f}"
+
+  before = reads(replica.name)
+  check("anonymous read goes to the replica", name not in await menu_names() and reads(replica.name) == before + 1)
+
+  status, headers, body = await request("POST", "/menus/", headers=auth, body={"shop_id": 1, "name": name, "price": 100})
+  check("write goes to the primary", status == 200 and PRIMARY_HEADER.lower() in headers, f"status={status}")
+
+  before = reads("primary")
+  check("writer's next read goes to the primary", name in await menu_names(auth) and reads("primary") == before + 1)
+  check("other clients still read the (lagging) replica", name not in await menu_names())
+  echoed = {PRIMARY_HEADER: headers.get(PRIMARY_HEADER.lower(), "0")}
+  check(f"client echoing {PRIMARY_HEADER} reads the primary", name in await menu_names(echoed))
+
+  # お気に入りの集合はキャッシュするため、ヘッダーを送り返さなくてもプライマリから読み込む
+  menu_id = body["id"]
+  status, _, _ = await request("POST", "/menu_favorites/", body={"user_id": 1, "menu_id": menu_id})
+  before = reads(replica.name) + reads("primary")
+  _, _, statuses = await request("GET", "/menu_favorites/status", {"user_id": 1, "menu_ids": menu_id})
+  check("favorite set is loaded from the primary", status == 200 and statuses["statuses"] == {str(menu_id): True})
+  check("favorite status does not check out a read session", reads(replica.name) + reads("primary") == before)
+  # 共有キャッシュに入る詳細のレスポンスも、書き込んでいないクライアントの読み取りでプライマリから読み込む
+  status, _, detail = await request("GET", f"/menus/{menu_id}")
+  check("cached menu detail is loaded from the primary", status == 200 and detail["name"] == name)
+
+  await asyncio.sleep(args.read_after_write + 0.2)
+  check("after READ_AFTER_WRITE_SECONDS the writer reads the replica again", name not in await menu_names(auth))
+  check("an expired header is ignored", name not in await menu_names(echoed))
+  return results
+
+def main():
+  upgrade_database(database.engine)
+  replica = database.replicas.replicas[0]
+  upgrade_database(replica.engine)
+  seed(database.engine, with_shop_user=True)
+  seed(replica.engine, with_shop_user=False)
+
+  results = asyncio.run(run_checks())
+  if not all(results):
+    print(f"\n{results.count(False)} 件の確認に失敗しました")
+    sys.exit(1)
+  print("\n全ての確認に成功しました")
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,51 @@
+"""Alembic の実行環境
+
+接続先は -x url=... があればそれを、なければ api/database.py の設定を使う。
+アプリの起動時（api/schema.py）は、呼び出し側の接続を config.attributes["connection"] で受け取る。
+"""
+from logging.config import fileConfig
+
+from alembic import context
+from sqlalchemy import create_engine
+
+from api.database import SQLALCHEMY_DATABASE_URL, Base
+# アプリが使う全モデルを Base.metadata に登録する（genre は未使用のため含めない）
+from api.models import favorites, menu_tombstone, notification, notification_broadcast, notification_shop, notification_users  # noqa: F401
+import api.models  # noqa: F401
+
+config = context.config
+if config.config_file_name is not None and config.attributes.get("connection") is None:
+  fileConfig(config.config_file_name, disable_existing_loggers=False)
+
+target_metadata = Base.metadata
+
+def database_url() -> str:
+  return context.get_x_argument(as_dictionary=True).get("url") or SQLALCHEMY_DATABASE_URL
+
+def run_migrations_offline() -> None:
+  """SQL を出力するだけ（alembic upgrade head --sql）"""
+  context.configure(url=database_url(), target_metadata=target_metadata, literal_binds=True)
+  with context.begin_transaction():
+    context.run_migrations()
+
+def run_migrations(connection) -> None:
+  context.configure(connection=connection, target_metadata=target_metadata, compare_type=True)
+  with context.begin_transaction():
+    context.run_migrations()
+
+def run_migrations_online() -> None:
+  connection = config.attributes.get("connection")
+  if connection is not None:
+    run_migrations(connection)
+    return
+  engine = create_engine(database_url())
+  try:
+    with engine.connect() as connection:
+      run_migrations(connection)
+  finally:
+    engine.dispose()
+
+if context.is_offline_mode():
+  run_migrations_offline()
+else:
+  run_migrations_online()
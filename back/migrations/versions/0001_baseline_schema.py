@@ -0,0 +1,208 @@
+"""baseline schema
+
+create_all で作成済みの DB にもそのまま適用できるよう、存在しないテーブルだけを作成する。
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18 14:33:26.456507
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0001'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+def upgrade() -> None:
+  tables = set(sa.inspect(op.get_bind()).get_table_names())
+  if 'areas' not in tables:
+    op.create_table('areas',
+      sa.Column('id', sa.Integer(), nullable=False),
+      sa.Column('name', sa.String(length=100), nullable=True),
+      sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_areas_id'), 'areas', ['id'], unique=False)
+  if 'image_variants' not in tables:
+    op.create_table('image_variants',
+      sa.Column('id', sa.Integer(), nullable=False),
+      sa.Column('source_url', sa.String(length=255), nullable=False),
+      sa.Column('size', sa.String(length=20), nullable=False),
+      sa.Column('format', sa.String(length=10), nullable=False),
+      sa.Column('url', sa.String(length=255), nullable=False),
+      sa.Column('width', sa.Integer(), nullable=False),
+      sa.Column('height', sa.Integer(), nullable=False),
+      sa.Column('bytes', sa.Integer(), nullable=False),
+      sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+      sa.PrimaryKeyConstraint('id'),
+      sa.UniqueConstraint('source_url', 'size', 'format', name='uq_image_variants_source_size_format')
+    )
+    op.create_index(op.f('ix_image_variants_id'), 'image_variants', ['id'], unique=False)
+    op.create_index(op.f('ix_image_variants_source_url'), 'image_variants', ['source_url'], unique=False)
+  if 'menu_tombstones' not in tables:
+    op.create_table('menu_tombstones',
+      sa.Column('menu_id', sa.Integer(), autoincrement=False, nullable=False),
+      sa.Column('shop_id', sa.Integer(), nullable=False),
+      sa.Column('deleted_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+      sa.PrimaryKeyConstraint('menu_id')
+    )
+    op.create_index(op.f('ix_menu_tombstones_deleted_at'), 'menu_tombstones', ['deleted_at'], unique=False)
+    op.create_index(op.f('ix_menu_tombstones_shop_id'), 'menu_tombstones', ['shop_id'], unique=False)
+  if 'users' not in tables:
+    op.create_table('users',
+      sa.Column('id', sa.Integer(), nullable=False),
+      sa.Column('username', sa.String(length=50), nullable=False),
+      sa.Column('address', sa.String(length=255), nullable=True),
+      sa.Column('email', sa.String(length=100), nullable=False),
+      sa.Column('password_hash', sa.String(length=255), nullable=False),
+      sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+      sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True),
+      sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_users_email'), 'users', ['email'], unique=True)
+    op.create_index(op.f('ix_users_id'), 'users', ['id'], unique=False)
+    op.create_index(op.f('ix_users_username'), 'users', ['username'], unique=True)
+  if 'shops' not in tables:
+    op.create_table('shops',
+      sa.Column('id', sa.Integer(), nullable=False),
+      sa.Column('area_id', sa.Integer(), nullable=False),
+      sa.Column('name', sa.String(length=100), nullable=False),
+      sa.Column('shop_detail', sa.Text(), nullable=True),
+      sa.Column('image_path', sa.String(length=255), nullable=True),
+      sa.Column('homepage_url', sa.String(length=255), nullable=True),
+      sa.Column('address', sa.String(length=255), nullable=True),
+      sa.Column('phone', sa.String(length=20), nullable=True),
+      sa.ForeignKeyConstraint(['area_id'], ['areas.id'], ),
+      sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_shops_id'), 'shops', ['id'], unique=False)
+  if 'favorites' not in tables:
+    op.create_table('favorites',
+      sa.Column('user_id', sa.Integer(), nullable=False),
+      sa.Column('shop_id', sa.Integer(), nullable=False),
+      sa.ForeignKeyConstraint(['shop_id'], ['shops.id'], ),
+      sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+      sa.PrimaryKeyConstraint('user_id', 'shop_id')
+    )
+  if 'menus' not in tables:
+    op.create_table('menus',
+      sa.Column('id', sa.Integer(), nullable=False),
+      sa.Column('shop_id', sa.Integer(), nullable=False),
+      sa.Column('genre_id', sa.Integer(), nullable=True),
+      sa.Column('name', sa.String(length=100), nullable=False),
+      sa.Column('description', sa.Text(), nullable=True),
+      sa.Column('price', sa.Float(), nullable=False),
+      sa.Column('category', sa.String(length=50), nullable=True),
+      sa.Column('tags', sa.JSON(), nullable=True),
+      sa.Column('image_url', sa.String(length=255), nullable=True),
+      sa.Column('is_available', sa.Boolean(), nullable=True),
+      sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+      sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True),
+      sa.ForeignKeyConstraint(['shop_id'], ['shops.id'], ),
+      sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_menus_category'), 'menus', ['category'], unique=False)
+    op.create_index(op.f('ix_menus_id'), 'menus', ['id'], unique=False)
+    op.create_index(op.f('ix_menus_name'), 'menus', ['name'], unique=False)
+  if 'shop_users' not in tables:
+    op.create_table('shop_users',
+      sa.Column('id', sa.Integer(), nullable=False),
+      sa.Column('shop_id', sa.Integer(), nullable=False),
+      sa.Column('username', sa.String(length=50), nullable=False),
+      sa.Column('email', sa.String(length=100), nullable=False),
+      sa.Column('password_hash', sa.String(length=255), nullable=False),
+      sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+      sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True),
+      sa.ForeignKeyConstraint(['shop_id'], ['shops.id'], ),
+      sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_shop_users_email'), 'shop_users', ['email'], unique=True)
+    op.create_index(op.f('ix_shop_users_id'), 'shop_users', ['id'], unique=False)
+    op.create_index(op.f('ix_shop_users_username'), 'shop_users', ['username'], unique=True)
+  if 'menu_favorites' not in tables:
+    op.create_table('menu_favorites',
+      sa.Column('user_id', sa.Integer(), nullable=False),
+      sa.Column('menu_id', sa.Integer(), nullable=False),
+      sa.ForeignKeyConstraint(['menu_id'], ['menus.id'], ),
+      sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+      sa.PrimaryKeyConstraint('user_id', 'menu_id')
+    )
+  if 'menu_search' not in tables:
+    op.create_table('menu_search',
+      sa.Column('menu_id', sa.Integer(), nullable=False),
+      sa.Column('document', sa.Text(), nullable=False),
+      sa.ForeignKeyConstraint(['menu_id'], ['menus.id'], ondelete='CASCADE'),
+      sa.PrimaryKeyConstraint('menu_id')
+    )
+    op.create_index('ft_menu_search_document', 'menu_search', ['document'], unique=False, mysql_prefix='FULLTEXT', mysql_with_parser='ngram')
+  if 'notifications' not in tables:
+    op.create_table('notifications',
+      sa.Column('id', sa.Integer(), nullable=False),
+      sa.Column('user_id', sa.Integer(), nullable=False),
+      sa.Column('shop_id', sa.Integer(), nullable=True),
+      sa.Column('shop_user_id', sa.Integer(), nullable=True),
+      sa.Column('contents', sa.String(length=255), nullable=False),
+      sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+      sa.Column('status', sa.String(length=255), nullable=True),
+      sa.ForeignKeyConstraint(['shop_id'], ['shops.id'], ),
+      sa.ForeignKeyConstraint(['shop_user_id'], ['shop_users.id'], ),
+      sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+      sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_notifications_id'), 'notifications', ['id'], unique=False)
+  if 'notification__shop' not in tables:
+    op.create_table('notification__shop',
+      sa.Column('id', sa.Integer(), nullable=False),
+      sa.Column('notifications_id', sa.Integer(), nullable=False),
+      sa.Column('shop_id', sa.Integer(), nullable=False),
+      sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+      sa.ForeignKeyConstraint(['notifications_id'], ['notifications.id'], ondelete='CASCADE'),
+      sa.ForeignKeyConstraint(['shop_id'], ['shops.id'], ondelete='CASCADE'),
+      sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_notification__shop_id'), 'notification__shop', ['id'], unique=False)
+  if 'notification__users' not in tables:
+    op.create_table('notification__users',
+      sa.Column('id', sa.Integer(), nullable=False),
+      sa.Column('notification_id', sa.Integer(), nullable=False),
+      sa.Column('user_id', sa.Integer(), nullable=False),
+      sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+      sa.ForeignKeyConstraint(['notification_id'], ['notifications.id'], ondelete='CASCADE'),
+      sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+      sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_notification__users_id'), 'notification__users', ['id'], unique=False)
+
+def downgrade() -> None:
+  op.drop_index(op.f('ix_notification__users_id'), table_name='notification__users')
+  op.drop_table('notification__users')
+  op.drop_index(op.f('ix_notification__shop_id'), table_name='notification__shop')
+  op.drop_table('notification__shop')
+  op.drop_index(op.f('ix_notifications_id'), table_name='notifications')
+  op.drop_table('notifications')
+  op.drop_index('ft_menu_search_document', table_name='menu_search', mysql_prefix='FULLTEXT', mysql_with_parser='ngram')
+  op.drop_table('menu_search')
+  op.drop_table('menu_favorites')
+  op.drop_index(op.f('ix_shop_users_username'), table_name='shop_users')
+  op.drop_index(op.f('ix_shop_users_id'), table_name='shop_users')
+  op.drop_index(op.f('ix_shop_users_email'), table_name='shop_users')
+  op.drop_table('shop_users')
+  op.drop_index(op.f('ix_menus_name'), table_name='menus')
+  op.drop_index(op.f('ix_menus_id'), table_name='menus')
+  op.drop_index(op.f('ix_menus_category'), table_name='menus')
+  op.drop_table('menus')
+  op.drop_table('favorites')
+  op.drop_index(op.f('ix_shops_id'), table_name='shops')
+  op.drop_table('shops')
+  op.drop_index(op.f('ix_users_username'), table_name='users')
+  op.drop_index(op.f('ix_users_id'), table_name='users')
+  op.drop_index(op.f('ix_users_email'), table_name='users')
+  op.drop_table('users')
+  op.drop_index(op.f('ix_menu_tombstones_shop_id'), table_name='menu_tombstones')
+  op.drop_index(op.f('ix_menu_tombstones_deleted_at'), table_name='menu_tombstones')
+  op.drop_table('menu_tombstones')
+  op.drop_index(op.f('ix_image_variants_source_url'), table_name='image_variants')
+  op.drop_index(op.f('ix_image_variants_id'), table_name='image_variants')
+  op.drop_table('image_variants')
+  op.drop_index(op.f('ix_areas_id'), table_name='areas')
+  op.drop_table('areas')
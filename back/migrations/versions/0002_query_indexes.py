@@ -0,0 +1,42 @@
+"""query indexes
+
+一覧・書き出し・画像の参照数・お気に入り・通知のクエリに合わせたインデックスを追加する。
+create_all で作成したばかりのテーブルには既にあるため、存在しないものだけを作成する。
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 14:33:56.005317
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+  ('ix_menus_shop_available_category', 'menus', ['shop_id', 'is_available', 'category']),
+  ('ix_menus_available_category', 'menus', ['is_available', 'category']),
+  ('ix_menus_available_created', 'menus', ['is_available', 'created_at']),
+  ('ix_menus_available_price', 'menus', ['is_available', 'price']),
+  ('ix_menus_updated_created', 'menus', ['updated_at', 'created_at']),
+  ('ix_menus_image_url', 'menus', ['image_url']),
+  ('ix_shops_image_path', 'shops', ['image_path']),
+  ('ix_menu_favorites_menu_id', 'menu_favorites', ['menu_id']),
+  ('ix_favorites_shop_id', 'favorites', ['shop_id']),
+  ('ix_notifications_user_status', 'notifications', ['user_id', 'status']),
+]
+
+def _existing_indexes(table: str) -> set:
+  return {index['name'] for index in sa.inspect(op.get_bind()).get_indexes(table)}
+
+def upgrade() -> None:
+  for name, table, columns in INDEXES:
+    if name not in _existing_indexes(table):
+      op.create_index(name, table, columns, unique=False)
+
+def downgrade() -> None:
+  for name, table, _ in reversed(INDEXES):
+    if name in _existing_indexes(table):
+      op.drop_index(name, table_name=table)
@@ -0,0 +1,26 @@
+"""notification inbox index
+
+通知の受信箱をユーザーごとに新しい順（created_at, id）で読むためのインデックスを追加する。
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 16:02:41.218734
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+def _existing_indexes(table: str) -> set:
+  return {index['name'] for index in sa.inspect(op.get_bind()).get_indexes(table)}
+
+def upgrade() -> None:
+  if 'ix_notifications_user_created' not in _existing_indexes('notifications'):
+    op.create_index('ix_notifications_user_created', 'notifications', ['user_id', 'created_at', 'id'], unique=False)
+
+def downgrade() -> None:
+  if 'ix_notifications_user_created' in _existing_indexes('notifications'):
+    op.drop_index('ix_notifications_user_created', table_name='notifications')
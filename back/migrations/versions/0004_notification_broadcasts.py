@@ -0,0 +1,44 @@
+"""notification broadcasts
+
+店舗からのお知らせの一斉配信のジョブと進捗を記録するテーブルを追加する。
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 17:11:05.482913
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+def upgrade() -> None:
+  if 'notification_broadcasts' in sa.inspect(op.get_bind()).get_table_names():
+    return
+  op.create_table('notification_broadcasts',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('shop_id', sa.Integer(), nullable=False),
+    sa.Column('shop_user_id', sa.Integer(), nullable=True),
+    sa.Column('contents', sa.String(length=255), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('total', sa.Integer(), nullable=True),
+    sa.Column('delivered', sa.Integer(), nullable=False),
+    sa.Column('last_user_id', sa.Integer(), nullable=False),
+    sa.Column('worker', sa.String(length=64), nullable=True),
+    sa.Column('heartbeat_at', sa.DateTime(), nullable=True),
+    sa.Column('error', sa.String(length=255), nullable=True),
+    sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=True),
+    sa.Column('finished_at', sa.DateTime(timezone=True), nullable=True),
+    sa.ForeignKeyConstraint(['shop_id'], ['shops.id'], ),
+    sa.ForeignKeyConstraint(['shop_user_id'], ['shop_users.id'], ),
+    sa.PrimaryKeyConstraint('id')
+  )
+  op.create_index('ix_notification_broadcasts_shop_id', 'notification_broadcasts', ['shop_id'], unique=False)
+  op.create_index('ix_notification_broadcasts_status', 'notification_broadcasts', ['status'], unique=False)
+
+def downgrade() -> None:
+  op.drop_index('ix_notification_broadcasts_status', table_name='notification_broadcasts')
+  op.drop_index('ix_notification_broadcasts_shop_id', table_name='notification_broadcasts')
+  op.drop_table('notification_broadcasts')
@@ -0,0 +1,51 @@
+"""favorite counts
+
+メニュー・店舗にお気に入りの数（favorite_count）を追加し、既存のお気に入りから1回だけ集計して埋める。
+以降はお気に入りの追加・削除と同じトランザクションで増減する。
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18 19:24:37.605118
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+  ('ix_menus_available_favorites', 'menus', ['is_available', 'favorite_count']),
+  ('ix_shops_favorite_count', 'shops', ['favorite_count']),
+  ('ix_shops_area_favorite_count', 'shops', ['area_id', 'favorite_count']),
+]
+
+# 追加したテーブルと、お気に入り数を集計する元のテーブル・列
+COUNTED_TABLES = [
+  ('menus', 'menu_favorites', 'menu_id'),
+  ('shops', 'favorites', 'shop_id'),
+]
+
+def upgrade() -> None:
+  inspector = sa.inspect(op.get_bind())
+  for table, favorites_table, foreign_key in COUNTED_TABLES:
+    if 'favorite_count' in {column['name'] for column in inspector.get_columns(table)}:
+      continue
+    op.add_column(table, sa.Column('favorite_count', sa.Integer(), server_default='0', nullable=False))
+    op.execute(
+      f'UPDATE {table} SET favorite_count = '
+      f'(SELECT COUNT(*) FROM {favorites_table} WHERE {favorites_table}.{foreign_key} = {table}.id)'
+    )
+  for name, table, columns in INDEXES:
+    if name not in {index['name'] for index in inspector.get_indexes(table)}:
+      op.create_index(name, table, columns, unique=False)
+
+def downgrade() -> None:
+  inspector = sa.inspect(op.get_bind())
+  for name, table, _ in INDEXES:
+    if name in {index['name'] for index in inspector.get_indexes(table)}:
+      op.drop_index(name, table_name=table)
+  for table, _, _ in COUNTED_TABLES:
+    if 'favorite_count' in {column['name'] for column in inspector.get_columns(table)}:
+      op.drop_column(table, 'favorite_count')
@@ -0,0 +1,29 @@
+"""catalog versions
+
+一覧の版を記録するテーブルを追加する。
+GET /menus/ の ETag は、メニュー全体を集計する代わりにこの行を主キーで1件読む。
+版はメニューの書き込みと同じトランザクションで進める。
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18 21:02:13.118406
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+def upgrade() -> None:
+  if 'catalog_versions' in sa.inspect(op.get_bind()).get_table_names():
+    return
+  op.create_table('catalog_versions',
+    sa.Column('scope', sa.String(length=64), nullable=False),
+    sa.Column('version', sa.Integer(), server_default='0', nullable=False),
+    sa.PrimaryKeyConstraint('scope')
+  )
+
+def downgrade() -> None:
+  op.drop_table('catalog_versions')
@@ -0,0 +1,34 @@
+"""menu departures
+
+店舗・エリア・カテゴリーの変更で絞り込みの条件から外れたメニューを記録するテーブルを追加する。
+GET /menus/export?changes=true を絞り込んだ場合に、外れたメニューを削除の行として返す。
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18 22:40:51.370215
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = '0007'
+down_revision = '0006'
+branch_labels = None
+depends_on = None
+
+def upgrade() -> None:
+  if 'menu_departures' in sa.inspect(op.get_bind()).get_table_names():
+    return
+  op.create_table('menu_departures',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('menu_id', sa.Integer(), nullable=False),
+    sa.Column('shop_id', sa.Integer(), nullable=False),
+    sa.Column('area_id', sa.Integer(), nullable=True),
+    sa.Column('category', sa.String(length=50), nullable=True),
+    sa.Column('departed_at', sa.DateTime(timezone=True), server_default=sa.func.now(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+  )
+  op.create_index('ix_menu_departures_departed_at', 'menu_departures', ['departed_at'], unique=False)
+
+def downgrade() -> None:
+  op.drop_index('ix_menu_departures_departed_at', table_name='menu_departures')
+  op.drop_table('menu_departures')